@@ -0,0 +1,209 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+
+# Admission control: bound how many requests run at once, so that during a
+# surge the requests that are admitted still finish quickly instead of all of
+# them queueing in the threadpool together.
+#
+# Every request is admitted by one gate: the route's own gate when it has one
+# (ADMISSION_ROUTE_LIMITS), otherwise the read gate (GET, HEAD) or the write
+# gate. A gate runs up to `limit` requests at once and lets up to `queue`
+# more wait, first come first served, for at most `timeout` seconds. A
+# request that finds the queue full, or is still waiting at the timeout, is
+# answered at once with 503 and Retry-After without running the handler.
+# Reads and writes have separate budgets, so a flood of attempt submissions
+# cannot starve the browse screens, and heavy routes (bulk import, export)
+# get small gates of their own.
+#
+# Gates live on the event loop and are only touched from it, so they need no
+# locks. The limits are per server process.
+
+# Always admitted: health checks and metrics must answer during overload
+EXEMPT_PATHS = ('/health', '/metrics')
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Gate:
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue:
+            self.shed += 1
+            raise Overloaded(f"{self.name}: too many requests waiting")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait((waiter,), timeout=self.timeout)
+        except BaseException:
+            # The client went away while waiting; give back a slot handed over meanwhile
+            if waiter.done():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self.timed_out += 1
+            raise Overloaded(f"{self.name}: no slot within {self.timeout:g}s")
+        # release() passed its slot on to this request; active is unchanged
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "queued": len(self._waiters),
+                "admitted": self.admitted, "shed": self.shed, "timed_out": self.timed_out}
+
+
+# "POST /attempts/=256:1024,GET /attempts/export=2:2" -> {(method, path): (limit, queue)}
+def parse_route_limits(text):
+    limits = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        route, _, budget = item.rpartition('=')
+        method, _, path = route.strip().partition(' ')
+        limit, _, queue = budget.partition(':')
+        limits[(method.upper(), path.strip())] = (int(limit), int(queue or 0))
+    return limits
+
+
+class AdmissionController:
+    # A limit of 0 turns the corresponding gate off
+
+    def __init__(self, read_limit, read_queue, write_limit, write_queue, timeout, retry_after, route_limits=None):
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.read = Gate('read', read_limit, read_queue, timeout) if read_limit > 0 else None
+        self.write = Gate('write', write_limit, write_queue, timeout) if write_limit > 0 else None
+        self.route_gates = {
+            key: Gate(f"{key[0]} {key[1]}", limit, queue, timeout)
+            for key, (limit, queue) in (route_limits or {}).items() if limit > 0
+        }
+        self._routes = None   # [(method, route, gate)], resolved against the app's routes on first use
+
+    def _route_gate(self, scope, router):
+        if self._routes is None:
+            self._routes = [
+                (method, route, self.route_gates[(method, route.path)])
+                for route in router.routes
+                for method in getattr(route, 'methods', None) or ()
+                if (method, getattr(route, 'path', None)) in self.route_gates
+            ]
+        for method, route, gate in self._routes:
+            if method == scope['method'] and route.matches(scope)[0] == Match.FULL:
+                return gate
+        return None
+
+    def gate_for(self, scope, router):
+        if scope['path'] in EXEMPT_PATHS:
+            return None
+        gate = self._route_gate(scope, router) if self.route_gates else None
+        if gate is None:
+            gate = self.read if scope['method'] in READ_METHODS else self.write
+        return gate
+
+    def stats(self):
+        gates = [gate for gate in (self.read, self.write) if gate is not None] + list(self.route_gates.values())
+        return {gate.name: gate.stats() for gate in gates}
+
+
+class AdmissionMiddleware:
+    # Pure ASGI middleware; the slot is held until the response's last chunk
+    # is sent. `router` is the app's router, whose routes are looked up on the
+    # first request, after every route is registered.
+
+    def __init__(self, app, controller, router):
+        self.app = app
+        self.controller = controller
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        gate = self.controller.gate_for(scope, self.router)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await gate.acquire()
+        except Overloaded as exc:
+            response = JSONResponse(status_code=503, content={"detail": f"Server overloaded ({exc})"},
+                                    headers={"Retry-After": str(self.controller.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+
+class TokenBuckets:
+    # Per-key token buckets: each key may make `burst` requests at once and
+    # `rate` per second on average. Idle keys are forgotten LRU-first beyond
+    # `max_keys`; a forgotten key starts again with a full bucket.
+
+    def __init__(self, rate, burst, max_keys):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, updated at)
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    # Take a token for `key`, or raise 429 with the seconds until one is available
+    def take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if not allowed:
+            retry_after = max(1, math.ceil((1 - tokens) / self.rate))
+            raise HTTPException(status_code=429, detail="Too many attempts; slow down",
+                                headers={"Retry-After": str(retry_after)})
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._buckets), "limited": self.limited}
@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from archive import archived_answers
+from grading import UNANSWERED, decode_answers
+
+# Classical item analysis of every question of a quiz: difficulty (p-value,
+# the share of attempts answering it correctly), discrimination (point-biserial
+# correlation of the item with the total score, and the corrected item-rest
+# correlation that leaves the item out of the total) and how often each
+# choice was picked, with the mean total score of the attempts picking it.
+#
+# Attempts are read in batches into an N x Q uint8 response matrix, one answer
+# byte per question exactly as they are stored, and each batch is folded
+# into per-quiz sufficient statistics with a handful of NumPy reductions:
+#
+#   n         attempts seen
+#   correct   per question, attempts answering it correctly      sum(x)
+#   cross     per question, total score of those attempts        sum(x * T)
+#   total     sum of total scores, and sum of their squares      sum(T), sum(T^2)
+#   counts    per question and answer byte, attempts picking it
+#   scores    per question and answer byte, their total scores
+#
+# Every statistic above is a sum over attempts, so new attempts are folded in
+# by reading only the rows after the last attempt id seen (attempt ids only
+# grow), and the correlations follow from the sums without revisiting a row.
+# The statistics depend on the answer key; when the key changes they are
+# rebuilt from all attempts, archived ones included.
+
+CHOICE_BINS = 256
+
+
+class QuizItemStats:
+    def __init__(self, key):
+        self.key = key
+        questions = len(key)
+        self.key_vector = np.frombuffer(key.packed, dtype=np.uint8)
+        self.last_id = 0
+        self.n = 0
+        self.correct = np.zeros(questions, dtype=np.int64)
+        self.cross = np.zeros(questions, dtype=np.int64)
+        self.total_sum = 0
+        self.total_squares = 0
+        self.counts = np.zeros((questions, CHOICE_BINS), dtype=np.int64)
+        self.scores = np.zeros((questions, CHOICE_BINS), dtype=np.int64)
+        # Flat bin offset of each question's row in counts/scores
+        self._offsets = np.arange(questions, dtype=np.int64) * CHOICE_BINS
+        self.updated_at = None
+
+    def matches(self, key):
+        return self.key.question_ids == key.question_ids and self.key.packed == key.packed
+
+    # Stack a batch of stored answers into the response matrix: one row per
+    # attempt, answers past the last question dropped, missing ones UNANSWERED.
+    # Answers are stored packed, so the attempts with exactly one answer per
+    # question are copied in with a single buffer join; only the others (an
+    # attempt from before a question was added or removed, or one archived
+    # as text) are decoded one by one.
+    def response_matrix(self, answers):
+        questions = len(self.key)
+        matrix = np.full((len(answers), questions), UNANSWERED, dtype=np.uint8)
+        regular = [isinstance(value, bytes) and len(value) == questions for value in answers]
+        rows = [row for row, is_regular in enumerate(regular) if is_regular]
+        if rows:
+            data = b''.join([answers[row] for row in rows])
+            matrix[rows] = np.frombuffer(data, dtype=np.uint8).reshape(len(rows), questions)
+        if len(rows) < len(answers):
+            for row, is_regular in enumerate(regular):
+                if not is_regular:
+                    packed = decode_answers(answers[row])[:questions]
+                    matrix[row, :len(packed)] = np.frombuffer(packed, dtype=np.uint8)
+        return matrix
+
+    def add(self, rows):
+        if not rows:
+            return
+        self.n += len(rows)
+        self.last_id = max(self.last_id, rows[-1][0])
+        if not len(self.key):
+            return
+        matrix = self.response_matrix([answers for _, answers in rows])
+        correct = matrix == self.key_vector
+        totals = correct.sum(axis=1, dtype=np.int64)
+        self.correct += correct.sum(axis=0, dtype=np.int64)
+        self.cross += totals @ correct.astype(np.int64)
+        self.total_sum += int(totals.sum())
+        self.total_squares += int((totals * totals).sum())
+        bins = (matrix + self._offsets).ravel()
+        size = self.counts.size
+        self.counts += np.bincount(bins, minlength=size).reshape(self.counts.shape)
+        self.scores += np.bincount(
+            bins, weights=np.repeat(totals, matrix.shape[1]), minlength=size
+        ).astype(np.int64).reshape(self.scores.shape)
+
+    # Statistics of the question in column `index` of the response matrix
+    def item(self, index, choice_labels):
+        n = self.n
+        correct = int(self.correct[index])
+        counts = self.counts[index]
+        scores = self.scores[index]
+        key = int(self.key_vector[index])
+        labels = list(choice_labels)
+        choices = []
+        for choice in range(max(len(labels), int(np.flatnonzero(counts[:UNANSWERED]).max(initial=-1)) + 1)):
+            count = int(counts[choice])
+            choices.append({
+                "choice": choice,
+                "label": labels[choice] if choice < len(labels) else None,
+                "correct": choice == key,
+                "count": count,
+                "proportion": count / n if n else None,
+                "mean_total_score": int(scores[choice]) / count if count else None,
+            })
+        unanswered = int(counts[UNANSWERED])
+        return {
+            "attempts": n,
+            "answered": n - unanswered,
+            "unanswered": unanswered,
+            "p_value": correct / n if n else None,
+            "point_biserial": _correlation(n, correct, correct, self.total_sum, self.total_squares,
+                                           int(self.cross[index])),
+            "corrected_point_biserial": _correlation(
+                n, correct, correct,
+                self.total_sum - correct,
+                self.total_squares - 2 * int(self.cross[index]) + correct,
+                int(self.cross[index]) - correct,
+            ),
+            "choices": choices,
+        }
+
+
+# Pearson correlation of a 0/1 item x with a score y from their sums:
+# n, sum(x), sum(x^2), sum(y), sum(y^2), sum(x * y). For the corrected
+# correlation y is the rest score T - x, whose sums follow from those of T.
+def _correlation(n, sum_x, sum_xx, sum_y, sum_yy, sum_xy):
+    variance_x = n * sum_xx - sum_x * sum_x
+    variance_y = n * sum_yy - sum_y * sum_y
+    if n < 2 or variance_x <= 0 or variance_y <= 0:
+        return None
+    return (n * sum_xy - sum_x * sum_y) / (variance_x * variance_y) ** 0.5
+
+
+class ItemAnalysisCache:
+    # LRU of per-quiz item statistics. Each quiz maps onto one of a fixed set
+    # of locks, so one request reads the quiz's new attempts while concurrent
+    # requests for the same quiz wait for the result instead of reading them
+    # again. The set never grows or changes, however many quizzes come and go.
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, max_entries, batch_size):
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self._entries = OrderedDict()
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.updates = 0
+        self.rows_read = 0
+
+    def _quiz_lock(self, quiz_id):
+        return self._locks[quiz_id % self.LOCK_STRIPES]
+
+    # Item statistics of the questions in columns `indexes` (all by default)
+    # of the quiz graded against `key`, after folding in the attempts committed
+    # since the quiz was last read. `choice_labels[i]` names question i's choices.
+    # Computed under the quiz's lock, so never from a half-applied batch.
+    def analyze(self, connection, key, choice_labels, indexes=None):
+        quiz_id = key.quiz_id
+        with self._quiz_lock(quiz_id):
+            with self._lock:
+                entry = self._entries.get(quiz_id)
+            if entry is None or not entry.matches(key):
+                entry = self._build(connection, key)
+                with self._lock:
+                    self.builds += 1
+            else:
+                self._read(connection, entry, archived=False)
+                with self._lock:
+                    self.updates += 1
+            with self._lock:
+                self._entries[quiz_id] = entry
+                self._entries.move_to_end(quiz_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            if indexes is None:
+                indexes = range(len(key))
+            summary = {"attempts": entry.n, "last_attempt_id": entry.last_id, "updated_at": entry.updated_at}
+            return [entry.item(index, choice_labels[index]) for index in indexes], summary
+
+    def _build(self, connection, key):
+        entry = QuizItemStats(key)
+        self._read(connection, entry, archived=True)
+        return entry
+
+    def _read(self, connection, entry, archived):
+        read = 0
+        if archived:
+            for rows in archived_answers(connection, entry.key.quiz_id, self.batch_size):
+                entry.add(rows)
+                read += len(rows)
+            # Archived ids are all older than the hot ones; start the hot read over
+            entry.last_id = 0
+        cursor = connection.execute(
+            "SELECT id, answers FROM attempts WHERE quiz_id = ? AND id > ? ORDER BY id",
+            (entry.key.quiz_id, entry.last_id)
+        )
+        try:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                entry.add(rows)
+                read += len(rows)
+        finally:
+            cursor.close()
+        entry.updated_at = int(time.time())
+        with self._lock:
+            self.rows_read += read
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            self._entries.pop(quiz_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "builds": self.builds,
+                    "updates": self.updates, "rows_read": self.rows_read}
@@ -0,0 +1,385 @@
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import settings
+from db_pool import retry_on_busy
+
+# Hot/cold partitioning of the attempts table.
+#
+# Attempts older than ARCHIVE_AFTER_DAYS are moved, oldest first, into one
+# archive database per calendar month of their created_at (UTC), e.g.
+# archives/attempts_2026_10.sqlite3, attached to the archiving connection with
+# ATTACH DATABASE. Each batch is three short transactions, so the write lock
+# is never held for long and a crash at any point loses nothing:
+#
+#   1. copy the batch into the archive (INSERT OR REPLACE, so a repeat is harmless)
+#   2. delete it from the hot table, and fold the rows that were actually
+#      deleted into archived_score_counts / archived_leaderboard and the
+#      attempt_archives catalogue, all in the main database
+#   3. re-copy the few rows, if any, that changed between 1 and 2
+#
+# A crash between 1 and 2 leaves rows in both places; reads check the hot
+# table first and the next run finishes the move. Archived attempts keep the
+# score they had when they were archived; regrading only touches hot rows.
+
+ARCHIVE_ALIAS = 'archive'
+LOOKUP_ALIAS = 'archive_lookup'
+
+# Archives written before answers were packed hold them as "1,0,2" text;
+# readers decode both forms with grading.decode_answers
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS {alias}.attempts (
+        id INTEGER PRIMARY KEY,
+        quiz_id INTEGER,
+        user_id INTEGER,
+        answers BLOB NOT NULL,
+        score INTEGER,
+        created_at INTEGER)''',
+    "CREATE INDEX IF NOT EXISTS {alias}.idx_attempts_quiz_id ON attempts (quiz_id)",
+)
+
+ATTEMPT_COLUMNS = 'id, quiz_id, user_id, answers, score, created_at'
+
+
+def archive_path(period):
+    return os.path.join(settings.ARCHIVE_DIR, f"attempts_{period}.sqlite3")
+
+
+# The archive period (YYYY_MM) a timestamp falls in, and when that period ends
+def period_bounds(timestamp):
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start.strftime('%Y_%m'), int(end.timestamp())
+
+
+def _attach(connection, path, alias):
+    connection.execute("ATTACH DATABASE ? AS " + alias, (path,))
+
+
+def _detach(connection, alias):
+    connection.execute("DETACH DATABASE " + alias)
+
+
+# Runs inside the caller's transaction; archives written before the quiz_id
+# index existed get it the next time they are written to
+def _create_schema(connection, alias):
+    for statement in ARCHIVE_SCHEMA:
+        connection.execute(statement.format(alias=alias))
+
+
+# Move up to `batch_size` of the oldest attempts created before `cutoff` (unix
+# seconds) into their archive. Returns the number of rows moved.
+def archive_batch(connection, cutoff, batch_size):
+    oldest = connection.execute("SELECT min(created_at) FROM attempts WHERE created_at < ?", (cutoff,)).fetchone()[0]
+    if oldest is None:
+        return 0
+    period, period_end = period_bounds(oldest)
+    rows = connection.execute(
+        f"SELECT {ATTEMPT_COLUMNS} FROM attempts WHERE created_at < ? ORDER BY created_at LIMIT ?",
+        (min(cutoff, period_end), batch_size)
+    ).fetchall()
+    if not rows:
+        return 0
+
+    os.makedirs(settings.ARCHIVE_DIR, exist_ok=True)
+    _attach(connection, archive_path(period), ARCHIVE_ALIAS)
+    try:
+        def copy(batch):
+            with connection:
+                _create_schema(connection, ARCHIVE_ALIAS)
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO {ARCHIVE_ALIAS}.attempts ({ATTEMPT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+
+        retry_on_busy(lambda: copy(rows))
+        deleted = retry_on_busy(lambda: _delete_archived(connection, period, [row[0] for row in rows]))
+        copied = set(rows)
+        changed = [row for row in deleted if row not in copied]
+        if changed:
+            retry_on_busy(lambda: copy(changed))
+    finally:
+        _detach(connection, ARCHIVE_ALIAS)
+    return len(deleted)
+
+
+def _delete_archived(connection, period, ids):
+    placeholders = ','.join('?' * len(ids))
+    with connection:
+        deleted = connection.execute(
+            f"DELETE FROM attempts WHERE id IN ({placeholders}) RETURNING {ATTEMPT_COLUMNS}", ids
+        ).fetchall()
+        if not deleted:
+            return deleted
+        scored = [row for row in deleted if row[4] is not None]
+        counts = Counter((row[1], row[4]) for row in scored)
+        connection.executemany(
+            '''INSERT INTO archived_score_counts (quiz_id, score, attempt_count) VALUES (?, ?, ?)
+               ON CONFLICT (quiz_id, score) DO UPDATE SET attempt_count = attempt_count + excluded.attempt_count''',
+            [(quiz_id, score, count) for (quiz_id, score), count in counts.items()]
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO archived_leaderboard (quiz_id, attempt_id, user_id, score) VALUES (?, ?, ?, ?)",
+            [(row[1], row[0], row[2], row[4]) for row in scored]
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO archived_user_quizzes (quiz_id, user_id) VALUES (?, ?)",
+            {(row[1], row[2]) for row in deleted if row[1] is not None and row[2] is not None}
+        )
+        for quiz_id in {row[1] for row in scored}:
+            connection.execute(
+                '''DELETE FROM archived_leaderboard WHERE quiz_id = ? AND attempt_id IN (
+                       SELECT attempt_id FROM archived_leaderboard WHERE quiz_id = ?
+                       ORDER BY score DESC, attempt_id LIMIT -1 OFFSET ?)''',
+                (quiz_id, quiz_id, settings.LEADERBOARD_SIZE)
+            )
+        ids = [row[0] for row in deleted]
+        connection.execute(
+            '''INSERT INTO attempt_archives (period, min_id, max_id, row_count, updated_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (period) DO UPDATE SET
+                   min_id = min(min_id, excluded.min_id),
+                   max_id = max(max_id, excluded.max_id),
+                   row_count = row_count + excluded.row_count,
+                   updated_at = excluded.updated_at''',
+            (period, min(ids), max(ids), len(ids), int(time.time()))
+        )
+    return deleted
+
+
+# Look an attempt up in the archives whose id range covers it. The archive is
+# attached only for the lookup, so a connection never holds more attached
+# databases than SQLite allows, however many months have been archived.
+def find_archived_attempt(connection, attempt_id):
+    periods = connection.execute(
+        "SELECT period FROM attempt_archives WHERE min_id <= ? AND max_id >= ? ORDER BY period DESC",
+        (attempt_id, attempt_id)
+    ).fetchall()
+    for (period,) in periods:
+        path = archive_path(period)
+        if not os.path.exists(path):
+            continue
+        _attach(connection, path, LOOKUP_ALIAS)
+        try:
+            row = connection.execute(
+                f"SELECT id, quiz_id, user_id, answers, score FROM {LOOKUP_ALIAS}.attempts WHERE id = ?",
+                (attempt_id,)
+            ).fetchone()
+        finally:
+            _detach(connection, LOOKUP_ALIAS)
+        if row is not None:
+            return row
+    return None
+
+
+# Yield a quiz's archived attempts as batches of (id, answers), oldest archive
+# first, leaving out rows a crashed move left in both places
+def archived_answers(connection, quiz_id, batch_size):
+    for (period,) in connection.execute("SELECT period FROM attempt_archives ORDER BY period").fetchall():
+        path = archive_path(period)
+        if not os.path.exists(path):
+            continue
+        _attach(connection, path, LOOKUP_ALIAS)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f'''SELECT id, answers FROM {LOOKUP_ALIAS}.attempts
+                    WHERE quiz_id = ? AND id NOT IN (SELECT id FROM main.attempts WHERE quiz_id = ?)
+                    ORDER BY id''',
+                (quiz_id, quiz_id)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            _detach(connection, LOOKUP_ALIAS)
+
+
+# Remove a deleted quiz's attempts from every archive, and what they
+# contributed to the archived aggregates. Returns the number of rows removed.
+def delete_archived_quiz(connection, quiz_id):
+    removed = 0
+    for (period,) in connection.execute("SELECT period FROM attempt_archives ORDER BY period").fetchall():
+        path = archive_path(period)
+        if not os.path.exists(path):
+            continue
+        _attach(connection, path, LOOKUP_ALIAS)
+        try:
+            def delete():
+                with connection:
+                    _create_schema(connection, LOOKUP_ALIAS)
+                    count = connection.execute(
+                        f"DELETE FROM {LOOKUP_ALIAS}.attempts WHERE quiz_id = ?", (quiz_id,)
+                    ).rowcount
+                    connection.execute(
+                        "UPDATE attempt_archives SET row_count = row_count - ?, updated_at = ? WHERE period = ?",
+                        (count, int(time.time()), period)
+                    )
+                return count
+            removed += retry_on_busy(delete)
+        finally:
+            _detach(connection, LOOKUP_ALIAS)
+
+    def clear_aggregates():
+        with connection:
+            connection.execute("DELETE FROM archived_score_counts WHERE quiz_id = ?", (quiz_id,))
+            connection.execute("DELETE FROM archived_leaderboard WHERE quiz_id = ?", (quiz_id,))
+            connection.execute("DELETE FROM archived_user_quizzes WHERE quiz_id = ?", (quiz_id,))
+    retry_on_busy(clear_aggregates)
+    return removed
+
+
+# Record in archived_user_quizzes the users and quizzes of every archived
+# attempt; for archives written before the archiver kept that table up to
+# date. Returns the number of pairs added.
+def index_archived_users(connection):
+    added = 0
+    for (period,) in connection.execute("SELECT period FROM attempt_archives ORDER BY period").fetchall():
+        path = archive_path(period)
+        if not os.path.exists(path):
+            continue
+        _attach(connection, path, LOOKUP_ALIAS)
+        try:
+            def index():
+                with connection:
+                    return connection.execute(
+                        f'''INSERT OR IGNORE INTO archived_user_quizzes (quiz_id, user_id)
+                            SELECT DISTINCT quiz_id, user_id FROM {LOOKUP_ALIAS}.attempts
+                            WHERE quiz_id IS NOT NULL AND user_id IS NOT NULL'''
+                    ).rowcount
+            added += retry_on_busy(index)
+        finally:
+            _detach(connection, LOOKUP_ALIAS)
+    return added
+
+
+def list_archives(connection):
+    rows = connection.execute(
+        "SELECT period, min_id, max_id, row_count, updated_at FROM attempt_archives ORDER BY period"
+    ).fetchall()
+    return [
+        {"period": period, "path": archive_path(period), "min_id": min_id, "max_id": max_id,
+         "rows": row_count, "updated_at": updated_at}
+        for period, min_id, max_id, row_count, updated_at in rows
+    ]
+
+
+# Archive everything older than `after_days`, batch by batch, pausing between
+# batches so request writes get the lock. Returns the number of rows moved.
+def archive_old_attempts(connection, after_days=None, batch_size=None, pause_ms=None, stop=None):
+    after_days = settings.ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    pause = (settings.ARCHIVE_BATCH_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+    cutoff = int(time.time() - after_days * 86400)
+    moved = 0
+    while not (stop is not None and stop.is_set()):
+        count = archive_batch(connection, cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        time.sleep(pause)
+    return moved
+
+
+class Archiver:
+    # Background thread running archive_old_attempts every ARCHIVE_INTERVAL_SECONDS
+
+    def __init__(self, connect, interval_seconds, after_days):
+        self.connect = connect
+        self.interval = interval_seconds
+        self.after_days = after_days
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._moved = 0
+        self._errors = 0
+        self._last_run = None
+        self._last_error = None
+
+    @property
+    def enabled(self):
+        return self.after_days > 0 and self.interval > 0
+
+    def start(self):
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="attempt-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self, connection):
+        try:
+            moved = archive_old_attempts(connection, self.after_days, stop=self._stopping)
+        except Exception as exc:
+            with self._lock:
+                self._errors += 1
+                self._last_error = repr(exc)
+            return 0
+        with self._lock:
+            self._runs += 1
+            self._moved += moved
+            self._last_run = int(time.time())
+        return moved
+
+    def _run(self):
+        connection = self.connect()
+        try:
+            while not self._stopping.is_set():
+                self.run_once(connection)
+                self._stopping.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "running": self._thread is not None and self._thread.is_alive(),
+                "after_days": self.after_days,
+                "runs": self._runs,
+                "moved": self._moved,
+                "errors": self._errors,
+                "last_run": self._last_run,
+                "last_error": self._last_error,
+            }
+
+
+def main(argv=None):
+    from db_pool import open_connection
+
+    parser = argparse.ArgumentParser(description="Move old attempts into monthly archive databases.")
+    parser.add_argument('command', choices=('run', 'list'))
+    parser.add_argument('--after-days', type=float, default=settings.ARCHIVE_AFTER_DAYS,
+                        help="archive attempts older than this many days")
+    parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    connection = open_connection(settings.DATABASE_PATH)
+    try:
+        if args.command == 'run':
+            moved = archive_old_attempts(connection, args.after_days, args.batch_size)
+            print(f"{moved} attempts archived")
+        for archive in list_archives(connection):
+            print(f"{archive['period']}: {archive['rows']} attempts, ids {archive['min_id']}-{archive['max_id']}, {archive['path']}")
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2 @@
+# Endpoint benchmarks and load tests for the backend. Run from the backend
+# directory with `python -m bench --help`.
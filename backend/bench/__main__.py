@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m bench', description="Seed a scratch database and benchmark every endpoint.")
+    parser.add_argument('--quizzes', type=int, default=200)
+    parser.add_argument('--questions-per-quiz', type=int, default=20)
+    parser.add_argument('--attempts', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=300, help="timed requests per route")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent clients")
+    parser.add_argument('--mode', choices=('asgi', 'uvicorn', 'both'), default='both')
+    parser.add_argument('--routes', help="comma-separated scenario names to run (default: all)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json', help="where to write the JSON results")
+    parser.add_argument('--baseline', help="earlier results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    parser.add_argument('--compare-serialization', action='store_true',
+                        help="run the list routes in-process with the model path and the fast JSON path")
+    parser.add_argument('--keep-db', action='store_true', help="do not delete the scratch database")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scratch = tempfile.mkdtemp(prefix='pquiz-bench-')
+    db_path = os.path.join(scratch, 'bench.sqlite3')
+    # settings.py reads the environment once, so this must happen before any
+    # backend module is imported
+    os.environ['PQUIZ_DB_PATH'] = db_path
+
+    from bench.report import build_report, find_regressions, load_report, save_report
+    from bench.runner import UvicornThread, run_asgi, run_uvicorn
+    from bench.scenarios import LIST_SCENARIOS, SCENARIOS, Context
+    from bench.seed import SeedVolumes, seed_database
+
+    volumes = SeedVolumes(args.quizzes, args.questions_per_quiz, args.attempts,
+                          spare_rows=max(2000, args.requests * 8))
+    print(f"Seeding {db_path} ...")
+    ranges = seed_database(db_path, volumes, seed=args.seed)
+
+    scenarios = SCENARIOS
+    if args.routes:
+        wanted = set(args.routes.split(','))
+        scenarios = [scenario for scenario in SCENARIOS if scenario.name in wanted]
+    ctx = Context(ranges, seed=args.seed)
+
+    import main as backend
+    modes = {}
+    if args.mode in ('asgi', 'both'):
+        print("In-process ASGI transport:")
+        modes["asgi"] = asyncio.run(run_asgi(backend.app, scenarios, ctx, args.requests, args.concurrency))
+    if args.mode in ('uvicorn', 'both'):
+        with UvicornThread(backend.app) as base_url:
+            print(f"uvicorn at {base_url}:")
+            modes["uvicorn"] = asyncio.run(run_uvicorn(base_url, scenarios, ctx, args.requests, args.concurrency))
+
+    if args.compare_serialization:
+        import settings
+        list_scenarios = [scenario for scenario in SCENARIOS if scenario.name in LIST_SCENARIOS]
+        for mode, fast in (("asgi_models", False), ("asgi_fast_json", True)):
+            settings.FAST_JSON_LISTS = fast
+            print(f"In-process ASGI transport, {'fast JSON' if fast else 'response models'}:")
+            modes[mode] = asyncio.run(run_asgi(backend.app, list_scenarios, ctx, args.requests, args.concurrency))
+        for name, fast in modes["asgi_fast_json"].items():
+            slow = modes["asgi_models"][name]
+            speedup = fast["throughput_rps"] / slow["throughput_rps"] if slow["throughput_rps"] else 0.0
+            print(f"  {name:<20} {speedup:>6.2f}x throughput  p50 {slow['p50_ms']:.2f} -> {fast['p50_ms']:.2f} ms")
+
+    options = {name: getattr(args, name) for name in ('requests', 'concurrency', 'seed')}
+    report = build_report(volumes.as_dict(), options, modes)
+    save_report(report, args.output)
+    print(f"Results written to {args.output}")
+
+    status = 0
+    if args.baseline:
+        regressions = find_regressions(report, load_report(args.baseline), args.threshold)
+        for mode, name, metric, before, after in regressions:
+            print(f"REGRESSION {mode}/{name}: {metric} {before} -> {after}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        status = 1 if regressions else 0
+
+    if not args.keep_db:
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(db_path + suffix)
+            except FileNotFoundError:
+                pass
+        os.rmdir(scratch)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
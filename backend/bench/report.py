@@ -0,0 +1,44 @@
+import datetime
+import json
+import platform
+import sqlite3
+
+
+def build_report(volumes, options, modes):
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "volumes": volumes,
+        "options": options,
+        "modes": modes,
+    }
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as source:
+        return json.load(source)
+
+
+# Routes whose p95 latency grew, or whose throughput dropped, by more than
+# `threshold` (a fraction) relative to the baseline run
+def find_regressions(report, baseline, threshold):
+    regressions = []
+    for mode, routes in report["modes"].items():
+        baseline_routes = baseline.get("modes", {}).get(mode, {})
+        for name, current in routes.items():
+            previous = baseline_routes.get(name)
+            if previous is None:
+                continue
+            if previous["p95_ms"] > 0 and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append((mode, name, "p95_ms", previous["p95_ms"], current["p95_ms"]))
+            if current["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+                regressions.append((mode, name, "throughput_rps", previous["throughput_rps"], current["throughput_rps"]))
+            if current["errors"] > previous["errors"]:
+                regressions.append((mode, name, "errors", previous["errors"], current["errors"]))
+    return regressions
@@ -0,0 +1,110 @@
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, wall_seconds):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "mean_ms": round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+# Fire `requests` requests of one scenario from `concurrency` concurrent clients
+async def run_scenario(client, scenario, ctx, requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            path, kwargs = scenario.make(ctx)
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            if failed:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_all(client, scenarios, ctx, requests, concurrency, log=print):
+    results = {}
+    for scenario in scenarios:
+        # A few untimed requests first, so caches and connections are warm
+        await run_scenario(client, scenario, ctx, min(10, requests), 1)
+        summary = await run_scenario(client, scenario, ctx, requests, concurrency)
+        summary["method"] = scenario.method
+        summary["route"] = scenario.route
+        results[scenario.name] = summary
+        log(f"  {scenario.name:<20} {summary['throughput_rps']:>10.1f} req/s  "
+            f"p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  "
+            f"p99 {summary['p99_ms']:>8.2f} ms  errors {summary['errors']}")
+    return results
+
+
+# In-process: requests go straight into the ASGI app, no sockets involved
+async def run_asgi(app, scenarios, ctx, requests, concurrency, log=print):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        return await run_all(client, scenarios, ctx, requests, concurrency, log)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class UvicornThread:
+    # A real uvicorn server for `app` on a free local port, run on a thread
+
+    def __init__(self, app):
+        import uvicorn
+        self.port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=self.port, log_level='warning'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("uvicorn failed to start")
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join(10)
+
+
+# Over TCP against uvicorn, with one pooled client connection per concurrent client
+async def run_uvicorn(base_url, scenarios, ctx, requests, concurrency, log=print):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        return await run_all(client, scenarios, ctx, requests, concurrency, log)
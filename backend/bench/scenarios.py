@@ -0,0 +1,114 @@
+import itertools
+import json
+import random
+
+
+class Context:
+    # Shared state for request generators: the seeded id ranges, a random
+    # source and counters handing out spare rows that may be deleted once
+
+    def __init__(self, ranges, seed=1):
+        self.ranges = ranges
+        self.rng = random.Random(seed)
+        self._spares = {name: itertools.count(low) for name, (low, _) in ranges.items() if name.startswith('spare_')}
+
+    def pick(self, name):
+        low, high = self.ranges[name]
+        return self.rng.randint(low, high)
+
+    def spare(self, name):
+        return next(self._spares[name])
+
+
+class Scenario:
+    def __init__(self, name, method, route, make):
+        self.name = name
+        self.method = method
+        self.route = route
+        # make(ctx) -> (path, request kwargs)
+        self.make = make
+
+
+def _answers(ctx, count=20):
+    return [ctx.rng.randrange(4) for _ in range(count)]
+
+
+def _question(ctx, quiz_id):
+    return {'quiz_id': quiz_id, 'question_text': 'Benchmark question?', 'choices': ['a', 'b', 'c', 'd'], 'correct_answer': ctx.rng.randrange(4)}
+
+
+def _add_question(ctx):
+    quiz_id = ctx.pick('quizzes')
+    return f"/quizzes/{quiz_id}/questions/", {'json': _question(ctx, quiz_id)}
+
+
+def _bulk_body(ctx, rows=200):
+    return ''.join(json.dumps(_question(ctx, 0)) + '\n' for _ in range(rows)).encode()
+
+
+def _lookup_scenarios(table, field):
+    return [
+        Scenario(f"create_{table}", 'POST', f"/{table}/",
+                 lambda ctx: (f"/{table}/", {'json': {field: 'bench', 'description': 'created by bench'}})),
+        Scenario(f"list_{table}", 'GET', f"/{table}/",
+                 lambda ctx: (f"/{table}/", {'params': {'limit': 100}})),
+        Scenario(f"update_{table}", 'PUT', f"/{table}/{{id}}",
+                 lambda ctx: (f"/{table}/{ctx.pick('lookups')}", {'json': {field: 'renamed', 'description': None}})),
+        Scenario(f"delete_{table}", 'DELETE', f"/{table}/{{id}}",
+                 lambda ctx: (f"/{table}/{ctx.spare('spare_lookups')}", {})),
+    ]
+
+
+# One scenario per endpoint of backend/main.py
+SCENARIOS = [
+    Scenario('health', 'GET', '/health', lambda ctx: ('/health', {})),
+    Scenario('metrics', 'GET', '/metrics', lambda ctx: ('/metrics', {})),
+    Scenario('create_quiz', 'POST', '/quizzes/',
+             lambda ctx: ('/quizzes/', {'json': {'title': 'bench', 'description': 'created by bench'}})),
+    Scenario('list_quizzes', 'GET', '/quizzes/',
+             lambda ctx: ('/quizzes/', {'params': {'after_id': ctx.pick('quizzes'), 'limit': 100}})),
+    Scenario('list_quizzes_large', 'GET', '/quizzes/',
+             lambda ctx: ('/quizzes/', {'params': {'limit': 1000}})),
+    Scenario('update_quiz', 'PUT', '/quizzes/{quiz_id}',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}", {'json': {'title': 'renamed', 'description': None}})),
+    Scenario('delete_quiz', 'DELETE', '/quizzes/{quiz_id}',
+             lambda ctx: (f"/quizzes/{ctx.spare('spare_quizzes')}", {})),
+    Scenario('add_question', 'POST', '/quizzes/{quiz_id}/questions/', _add_question),
+    Scenario('import_questions', 'POST', '/quizzes/{quiz_id}/questions/bulk',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}/questions/bulk",
+                          {'content': _bulk_body(ctx), 'headers': {'content-type': 'application/x-ndjson'}})),
+    Scenario('get_questions', 'GET', '/quizzes/{quiz_id}/questions/',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}/questions/", {})),
+    Scenario('get_full_quiz', 'GET', '/quizzes/{quiz_id}/full',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}/full", {})),
+    Scenario('update_question', 'PUT', '/questions/{question_id}',
+             lambda ctx: (f"/questions/{ctx.pick('questions')}", {'json': _question(ctx, 0)})),
+    Scenario('delete_question', 'DELETE', '/questions/{question_id}',
+             lambda ctx: (f"/questions/{ctx.spare('spare_questions')}", {})),
+    Scenario('create_attempt', 'POST', '/attempts/',
+             lambda ctx: ('/attempts/', {'json': {'quiz_id': ctx.pick('quizzes'), 'user_id': ctx.rng.randint(1, 5000), 'answers': _answers(ctx)}})),
+    Scenario('get_attempt', 'GET', '/attempts/{attempt_id}',
+             lambda ctx: (f"/attempts/{ctx.pick('attempts')}", {})),
+    Scenario('export_attempts', 'GET', '/attempts/export',
+             lambda ctx: ('/attempts/export', {'params': {'quiz_id': ctx.pick('quizzes'), 'format': 'csv', 'gzip': True}})),
+    Scenario('regrade_attempts', 'POST', '/quizzes/{quiz_id}/regrade',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}/regrade", {})),
+    Scenario('get_leaderboard', 'GET', '/quizzes/{quiz_id}/leaderboard',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}/leaderboard", {})),
+    Scenario('get_quiz_stats', 'GET', '/quizzes/{quiz_id}/stats',
+             lambda ctx: (f"/quizzes/{ctx.pick('quizzes')}/stats", {})),
+    Scenario('search_questions', 'GET', '/search',
+             lambda ctx: ('/search', {'params': {'q': f"question {ctx.rng.randrange(20)} of quiz", 'limit': 20}})),
+    Scenario('search_quizzes', 'GET', '/search',
+             lambda ctx: ('/search', {'params': {'q': f"quiz {ctx.pick('quizzes')}", 'kind': 'quizzes'}})),
+    Scenario('sample_questions', 'GET', '/questions/sample',
+             lambda ctx: ('/questions/sample', {'params': {'quiz_id': [ctx.pick('quizzes') for _ in range(5)], 'n': 20,
+                                                           'user_id': ctx.rng.randint(1, 5000)}})),
+    *_lookup_scenarios('categories', 'category_name'),
+    *_lookup_scenarios('levels', 'level_name'),
+    *_lookup_scenarios('topics', 'topic_name'),
+]
+
+# Read-only list routes, used to compare the fast JSON path with the model path
+LIST_SCENARIOS = ('list_quizzes', 'list_quizzes_large', 'get_questions',
+                  'list_categories', 'list_levels', 'list_topics')
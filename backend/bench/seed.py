@@ -0,0 +1,97 @@
+import random
+import sqlite3
+
+from grading import encode_choices
+from migrations import migrate
+import stats
+
+CHOICES = encode_choices(('a', 'b', 'c', 'd'))
+
+
+class SeedVolumes:
+    def __init__(self, quizzes=200, questions_per_quiz=20, attempts=20000, spare_rows=2000):
+        self.quizzes = quizzes
+        self.questions_per_quiz = questions_per_quiz
+        self.attempts = attempts
+        # Extra rows per table that the delete scenarios may consume
+        self.spare_rows = spare_rows
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def _chunks(rows, size=10000):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+# Create and fill a benchmark database at `path`. Scores and aggregates are
+# computed the same way the attempt writer would, so read endpoints see
+# realistic data. Returns the id ranges the scenarios draw from.
+def seed_database(path, volumes, seed=1):
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    try:
+        migrate(connection)
+        quiz_count = volumes.quizzes + volumes.spare_rows
+        # One more quiz after the spare ones holds the spare questions, so the
+        # delete_quiz scenario never cascades into them
+        spare_question_quiz = quiz_count + 1
+        with connection:
+            connection.executemany(
+                "INSERT INTO quizzes (id, title, description) VALUES (?, ?, ?)",
+                [(i, f"Quiz {i}", f"Benchmark quiz number {i}") for i in range(1, spare_question_quiz + 1)]
+            )
+            for table, column in (('categories', 'category_name'), ('levels', 'level_name'), ('topics', 'topic_name')):
+                connection.executemany(
+                    f"INSERT INTO {table} (id, {column}, description) VALUES (?, ?, ?)",
+                    [(i, f"{table} {i}", None) for i in range(1, volumes.spare_rows + 100 + 1)]
+                )
+
+        keys = {}
+        question_rows = []
+        question_id = 0
+        for quiz_id in range(1, volumes.quizzes + 1):
+            key = bytearray()
+            for n in range(volumes.questions_per_quiz):
+                question_id += 1
+                correct = rng.randrange(4)
+                key.append(correct)
+                question_rows.append((question_id, quiz_id, f"Question {n} of quiz {quiz_id}?", CHOICES, correct))
+            keys[quiz_id] = bytes(key)
+        # Spare questions for the delete_question scenario
+        for n in range(volumes.spare_rows):
+            question_id += 1
+            question_rows.append((question_id, spare_question_quiz, f"Spare question {n}", CHOICES, 0))
+        for chunk in _chunks(question_rows):
+            with connection:
+                connection.executemany(
+                    "INSERT INTO questions (id, quiz_id, question_text, choices, correct_answer) VALUES (?, ?, ?, ?, ?)",
+                    chunk
+                )
+
+        attempt_rows = []
+        for attempt_id in range(1, volumes.attempts + 1):
+            quiz_id = rng.randint(1, volumes.quizzes)
+            answers = bytes(rng.randrange(4) for _ in range(volumes.questions_per_quiz))
+            score = sum(a == b for a, b in zip(answers, keys[quiz_id]))
+            attempt_rows.append((attempt_id, quiz_id, rng.randint(1, 5000), answers, score))
+        for chunk in _chunks(attempt_rows):
+            with connection:
+                connection.executemany(
+                    "INSERT INTO attempts (id, quiz_id, user_id, answers, score) VALUES (?, ?, ?, ?, ?)",
+                    chunk
+                )
+        stats.rebuild_all_stats(connection)
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    return {
+        "quizzes": (1, volumes.quizzes),
+        "spare_quizzes": (volumes.quizzes + 1, quiz_count),
+        "questions": (1, volumes.quizzes * volumes.questions_per_quiz),
+        "spare_questions": (volumes.quizzes * volumes.questions_per_quiz + 1, question_id),
+        "attempts": (1, volumes.attempts),
+        "lookups": (1, 100),
+        "spare_lookups": (101, volumes.spare_rows + 100),
+    }
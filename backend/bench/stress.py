@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+# Multi-worker write stress test: starts `uvicorn main:app --workers N` on a
+# scratch database, fires concurrent writes (attempts, quizzes and questions)
+# at it, then checks in the database that every acknowledged write is there
+# and that no request failed. Exits non-zero on any failure or lost write.
+#
+#   cd backend; python -m bench.stress --workers 4 --clients 64 --requests 4000
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stress rows are told apart from seeded ones by these markers
+USER_ID_BASE = 1_000_000_000
+MARKER = 'stress'
+
+_CONTENTION_LINE = re.compile(r'^pquiz_db_contention_(\w+)\{pid="(\d+)"\} (\S+)$', re.MULTILINE)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m bench.stress', description="Concurrent writes against several uvicorn workers.")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=64, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=4000, help="total write requests")
+    parser.add_argument('--quizzes', type=int, default=50, help="quizzes seeded before the run")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--keep-db', action='store_true')
+    return parser.parse_args(argv)
+
+
+def start_server(db_path, workers, port):
+    env = dict(os.environ, PQUIZ_DB_PATH=db_path, WEB_CONCURRENCY=str(workers))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+def wait_until_ready(base_url, server, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("uvicorn did not become ready")
+
+
+def make_request(index, quiz_ids):
+    quiz_id = quiz_ids[index % len(quiz_ids)]
+    kind = ('attempt', 'attempt', 'question', 'quiz')[index % 4]
+    if kind == 'attempt':
+        return kind, '/attempts/', {'quiz_id': quiz_id, 'user_id': USER_ID_BASE + index, 'answers': [0, 1, 2]}
+    if kind == 'question':
+        return kind, f'/quizzes/{quiz_id}/questions/', {
+            'quiz_id': quiz_id, 'question_text': f'{MARKER} question {index}', 'choices': ['a', 'b', 'c'], 'correct_answer': 1}
+    return kind, '/quizzes/', {'title': f'{MARKER} quiz {index}', 'description': None}
+
+
+async def fire(base_url, total, clients, quiz_ids):
+    acknowledged = {'attempt': set(), 'question': set(), 'quiz': set()}
+    failures = []
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0) as client:
+        async def worker():
+            for index in remaining:
+                kind, path, body = make_request(index, quiz_ids)
+                try:
+                    response = await client.post(path, json=body)
+                except httpx.HTTPError as exc:
+                    failures.append((kind, index, repr(exc)))
+                    continue
+                if response.status_code != 200:
+                    failures.append((kind, index, f"{response.status_code} {response.text[:200]}"))
+                else:
+                    acknowledged[kind].add(response.json()['id'])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return acknowledged, failures, elapsed
+
+
+# Each scrape lands on whichever worker accepts the connection; keep the
+# latest counters seen per pid
+def scrape_contention(base_url, scrapes):
+    per_worker = {}
+    for _ in range(scrapes):
+        try:
+            text = httpx.get(f"{base_url}/metrics", timeout=5.0).text
+        except httpx.HTTPError:
+            continue
+        for name, pid, value in _CONTENTION_LINE.findall(text):
+            per_worker.setdefault(int(pid), {})[name] = float(value)
+    return per_worker
+
+
+def stored_ids(db_path):
+    connection = sqlite3.connect(db_path)
+    try:
+        return {
+            'attempt': {row[0] for row in connection.execute(
+                "SELECT id FROM attempts WHERE user_id >= ?", (USER_ID_BASE,))},
+            'question': {row[0] for row in connection.execute(
+                "SELECT id FROM questions WHERE question_text LIKE ?", (f'{MARKER} %',))},
+            'quiz': {row[0] for row in connection.execute(
+                "SELECT id FROM quizzes WHERE title LIKE ?", (f'{MARKER} %',))},
+        }
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scratch = tempfile.mkdtemp(prefix='pquiz-stress-')
+    db_path = os.path.join(scratch, 'stress.sqlite3')
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    from bench.seed import SeedVolumes, seed_database
+    ranges = seed_database(db_path, SeedVolumes(args.quizzes, 10, 0, spare_rows=0))
+    low, high = ranges['quizzes']
+    quiz_ids = list(range(low, high + 1))
+
+    server = start_server(db_path, args.workers, args.port)
+    try:
+        wait_until_ready(base_url, server)
+        print(f"{args.workers} workers at {base_url}, {args.clients} clients, {args.requests} writes")
+        acknowledged, failures, elapsed = asyncio.run(fire(base_url, args.requests, args.clients, quiz_ids))
+        contention = scrape_contention(base_url, args.workers * 8)
+    finally:
+        # An acknowledged write was committed before its response was sent;
+        # SIGTERM shuts the workers down gracefully (the lifespan drains and
+        # stops the attempt writers) before the database is read below
+        server.terminate()
+        server.wait(30)
+
+    stored = stored_ids(db_path)
+    lost = {kind: ids - stored[kind] for kind, ids in acknowledged.items()}
+    total_acknowledged = sum(len(ids) for ids in acknowledged.values())
+    total_lost = sum(len(ids) for ids in lost.values())
+
+    print(f"  {total_acknowledged} acknowledged in {elapsed:.2f}s ({total_acknowledged / elapsed:.1f} writes/s)")
+    for kind in sorted(acknowledged):
+        print(f"  {kind:<9} acknowledged {len(acknowledged[kind]):>6}  stored {len(stored[kind]):>6}  lost {len(lost[kind])}")
+    for pid, counters in sorted(contention.items()):
+        summary = '  '.join(f"{name} {value:g}" for name, value in sorted(counters.items()))
+        print(f"  worker {pid}: {summary}")
+    for kind, index, error in failures[:10]:
+        print(f"  FAILED {kind} #{index}: {error}")
+    print(f"  {len(failures)} failed requests, {total_lost} lost writes")
+
+    if not args.keep_db:
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(db_path + suffix)
+            except FileNotFoundError:
+                pass
+        os.rmdir(scratch)
+    return 1 if failures or total_lost else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import codecs
+import csv
+import json
+import sqlite3
+import time
+
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+import settings
+
+# Errors that belong to the row being inserted; anything else (a lock
+# timeout, a full disk) fails the whole chunk
+ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.InterfaceError, OverflowError)
+
+CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/json-lines': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+def format_from_content_type(content_type):
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return CONTENT_TYPES.get(media_type, 'ndjson')
+
+
+class RecordParser:
+    # Incremental NDJSON/CSV parser: feed() it decoded text as it arrives and it
+    # returns the records completed so far as (row_number, dict) pairs, or
+    # (row_number, error_message) when a record cannot be parsed. Only the
+    # current incomplete record is buffered, never the whole body, and it is
+    # kept as a list of pieces joined once complete, so a long record costs
+    # linear time however many chunks it arrives in.
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.buffer = []          # pieces of the current unterminated line
+        self.pending = []         # CSV lines of a record with an open quoted field
+        self.pending_quotes = 0
+        self.header = None
+        self.row_number = 0
+
+    def feed(self, text):
+        if '\n' not in text:
+            if text:
+                self.buffer.append(text)
+            return []
+        lines = text.split('\n')
+        lines[0] = ''.join(self.buffer) + lines[0]
+        self.buffer = [lines.pop()]
+        return [record for line in lines for record in self._line(line)]
+
+    def close(self):
+        line = ''.join(self.buffer)
+        self.buffer = []
+        records = self._line(line) if line else []
+        if self.pending:
+            self.row_number += 1
+            records.append((self.row_number, "Unterminated quoted field"))
+            self.pending = []
+        return records
+
+    def _line(self, line):
+        line = line.rstrip('\r')
+        if self.fmt == 'csv':
+            return self._csv_line(line)
+        if not line.strip():
+            return []
+        self.row_number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            return [(self.row_number, f"Invalid JSON: {exc}")]
+        if not isinstance(record, dict):
+            return [(self.row_number, "Expected a JSON object")]
+        return [(self.row_number, record)]
+
+    def _csv_line(self, line):
+        # A CSV record may span lines inside a quoted field; it is complete once
+        # its quote characters balance out
+        quotes = line.count('"')
+        if self.pending or quotes % 2:
+            self.pending.append(line)
+            self.pending_quotes += quotes
+            if self.pending_quotes % 2:
+                return []
+            record = '\n'.join(self.pending)
+            self.pending = []
+            self.pending_quotes = 0
+        else:
+            record = line
+        if not record.strip():
+            return []
+        try:
+            values = next(csv.reader([record]))
+        except csv.Error as exc:
+            self.row_number += 1
+            return [(self.row_number, f"Invalid CSV: {exc}")]
+        if self.header is None:
+            self.header = [name.strip() for name in values]
+            return []
+        self.row_number += 1
+        if len(values) != len(self.header):
+            return [(self.row_number, f"Expected {len(self.header)} columns, got {len(values)}")]
+        return [(self.row_number, dict(zip(self.header, values)))]
+
+
+# One line per field that failed validation, e.g. "answers.2: Input should be a valid integer"
+def describe_validation_error(exc):
+    return '; '.join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+
+# Insert `rows` with `sql` inside the caller's transaction. A chunk that
+# fails is rolled back to its savepoint and inserted again row by row, so the
+# valid rows are kept; returns [(index in rows, error)] of the rows that failed.
+def insert_chunk(connection, sql, rows):
+    if not connection.in_transaction:
+        connection.execute("BEGIN IMMEDIATE")
+    connection.execute("SAVEPOINT import_chunk")
+    try:
+        connection.executemany(sql, rows)
+    except ROW_ERRORS:
+        connection.execute("ROLLBACK TO import_chunk")
+    else:
+        connection.execute("RELEASE import_chunk")
+        return []
+    failures = []
+    for index, row in enumerate(rows):
+        connection.execute("SAVEPOINT import_row")
+        try:
+            connection.execute(sql, row)
+        except ROW_ERRORS as exc:
+            connection.execute("ROLLBACK TO import_row")
+            failures.append((index, str(exc)))
+        connection.execute("RELEASE import_row")
+    connection.execute("RELEASE import_chunk")
+    return failures
+
+
+# Stream a request body into the database in chunked transactions.
+#
+# `chunks` is an async iterator of raw bytes, `model` validates each row and
+# `insert_batch(rows)` is a blocking function that inserts a list of
+# validated models in one transaction and returns [(index in rows, error)]
+# of the rows it could not insert (see insert_chunk); it runs in the
+# threadpool. An exception fails the whole chunk.
+async def import_rows(chunks, fmt, model, insert_batch, defaults=None):
+    started = time.perf_counter()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parser = RecordParser(fmt)
+    batch, batch_rows = [], []
+    inserted = failed = 0
+    errors = []
+
+    def record_error(row_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < settings.BULK_IMPORT_MAX_ERRORS:
+            errors.append({"row": row_number, "error": message})
+
+    async def flush():
+        nonlocal inserted
+        rows, row_numbers = batch[:], batch_rows[:]
+        batch.clear()
+        batch_rows.clear()
+        try:
+            failures = await run_in_threadpool(insert_batch, rows)
+        except Exception as exc:
+            for row_number in row_numbers:
+                record_error(row_number, f"Insert failed: {exc}")
+        else:
+            for index, message in failures:
+                record_error(row_numbers[index], f"Insert failed: {message}")
+            inserted += len(rows) - len(failures)
+
+    async def consume(records):
+        for row_number, record in records:
+            if isinstance(record, str):
+                record_error(row_number, record)
+                continue
+            if defaults:
+                record.update(defaults)
+            try:
+                batch.append(model(**record))
+            except ValidationError as exc:
+                record_error(row_number, describe_validation_error(exc))
+                continue
+            batch_rows.append(row_number)
+            if len(batch) >= settings.BULK_IMPORT_BATCH_SIZE:
+                await flush()
+
+    async for chunk in chunks:
+        await consume(parser.feed(decoder.decode(chunk)))
+    await consume(parser.feed(decoder.decode(b'', final=True)))
+    await consume(parser.close())
+    if batch:
+        await flush()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 6),
+        "rows_per_second": round(inserted / elapsed, 1) if elapsed > 0 else 0.0,
+    }
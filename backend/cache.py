@@ -0,0 +1,134 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def strong_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+# True when an If-None-Match header value matches the given strong ETag
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or ('W/' + etag) in candidates
+
+
+class CachedBody:
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = strong_etag(body)
+
+
+class LRUCache:
+    # Thread-safe LRU cache bounded by the total weight of its values (one
+    # each unless `weight` says otherwise), filled by loaders that run outside
+    # the lock.
+    #
+    # Invalidating a key while a loader for it is running bumps the key's
+    # generation, so the value that loader read before the invalidation is not
+    # stored after it. Generations are only kept for keys with a load in
+    # flight and dropped when the last one finishes, so invalidating one key
+    # never keeps the others from being cached, and memory stays bounded by
+    # the entries plus the loads running at once.
+
+    def __init__(self, max_weight, weight=None):
+        self.max_weight = max_weight
+        self._weight = weight or (lambda value: 1)
+        self._entries = OrderedDict()
+        self._loads = {}                # key -> [generation, loads in flight]
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        return self._lookup(key)
+
+    def _lookup(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # The cached value of `key`, or loader()'s result, stored unless `key` was
+    # invalidated while it ran. An exception from loader() is passed on.
+    def get_or_load(self, key, loader):
+        value = self._lookup(key)
+        if value is not None:
+            return value
+        with self._lock:
+            load = self._loads.setdefault(key, [0, 0])
+            load[1] += 1
+            generation = load[0]
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                load = self._loads[key]
+                load[1] -= 1
+                if not load[1]:
+                    del self._loads[key]
+        with self._lock:
+            if load[0] == generation:
+                self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        weight = self._weight(value)
+        if weight > self.max_weight:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= self._weight(previous)
+        self._entries[key] = value
+        self._size += weight
+        while self._size > self.max_weight:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= self._weight(evicted)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._size -= self._weight(value)
+            load = self._loads.get(key)
+            if load is not None:
+                load[0] += 1
+
+    def values(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+class ResponseCache(LRUCache):
+    # In-process LRU cache of encoded response bodies (CachedBody), bounded by
+    # their total size in bytes rather than by entry count
+
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes, weight=lambda entry: len(entry.body))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,266 @@
+import functools
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+import settings
+
+# Pragmas applied once when a pooled connection is opened. journal_mode=WAL is
+# persistent in the database file, the others are per connection.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = {busy_timeout}",
+    "PRAGMA cache_size = -{cache_size_kb}",
+    "PRAGMA mmap_size = {mmap_size}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class DatabaseBusy(Exception):
+    pass
+
+
+# Open a new connection with the tuned pragmas and a large statement cache.
+# Implicit transactions start with BEGIN IMMEDIATE, so a writer waits for the
+# write lock (under busy_timeout) when it starts instead of failing with
+# SQLITE_BUSY when it tries to upgrade a read lock halfway through.
+def open_connection(path=None, factory=sqlite3.Connection):
+    connection = sqlite3.connect(
+        path or settings.DATABASE_PATH,
+        timeout=settings.DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level='IMMEDIATE',
+        check_same_thread=False,
+        cached_statements=settings.DB_STATEMENT_CACHE_SIZE,
+        factory=factory,
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        connection.execute(pragma.format(
+            busy_timeout=settings.DB_BUSY_TIMEOUT_MS,
+            cache_size_kb=settings.DB_CACHE_SIZE_KB,
+            mmap_size=settings.DB_MMAP_SIZE,
+        ))
+    return connection
+
+
+# Several server processes can only share the database safely in WAL mode;
+# refuse to start if the file system does not support it
+def ensure_wal(connection):
+    mode = connection.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    if mode.lower() != 'wal':
+        raise RuntimeError(f"Could not enable WAL journal mode (journal_mode is {mode!r})")
+    return mode
+
+
+def is_busy_error(exc):
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    code = getattr(exc, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(exc)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+class WriteContention:
+    # Lock contention counters for this process: writes that hit SQLITE_BUSY
+    # even after busy_timeout, how often they were retried and how long the
+    # backoff took, and writes that gave up
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.busy_errors = 0
+        self.retries = 0
+        self.recovered = 0
+        self.exhausted = 0
+        self.backoff_seconds = 0.0
+
+    def record(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "busy_errors": self.busy_errors,
+                "retries": self.retries,
+                "recovered": self.recovered,
+                "exhausted": self.exhausted,
+                "backoff_seconds": self.backoff_seconds,
+            }
+
+
+contention = WriteContention()
+
+
+# Run fn(), retrying it with jittered exponential backoff while the database
+# is locked by another process. fn must be safe to repeat: it should do its
+# writes in one transaction, which is rolled back when it fails.
+def retry_on_busy(fn, retries=None, base_delay_ms=None, max_delay_ms=None):
+    retries = settings.DB_WRITE_RETRIES if retries is None else retries
+    base_delay = (settings.DB_RETRY_BASE_MS if base_delay_ms is None else base_delay_ms) / 1000
+    max_delay = (settings.DB_RETRY_MAX_MS if max_delay_ms is None else max_delay_ms) / 1000
+    attempt = 0
+    while True:
+        try:
+            result = fn()
+        except sqlite3.OperationalError as exc:
+            if not is_busy_error(exc):
+                raise
+            contention.record(busy_errors=1)
+            if attempt >= retries:
+                contention.record(exhausted=1)
+                raise DatabaseBusy("Database is busy, try again later") from exc
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            contention.record(retries=1, backoff_seconds=delay)
+            time.sleep(delay)
+            attempt += 1
+        else:
+            if attempt:
+                contention.record(recovered=1)
+            return result
+
+
+# Decorator form of retry_on_busy for write endpoints and helpers
+def retry_writes(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return retry_on_busy(lambda: fn(*args, **kwargs))
+    return wrapper
+
+
+class ConnectionPool:
+    # A bounded pool of reusable SQLite connections.
+    #
+    # Connections are created lazily up to `size` and handed out LIFO, so a
+    # lightly loaded server keeps reusing the same warm connection (and its
+    # statement cache) instead of cycling through all of them. When every
+    # connection is checked out, callers wait up to `timeout` seconds.
+
+    def __init__(self, factory, size, timeout):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._closed = False
+        # Checkout statistics, used to size the pool
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        started = time.perf_counter()
+        connection = None
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    connection = self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+        waited = False
+        if connection is None:
+            waited = True
+            try:
+                connection = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(
+                    f"No database connection available within {self.timeout}s"
+                )
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_total += elapsed
+                self._wait_max = max(self._wait_max, elapsed)
+        return connection
+
+    def release(self, connection):
+        # Never hand a connection with an open transaction to the next caller
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            self.discard(connection)
+            return
+        with self._lock:
+            self._in_use -= 1
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    def discard(self, connection):
+        # Drop a broken connection instead of returning it to the pool
+        with self._lock:
+            self._in_use -= 1
+            self._created -= 1
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = self._in_use
+
+    def healthy(self):
+        try:
+            connection = self.acquire()
+        except (PoolTimeout, sqlite3.Error):
+            return False
+        try:
+            connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        with self._lock:
+            waits = self._waits
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "waits": waits,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": (self._wait_total / waits * 1000) if waits else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+            }
@@ -0,0 +1,306 @@
+import argparse
+import csv
+import io
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+import settings
+from grading import NO_KEY, UNANSWERED, AnswerKeyCache, decode_answers, unpack_answers
+
+# Streaming export of the attempts table.
+#
+# Attempts are read through one cursor with fetchmany(), and every batch is
+# encoded and handed on before the next one is read, so memory use depends on
+# the batch size only, never on the size of the table. Rows come out in id
+# order; passing the last exported id as `after_id` resumes an interrupted
+# export. With `questions`, each attempt is expanded to one row per question
+# of its quiz, graded against the cached answer key.
+#
+# Formats: NDJSON, CSV (with a header row) and "columnar", a chunked binary
+# layout that analytics jobs can load column by column:
+#
+#   b'PQC1'  u32 header length  JSON header {"version": 1, "columns": [{"name", "type"}]}
+#   chunks:  u32 row count, then one block per column, in header order
+#            int  column: validity bitmap, row count * int64
+#            text column: validity bitmap, (row count + 1) * uint32 offsets, UTF-8 data
+#   end:     u32 0
+#
+# All integers are little-endian; bitmap bit i (LSB first) is set when row i is
+# not NULL. Any format can be gzip-compressed on the fly.
+
+EXPORT_FORMATS = ('ndjson', 'csv', 'columnar')
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'columnar': 'application/octet-stream',
+}
+
+FILE_EXTENSIONS = {'ndjson': 'ndjson', 'csv': 'csv', 'columnar': 'pqc'}
+
+COLUMNAR_MAGIC = b'PQC1'
+COLUMNAR_VERSION = 1
+
+ATTEMPT_COLUMNS = (('id', 'int'), ('quiz_id', 'int'), ('user_id', 'int'), ('answers', 'text'), ('score', 'int'))
+
+QUESTION_ROW_COLUMNS = (
+    ('attempt_id', 'int'), ('quiz_id', 'int'), ('user_id', 'int'), ('question_id', 'int'),
+    ('answer', 'int'), ('correct_answer', 'int'), ('correct', 'int'),
+)
+
+_U32 = struct.Struct('<I')
+
+
+def export_columns(questions):
+    return QUESTION_ROW_COLUMNS if questions else ATTEMPT_COLUMNS
+
+
+def export_filename(fmt, questions, compress):
+    name = 'attempt_answers' if questions else 'attempts'
+    return f"{name}.{FILE_EXTENSIONS[fmt]}" + ('.gz' if compress else '')
+
+
+# Keyset pages of attempts, each read by its own short statement, so no read
+# snapshot is held while a batch is encoded and sent and WAL checkpoints keep
+# up with writers during a long export
+def _attempt_batches(connection, after_id, quiz_id, batch_size):
+    while True:
+        # Separate statements, so a quiz's export reads its idx_attempts_quiz_id range
+        if quiz_id is None:
+            rows = connection.execute(
+                "SELECT id, quiz_id, user_id, answers, score FROM attempts WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, batch_size)
+            ).fetchall()
+        else:
+            rows = connection.execute(
+                '''SELECT id, quiz_id, user_id, answers, score FROM attempts
+                   WHERE quiz_id = ? AND id > ? ORDER BY id LIMIT ?''',
+                (quiz_id, after_id, batch_size)
+            ).fetchall()
+        if not rows:
+            break
+        yield rows
+        after_id = rows[-1][0]
+
+
+# Attempts as exported: answers are a list of choice indexes (null for a
+# skipped question) in NDJSON, and "1,,2" text in the CSV and columnar formats
+def _attempt_rows(fmt, attempts):
+    if fmt == 'ndjson':
+        return [(attempt_id, quiz_id, user_id, unpack_answers(decode_answers(answers)), score)
+                for attempt_id, quiz_id, user_id, answers, score in attempts]
+    return [
+        (attempt_id, quiz_id, user_id,
+         ','.join('' if answer == UNANSWERED else str(answer) for answer in decode_answers(answers)), score)
+        for attempt_id, quiz_id, user_id, answers, score in attempts
+    ]
+
+
+# One row per (attempt, question of its quiz); answers past the end of the
+# attempt's answer list, or unparseable ones, are exported as NULL
+def _question_rows(connection, answer_keys, attempts):
+    rows = []
+    for attempt_id, quiz_id, user_id, answers, _ in attempts:
+        key = answer_keys.get(connection, quiz_id)
+        packed = decode_answers(answers)
+        for position, question_id in enumerate(key.question_ids):
+            answer = packed[position] if position < len(packed) else UNANSWERED
+            correct_answer = key.packed[position]
+            rows.append((
+                attempt_id, quiz_id, user_id, question_id,
+                None if answer == UNANSWERED else answer,
+                None if correct_answer == NO_KEY else correct_answer,
+                int(answer == correct_answer),
+            ))
+    return rows
+
+
+def _bitmap(values):
+    bitmap = bytearray((len(values) + 7) // 8)
+    for index, value in enumerate(values):
+        if value is not None:
+            bitmap[index >> 3] |= 1 << (index & 7)
+    return bytes(bitmap)
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _column_block(kind, values):
+    if kind == 'int':
+        data = _little_endian(array('q', (0 if value is None else value for value in values)))
+    else:
+        encoded = [b'' if value is None else str(value).encode() for value in values]
+        offsets = array('I', [0])
+        total = 0
+        for item in encoded:
+            total += len(item)
+            offsets.append(total)
+        data = _little_endian(offsets) + b''.join(encoded)
+    return _bitmap(values) + data
+
+
+def columnar_header(columns):
+    header = json.dumps({
+        "version": COLUMNAR_VERSION,
+        "columns": [{"name": name, "type": kind} for name, kind in columns],
+    }).encode()
+    return COLUMNAR_MAGIC + _U32.pack(len(header)) + header
+
+
+def columnar_chunk(columns, rows):
+    parts = [_U32.pack(len(rows))]
+    for index, (_, kind) in enumerate(columns):
+        parts.append(_column_block(kind, [row[index] for row in rows]))
+    return b''.join(parts)
+
+
+class _Encoder:
+    def __init__(self, fmt, columns):
+        self.fmt = fmt
+        self.columns = columns
+        self.names = [name for name, _ in columns]
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+
+    def header(self):
+        if self.fmt == 'csv':
+            return self._csv([self.names])
+        if self.fmt == 'columnar':
+            return columnar_header(self.columns)
+        return b''
+
+    def batch(self, rows):
+        if self.fmt == 'csv':
+            return self._csv(rows)
+        if self.fmt == 'columnar':
+            return columnar_chunk(self.columns, rows)
+        names = self.names
+        return ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in rows).encode()
+
+    def footer(self):
+        return _U32.pack(0) if self.fmt == 'columnar' else b''
+
+    def _csv(self, rows):
+        self._writer.writerows(rows)
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text.encode()
+
+
+def gzip_chunks(chunks, level=None):
+    compressor = zlib.compressobj(settings.EXPORT_GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _export_chunks(connection, fmt, after_id, quiz_id, questions, answer_keys, batch_size):
+    encoder = _Encoder(fmt, export_columns(questions))
+    header = encoder.header()
+    if header:
+        yield header
+    for attempts in _attempt_batches(connection, after_id, quiz_id, batch_size):
+        rows = _question_rows(connection, answer_keys, attempts) if questions else _attempt_rows(fmt, attempts)
+        if rows:
+            yield encoder.batch(rows)
+    footer = encoder.footer()
+    if footer:
+        yield footer
+
+
+# Encoded export as an iterator of byte chunks
+def export_attempts(connection, fmt='ndjson', after_id=0, quiz_id=None, questions=False,
+                    compress=False, answer_keys=None, batch_size=None):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    if questions and answer_keys is None:
+        answer_keys = AnswerKeyCache(settings.ANSWER_KEY_CACHE_SIZE)
+    chunks = _export_chunks(connection, fmt, after_id, quiz_id, questions, answer_keys,
+                            batch_size or settings.EXPORT_BATCH_SIZE)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+# For StreamingResponse: holds its own pool connection until the export ends
+def stream_export(pool, **options):
+    connection = pool.acquire()
+    try:
+        yield from export_attempts(connection, **options)
+    finally:
+        pool.release(connection)
+
+
+def _read_exact(source, size):
+    data = source.read(size)
+    if len(data) != size:
+        raise ValueError("truncated columnar export")
+    return data
+
+
+def _read_block(source, kind, count):
+    valid = _read_exact(source, (count + 7) // 8)
+    present = [bool(valid[index >> 3] & (1 << (index & 7))) for index in range(count)]
+    if kind == 'int':
+        values = array('q')
+        values.frombytes(_read_exact(source, count * 8))
+    else:
+        offsets = array('I')
+        offsets.frombytes(_read_exact(source, (count + 1) * 4))
+    if sys.byteorder == 'big':
+        (values if kind == 'int' else offsets).byteswap()
+    if kind == 'int':
+        return [value if ok else None for value, ok in zip(values, present)]
+    data = _read_exact(source, offsets[-1])
+    return [data[offsets[index]:offsets[index + 1]].decode() if present[index] else None for index in range(count)]
+
+
+# Read a columnar export back: yields (columns, {name: values}) per chunk
+def read_columnar(source):
+    if _read_exact(source, 4) != COLUMNAR_MAGIC:
+        raise ValueError("not a columnar export")
+    (length,) = _U32.unpack(_read_exact(source, 4))
+    header = json.loads(_read_exact(source, length))
+    columns = [(column["name"], column["type"]) for column in header["columns"]]
+    while True:
+        (count,) = _U32.unpack(_read_exact(source, 4))
+        if count == 0:
+            return
+        yield columns, {name: _read_block(source, kind, count) for name, kind in columns}
+
+
+def main(argv=None):
+    from db_pool import open_connection
+
+    parser = argparse.ArgumentParser(description="Export attempts as NDJSON, CSV or columnar chunks.")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    parser.add_argument('--after-id', type=int, default=0, help="resume after this attempt id")
+    parser.add_argument('--quiz-id', type=int)
+    parser.add_argument('--questions', action='store_true', help="one row per attempt and question")
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--output', '-o', help="output file (default: stdout)")
+    options = parser.parse_args(argv)
+
+    connection = open_connection(settings.DATABASE_PATH)
+    output = open(options.output, 'wb') if options.output else sys.stdout.buffer
+    try:
+        for chunk in export_attempts(connection, options.format, options.after_id, options.quiz_id,
+                                     options.questions, options.gzip, batch_size=options.batch_size):
+            output.write(chunk)
+    finally:
+        if options.output:
+            output.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
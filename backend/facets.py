@@ -0,0 +1,104 @@
+import json
+
+from fastapi import HTTPException
+
+# Browsing quizzes by category, level and topic.
+#
+# Each facet links quizzes to its values through an association table keyed
+# (value id, quiz id), so the quizzes tagged with a value are one index range,
+# already in quiz id order. A filter on several facets intersects those
+# ranges (INTERSECT of the per-facet id lists) before a single quizzes row is
+# read; values of the same facet are alternatives, different facets must all
+# match.
+#
+# How many quizzes carry each value is kept in quiz_facet_counts by triggers
+# on the association tables (migration 11), so the unfiltered counts shown on
+# the browse screen are a read of a few rows, never a GROUP BY over the
+# catalogue. Counts under a filter are grouped over the matching quizzes only.
+#
+# Lists of value ids are bound as one JSON array read through json_each(?),
+# so however many values a request names, it stays within SQLite's limit on
+# bound parameters.
+
+# facet -> (association table, value column, value table, value name column)
+FACETS = {
+    'category': ('quiz_categories', 'category_id', 'categories', 'category_name'),
+    'level': ('quiz_levels', 'level_id', 'levels', 'level_name'),
+    'topic': ('quiz_topics', 'topic_id', 'topics', 'topic_name'),
+}
+
+
+# Subquery selecting the ids above `after_id` of the quizzes matching
+# `selected` ({facet: [value ids]}), with its parameters; None when nothing
+# is selected
+def facet_filter(selected, after_id=0):
+    arms = []
+    params = []
+    for facet, value_ids in selected.items():
+        if not value_ids:
+            continue
+        table, column = FACETS[facet][:2]
+        arms.append(f"SELECT quiz_id FROM {table} WHERE {column} IN (SELECT value FROM json_each(?)) AND quiz_id > ?")
+        params.extend((json.dumps(value_ids), after_id))
+    if not arms:
+        return None
+    return ' INTERSECT '.join(arms), params
+
+
+# {facet: [{"id", "name", "quizzes"}]}, most used values first
+def facet_counts(connection, selected=None):
+    matching = facet_filter(selected or {})
+    counts = {}
+    for facet, (table, column, values, name_column) in FACETS.items():
+        if matching is None:
+            rows = connection.execute(
+                f'''SELECT c.value_id, v.{name_column}, c.quiz_count
+                    FROM quiz_facet_counts c JOIN {values} v ON v.id = c.value_id
+                    WHERE c.facet = ? ORDER BY c.quiz_count DESC, c.value_id''',
+                (facet,)
+            ).fetchall()
+        else:
+            subquery, params = matching
+            rows = connection.execute(
+                f'''SELECT a.{column}, v.{name_column}, count(*) AS quizzes
+                    FROM {table} a JOIN {values} v ON v.id = a.{column}
+                    WHERE a.quiz_id IN ({subquery})
+                    GROUP BY a.{column} ORDER BY quizzes DESC, a.{column}''',
+                params
+            ).fetchall()
+        counts[facet] = [{"id": value_id, "name": name, "quizzes": quizzes} for value_id, name, quizzes in rows]
+    return counts
+
+
+# {facet: [value ids]} of one quiz
+def quiz_facets(connection, quiz_id):
+    return {
+        facet: [row[0] for row in connection.execute(
+            f"SELECT {column} FROM {table} WHERE quiz_id = ? ORDER BY {column}", (quiz_id,)
+        )]
+        for facet, (table, column, _, _) in FACETS.items()
+    }
+
+
+# Make `value_ids` the quiz's values of `facet`. Only the links that change
+# are written, so the count triggers fire once per actual change. Runs in
+# the caller's transaction; unknown value ids are a 400.
+def set_quiz_facet(connection, quiz_id, facet, value_ids):
+    table, column, values, _ = FACETS[facet]
+    value_ids = sorted(set(value_ids))
+    if value_ids:
+        known = {row[0] for row in connection.execute(
+            f"SELECT id FROM {values} WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(value_ids),)
+        )}
+        unknown = [value_id for value_id in value_ids if value_id not in known]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown {facet} ids: {', '.join(map(str, unknown))}")
+    current = {row[0] for row in connection.execute(f"SELECT {column} FROM {table} WHERE quiz_id = ?", (quiz_id,))}
+    connection.executemany(
+        f"DELETE FROM {table} WHERE {column} = ? AND quiz_id = ?",
+        [(value_id, quiz_id) for value_id in current.difference(value_ids)]
+    )
+    connection.executemany(
+        f"INSERT INTO {table} ({column}, quiz_id) VALUES (?, ?)",
+        [(value_id, quiz_id) for value_id in value_ids if value_id not in current]
+    )
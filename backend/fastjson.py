@@ -0,0 +1,33 @@
+import json
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fast path for list responses: cursor rows (plain tuples) go straight to JSON
+# bytes, skipping the per-row model construction and the second validation
+# pass FastAPI runs for `response_model`. The output is the same document the
+# model path produces: objects with the model's fields, in column order. The
+# column tuples in main.py are the models' fields, and SQLite's column
+# affinity already gives the model types, so no per-value conversion is needed.
+#
+# orjson is used when it is installed; otherwise the standard library encoder
+# is called with the same options as FastAPI's JSONResponse.
+
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_rows(columns, rows):
+    return dumps([dict(zip(columns, row)) for row in rows])
+
+
+class RawJSONResponse(Response):
+    # A JSON response whose body is already encoded
+    media_type = 'application/json'
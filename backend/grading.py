@@ -0,0 +1,135 @@
+import json
+import time
+from operator import eq
+
+from cache import LRUCache
+
+# Attempt answers are positional: the n-th answer belongs to the quiz's n-th
+# question in id order. Answers and answer keys are both packed into bytes,
+# one byte per question, so scoring an attempt is a single C-level pass of
+# operator.eq over two byte strings. attempts.answers stores that packed form
+# as a BLOB; only attempts archived before it did hold "1,0,2" text.
+
+UNANSWERED = 255   # answer byte for a skipped or unparseable answer
+NO_KEY = 254       # key byte for a question without a usable correct_answer
+MAX_CHOICE = 253
+
+
+# Pack an answers string such as "1,0,2" into one byte per question
+def parse_answers(text):
+    packed = bytearray()
+    for token in text.split(','):
+        token = token.strip()
+        if token.isdigit() and int(token) <= MAX_CHOICE:
+            packed.append(int(token))
+        else:
+            packed.append(UNANSWERED)
+    return bytes(packed)
+
+
+# Pack a list of choice indexes, None for a skipped question
+def pack_answers(answers):
+    return bytes(UNANSWERED if answer is None else answer for answer in answers)
+
+
+def unpack_answers(packed):
+    return [None if answer == UNANSWERED else answer for answer in packed]
+
+
+# Packed answers of a stored attempt, whichever form it was stored in
+def decode_answers(value):
+    if isinstance(value, bytes):
+        return value
+    return parse_answers(value) if value else b''
+
+
+# Question choices are stored as a JSON array of strings. Comma-separated
+# text, the old storage format, is still accepted wherever choices come in.
+def parse_choices(value):
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    if text.startswith('['):
+        try:
+            choices = json.loads(text)
+        except ValueError:
+            choices = None
+        if isinstance(choices, list):
+            return choices
+    return [choice.strip() for choice in text.split(',')] if text else []
+
+
+def encode_choices(choices):
+    return json.dumps(list(choices), ensure_ascii=False, separators=(',', ':'))
+
+
+def score_answers(key, answers):
+    return sum(map(eq, answers, key.packed))
+
+
+class AnswerKey:
+    __slots__ = ('quiz_id', 'question_ids', 'packed')
+
+    def __init__(self, quiz_id, question_ids, packed):
+        self.quiz_id = quiz_id
+        self.question_ids = question_ids
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed)
+
+    @classmethod
+    def load(cls, connection, quiz_id):
+        rows = connection.execute(
+            "SELECT id, correct_answer FROM questions WHERE quiz_id = ? ORDER BY id",
+            (quiz_id,)
+        ).fetchall()
+        packed = bytes(
+            answer if isinstance(answer, int) and 0 <= answer <= MAX_CHOICE else NO_KEY
+            for _, answer in rows
+        )
+        return cls(quiz_id, tuple(question_id for question_id, _ in rows), packed)
+
+
+class AnswerKeyCache(LRUCache):
+    # LRU cache of per-quiz answer keys. Question mutations call invalidate();
+    # a key loaded concurrently with an invalidation is not stored over it.
+
+    def __init__(self, max_entries):
+        super().__init__(max_entries)
+
+    def get(self, connection, quiz_id):
+        return self.get_or_load(quiz_id, lambda: AnswerKey.load(connection, quiz_id))
+
+
+# Re-score every attempt of a quiz against its current answer key. Attempts are
+# read in keyset batches and their scores written back one batch per
+# transaction, so the write lock is only held briefly.
+def regrade_quiz(connection, key, batch_size, on_progress=None):
+    started = time.perf_counter()
+    graded = 0
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            "SELECT id, answers FROM attempts WHERE quiz_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (key.quiz_id, after_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        packed_key = key.packed
+        updates = [
+            (sum(map(eq, decode_answers(answers), packed_key)), attempt_id)
+            for attempt_id, answers in rows
+        ]
+        with connection:
+            connection.executemany("UPDATE attempts SET score = ? WHERE id = ?", updates)
+        graded += len(rows)
+        after_id = rows[-1][0]
+        if on_progress is not None:
+            on_progress(graded)
+    return {
+        "quiz_id": key.quiz_id,
+        "questions": len(key),
+        "graded": graded,
+        "elapsed_seconds": round(time.perf_counter() - started, 6),
+    }
@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from db_pool import retry_on_busy
+
+# Persistent background jobs for slow maintenance work.
+#
+# Jobs are rows in the jobs table (migration 8), so they survive restarts and
+# every server process sees the same queue. Endpoints enqueue a job, usually
+# in the same transaction as their own change, and return its id at once;
+# JobRunner threads claim queued jobs with one atomic UPDATE ... RETURNING,
+# run the handler registered for the job's kind and record its result or
+# error. Handlers report progress through the JobContext they are given and
+# must be safe to run again from the start.
+#
+# A claimed job is leased to its runner until lease_expires_at (migration 12),
+# and a heartbeat thread of the runner keeps renewing the leases of the jobs
+# it is running. A running job whose lease has run out belonged to a process
+# that died or hung, on whatever host, and any runner queues it again.
+# Heartbeats cannot renew a lease while a handler's single transaction holds
+# the write lock, so such work leases its job up front for its worst case
+# through JobContext.long_transaction().
+
+job_log = logging.getLogger('pquiz.jobs')
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+JOB_COLUMNS = ('id', 'kind', 'params', 'status', 'done', 'total', 'result', 'error',
+               'created_at', 'started_at', 'finished_at')
+
+
+def _now():
+    return round(time.time(), 3)
+
+
+def _job_dict(row):
+    job = dict(zip(JOB_COLUMNS, row))
+    job["params"] = json.loads(job["params"])
+    if job["result"] is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+# Queue a job; runs inside the caller's transaction, which must commit before
+# a runner can see the job
+def enqueue(connection, kind, params=None):
+    cursor = connection.execute(
+        "INSERT INTO jobs (kind, params, status, done, created_at) VALUES (?, ?, 'queued', 0, ?)",
+        (kind, json.dumps(params or {}), _now())
+    )
+    return cursor.lastrowid
+
+
+def get_job(connection, job_id):
+    row = connection.execute(
+        "SELECT id, kind, params, status, done, total, result, error, created_at, started_at, finished_at "
+        "FROM jobs WHERE id = ?",
+        (job_id,)
+    ).fetchone()
+    return _job_dict(row) if row else None
+
+
+# Newest first; `before_id` continues from the last job of the previous page
+def list_jobs(connection, status=None, limit=50, before_id=None):
+    rows = connection.execute(
+        '''SELECT id, kind, params, status, done, total, result, error, created_at, started_at, finished_at
+           FROM jobs WHERE (? IS NULL OR status = ?) AND (? IS NULL OR id < ?)
+           ORDER BY id DESC LIMIT ?''',
+        (status, status, before_id, before_id, limit)
+    ).fetchall()
+    return [_job_dict(row) for row in rows]
+
+
+class JobContext:
+    # Handed to a job handler: its connection, and progress reporting that
+    # readers of GET /jobs/{id} see as done/total
+
+    def __init__(self, connection, job_id, worker_id, lease_seconds):
+        self.connection = connection
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+
+    def progress(self, done, total=None):
+        def update():
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE jobs SET done = ?, total = coalesce(?, total) WHERE id = ?",
+                    (done, total, self.job_id)
+                )
+        retry_on_busy(update)
+
+    # Wraps work that keeps the write lock for up to `seconds`: the job stays
+    # leased that long, then back to the runner's usual lease afterwards
+    @contextmanager
+    def long_transaction(self, seconds):
+        self._lease(_now() + max(seconds, self.lease_seconds))
+        try:
+            yield
+        finally:
+            self._lease(_now() + self.lease_seconds)
+
+    def _lease(self, expires_at):
+        def update():
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                    (expires_at, self.job_id, self.worker_id)
+                )
+        retry_on_busy(update)
+
+
+class JobRunner:
+    # `handlers` maps a job kind to fn(context, **params) -> JSON-able result
+
+    def __init__(self, connect, handlers, workers, poll_interval, retention_days, lease_seconds):
+        self.connect = connect
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention_days = retention_days
+        self.lease_seconds = lease_seconds
+        # Unique per runner, so a restarted process reusing a pid never owns its predecessor's jobs
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._threads = []
+        self._heartbeat_thread = None
+        self._wake = threading.Condition()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._requeued = 0
+        self._errors = 0
+        self._pruned_at = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        connection = self.connect()
+        try:
+            self._requeue_expired(connection)
+        finally:
+            connection.close()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-runner-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-runner-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        self.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join(timeout)
+        self._threads = []
+        self._heartbeat_thread = None
+
+    # Called after enqueue() commits, so an idle worker starts right away
+    def wake(self):
+        with self._wake:
+            self._wake.notify_all()
+
+    # Running jobs whose lease has run out, whichever runner claimed them;
+    # jobs without a lease were claimed before migration 12
+    def _requeue_expired(self, connection):
+        def requeue():
+            with connection:
+                return connection.execute(
+                    '''UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, lease_expires_at = NULL
+                       WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)''',
+                    (_now(),)
+                ).rowcount
+        requeued = retry_on_busy(requeue)
+        if requeued:
+            with self._lock:
+                self._requeued += requeued
+
+    # Renew the leases of this runner's jobs, never cutting short a lease
+    # taken by long_transaction()
+    def _renew_leases(self, connection):
+        def renew():
+            with connection:
+                connection.execute(
+                    '''UPDATE jobs SET lease_expires_at = max(coalesce(lease_expires_at, 0), ?)
+                       WHERE status = 'running' AND worker = ?''',
+                    (_now() + self.lease_seconds, self.worker_id)
+                )
+        retry_on_busy(renew)
+
+    def _claim(self, connection):
+        def claim():
+            now = _now()
+            with connection:
+                return connection.execute(
+                    '''UPDATE jobs SET status = 'running', started_at = ?, worker = ?, lease_expires_at = ?
+                       WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+                       RETURNING id, kind, params''',
+                    (now, self.worker_id, now + self.lease_seconds)
+                ).fetchone()
+        return retry_on_busy(claim)
+
+    # A job whose lease was lost meanwhile belongs to another runner now, and
+    # its row is left alone
+    def _finish(self, connection, job_id, status, result=None, error=None):
+        def finish():
+            with connection:
+                connection.execute(
+                    '''UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL
+                       WHERE id = ? AND status = 'running' AND worker = ?''',
+                    (status, None if result is None else json.dumps(result), error, _now(), job_id, self.worker_id)
+                )
+        retry_on_busy(finish)
+
+    # Renews leases and requeues expired ones a few times per lease period,
+    # so a job outlives a missed heartbeat or two
+    def _heartbeat(self):
+        connection = self.connect()
+        try:
+            while not self._stopping.wait(self.lease_seconds / 3):
+                try:
+                    with self._lock:
+                        running = self._running
+                    if running:
+                        self._renew_leases(connection)
+                    self._requeue_expired(connection)
+                except Exception:
+                    if connection.in_transaction:
+                        connection.rollback()
+        finally:
+            connection.close()
+
+    def _prune(self, connection):
+        if self.retention_days <= 0 or time.monotonic() - self._pruned_at < 3600:
+            return
+        self._pruned_at = time.monotonic()
+        cutoff = time.time() - self.retention_days * 86400
+        with connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (cutoff,)
+            )
+
+    def _run(self):
+        connection = self.connect()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    claimed = self._claim(connection)
+                    if claimed is None:
+                        self._prune(connection)
+                except Exception:
+                    job_log.exception("Claiming a job failed")
+                    self._recover(connection)
+                    claimed = None
+                if claimed is None:
+                    with self._wake:
+                        self._wake.wait(self.poll_interval)
+                    continue
+                try:
+                    self._execute(connection, *claimed)
+                except Exception:
+                    # The outcome could not be recorded; the job's lease runs
+                    # out and another runner queues it again
+                    job_log.exception("Recording the outcome of job %s (%s) failed", claimed[0], claimed[1])
+                    self._recover(connection)
+        finally:
+            connection.close()
+
+    def _recover(self, connection):
+        with self._lock:
+            self._errors += 1
+        if connection.in_transaction:
+            connection.rollback()
+
+    def _execute(self, connection, job_id, kind, params):
+        with self._lock:
+            self._running += 1
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {kind}")
+            context = JobContext(connection, job_id, self.worker_id, self.lease_seconds)
+            result = handler(context, **json.loads(params))
+        except Exception as exc:
+            if connection.in_transaction:
+                connection.rollback()
+            self._finish(connection, job_id, 'failed', error=f"{type(exc).__name__}: {exc}")
+            with self._lock:
+                self._failed += 1
+        else:
+            self._finish(connection, job_id, 'succeeded', result=result)
+            with self._lock:
+                self._succeeded += 1
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": len(self._threads),
+                "running": self._running,
+                "succeeded": self._succeeded,
+                "failed": self._failed,
+                "requeued": self._requeued,
+                "errors": self._errors,
+            }
@@ -0,0 +1,296 @@
+import asyncio
+import json
+
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+import settings
+from grading import MAX_CHOICE, NO_KEY, UNANSWERED
+from write_queue import WriterQueueFull
+
+# Live classroom sessions over WebSockets, one room per quiz.
+#
+# The host (connected with host=true) moves the room through the quiz with
+# {"type": "next"} and finishes it with {"type": "end"}; participants answer
+# the current question with {"type": "answer", "choice": n}. The server sends
+# JSON messages of type joined, question, tally, reveal, graded, finished and
+# error. When the session ends, every participant's answers become one
+# attempt, submitted through the group-commit attempt writer.
+#
+# Fan-out: a broadcast is serialized once and the same string is queued for
+# every client. Each client has a bounded queue drained by its own sender
+# task, so broadcasting never waits on a socket; a client whose queue is full
+# is too slow to keep up and is disconnected (close code 1013, try again
+# later) instead of stalling the room. Tallies are coalesced and broadcast at
+# most once per LIVE_TALLY_INTERVAL_MS, however fast answers arrive.
+#
+# Rooms live in the server process, so all participants of a room must reach
+# the same process (a single worker, or sticky routing by quiz id).
+
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_NOT_FOUND = 4404
+CLOSE_ROOM_FULL = 4429
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':'))
+
+
+class LiveClient:
+    __slots__ = ('websocket', 'user_id', 'host', 'queue', 'sender')
+
+    def __init__(self, websocket, user_id, host, queue_size):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.host = host
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.sender = None
+
+    # Queue an encoded message; False when the client has fallen too far behind
+    def offer(self, data):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    # A send that fails (closed socket, disconnect) ends the loop and takes the
+    # client out of the room, so broadcasts stop queueing for it
+    async def send_loop(self, room):
+        try:
+            while True:
+                data = await self.queue.get()
+                await self.websocket.send_text(data)
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            pass
+        finally:
+            room.remove(self)
+
+
+class LiveRoom:
+    def __init__(self, sessions, quiz_id, questions, correct_answers):
+        self.sessions = sessions
+        self.quiz_id = quiz_id
+        self.questions = questions              # [(id, question_text, [choice, ...])] in id order
+        self.correct_answers = correct_answers  # packed answer key, one byte per question
+        self.clients = set()
+        self.current = -1
+        self.answers = {}                       # user_id -> {question index: choice}
+        self.counts = {}                        # choice -> answers to the current question
+        self._tally_dirty = False
+        self._tally_task = asyncio.create_task(self._tally_loop())
+
+    # A question is open between "next" and the following "next" or "end";
+    # after the last question `current` stays at len(questions)
+    def _open(self):
+        return 0 <= self.current < len(self.questions)
+
+    @property
+    def participants(self):
+        return sum(1 for client in self.clients if not client.host)
+
+    def add(self, client):
+        self.clients.add(client)
+        client.sender = asyncio.create_task(client.send_loop(self))
+        self.send(client, {"type": "joined", "quiz_id": self.quiz_id,
+                           "participants": self.participants, "total_questions": len(self.questions)})
+        if self._open():
+            self.send(client, self._question_message())
+            self.send(client, self._tally_message())
+
+    def remove(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            if client.sender is not asyncio.current_task():
+                client.sender.cancel()
+
+    def close(self):
+        self._tally_task.cancel()
+        for client in list(self.clients):
+            self.remove(client)
+
+    def send(self, client, message):
+        if not client.offer(encode(message)):
+            self._evict(client)
+
+    def broadcast(self, message):
+        data = encode(message)
+        for client in list(self.clients):
+            if not client.offer(data):
+                self._evict(client)
+        self.sessions.broadcasts += 1
+        self.sessions.messages += len(self.clients)
+
+    def _evict(self, client):
+        self.remove(client)
+        self.sessions.evicted += 1
+        asyncio.create_task(self._close(client.websocket, CLOSE_TRY_AGAIN_LATER))
+
+    @staticmethod
+    async def _close(websocket, code):
+        try:
+            await websocket.close(code=code)
+        except RuntimeError:
+            pass
+
+    def _question_message(self):
+        question_id, text, choices = self.questions[self.current]
+        return {"type": "question", "index": self.current, "total": len(self.questions),
+                "question": {"id": question_id, "question_text": text, "choices": choices}}
+
+    def _tally_message(self):
+        return {"type": "tally", "index": self.current, "question_id": self.questions[self.current][0],
+                "answered": sum(self.counts.values()), "participants": self.participants,
+                "counts": {str(choice): count for choice, count in sorted(self.counts.items())}}
+
+    async def _tally_loop(self):
+        interval = settings.LIVE_TALLY_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            if self._tally_dirty and self._open():
+                self._tally_dirty = False
+                self.broadcast(self._tally_message())
+
+    def _reveal(self):
+        correct = self.correct_answers[self.current]
+        self.broadcast({"type": "reveal", "index": self.current, "question_id": self.questions[self.current][0],
+                        "correct_answer": None if correct == NO_KEY else correct})
+
+    async def handle(self, client, message):
+        kind = message.get("type") if isinstance(message, dict) else None
+        if kind == "answer" and not client.host:
+            self._answer(client, message)
+        elif kind == "next" and client.host:
+            self._next()
+        elif kind == "end" and client.host:
+            await self._end()
+        else:
+            self.send(client, {"type": "error", "detail": f"Unexpected message: {kind!r}"})
+
+    def _answer(self, client, message):
+        choice = message.get("choice")
+        if not self._open():
+            self.send(client, {"type": "error", "detail": "No question is open"})
+            return
+        if not isinstance(choice, int) or isinstance(choice, bool) or not 0 <= choice <= MAX_CHOICE:
+            self.send(client, {"type": "error", "detail": "Invalid choice"})
+            return
+        answers = self.answers.setdefault(client.user_id, {})
+        previous = answers.get(self.current)
+        if previous is not None:
+            self.counts[previous] -= 1
+            if not self.counts[previous]:
+                del self.counts[previous]
+        answers[self.current] = choice
+        self.counts[choice] = self.counts.get(choice, 0) + 1
+        self._tally_dirty = True
+
+    def _next(self):
+        if self._open():
+            self._reveal()
+        if self.current + 1 >= len(self.questions):
+            self.current = len(self.questions)
+            return
+        self.current += 1
+        self.counts = {}
+        self._tally_dirty = False
+        self.broadcast(self._question_message())
+
+    async def _end(self):
+        if self._open():
+            self._reveal()
+        answers, self.answers = self.answers, {}
+        self.current = -1
+        self.counts = {}
+        total = len(self.questions)
+        submitted = []
+        for user_id, chosen in answers.items():
+            packed = bytes(chosen.get(index, UNANSWERED) for index in range(total))
+            try:
+                future = self.sessions.submit_attempt((self.quiz_id, user_id, packed))
+            except WriterQueueFull:
+                continue
+            submitted.append((user_id, asyncio.wrap_future(future)))
+        results = await asyncio.gather(*(future for _, future in submitted), return_exceptions=True)
+        graded = {}
+        for (user_id, _), result in zip(submitted, results):
+            if not isinstance(result, BaseException):
+                graded[user_id] = result
+        for client in list(self.clients):
+            if client.user_id in graded:
+                attempt_id, score = graded[client.user_id]
+                self.send(client, {"type": "graded", "attempt_id": attempt_id, "score": score, "out_of": total})
+            elif client.user_id in answers and not client.host:
+                self.send(client, {"type": "error", "detail": "Your attempt could not be saved"})
+        self.broadcast({"type": "finished", "attempts": len(graded), "participants": len(answers)})
+
+
+class LiveSessions:
+    # The rooms of this process. `load_quiz(quiz_id)` runs on the threadpool
+    # and returns (questions, packed answer key), or None for an unknown quiz;
+    # `submit_attempt(row)` queues an attempt write and returns its Future.
+
+    def __init__(self, load_quiz, submit_attempt):
+        self.load_quiz = load_quiz
+        self.submit_attempt = submit_attempt
+        self.rooms = {}
+        self._loading = {}
+        self.broadcasts = 0
+        self.messages = 0
+        self.evicted = 0
+
+    async def _room(self, quiz_id):
+        room = self.rooms.get(quiz_id)
+        if room is not None:
+            return room
+        loading = self._loading.get(quiz_id)
+        if loading is None:
+            loading = self._loading[quiz_id] = asyncio.ensure_future(run_in_threadpool(self.load_quiz, quiz_id))
+        try:
+            loaded = await loading
+        finally:
+            self._loading.pop(quiz_id, None)
+        if loaded is None:
+            return None
+        room = self.rooms.get(quiz_id)
+        if room is None:
+            room = self.rooms[quiz_id] = LiveRoom(self, quiz_id, *loaded)
+        return room
+
+    async def serve(self, websocket: WebSocket, quiz_id, user_id, host):
+        await websocket.accept()
+        room = await self._room(quiz_id)
+        if room is None:
+            await websocket.close(code=CLOSE_NOT_FOUND, reason="Quiz not found")
+            return
+        if len(room.clients) >= settings.LIVE_MAX_CLIENTS:
+            await websocket.close(code=CLOSE_ROOM_FULL, reason="Room is full")
+            return
+        client = LiveClient(websocket, user_id, host, settings.LIVE_CLIENT_QUEUE_SIZE)
+        room.add(client)
+        try:
+            while client in room.clients:
+                text = await websocket.receive_text()
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    room.send(client, {"type": "error", "detail": "Messages must be JSON"})
+                    continue
+                await room.handle(client, message)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            room.remove(client)
+            if not room.clients and self.rooms.get(quiz_id) is room:
+                del self.rooms[quiz_id]
+                room.close()
+            await asyncio.gather(client.sender, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "rooms": len(self.rooms),
+            "clients": sum(len(room.clients) for room in self.rooms.values()),
+            "broadcasts": self.broadcasts,
+            "messages": self.messages,
+            "evicted": self.evicted,
+        }
@@ -1,63 +1,327 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import random
+import threading
+import time
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, BeforeValidator, Field, ValidationError
+from starlette.concurrency import run_in_threadpool
+from typing import Annotated, Any, List, Optional
 import sqlite3
 
-app = FastAPI()
+import settings
+from admission import AdmissionController, AdmissionMiddleware, TokenBuckets, parse_route_limits
+from analytics import ItemAnalysisCache
+from archive import (
+    Archiver, archive_old_attempts, delete_archived_quiz, find_archived_attempt, index_archived_users, list_archives,
+)
+from bulk_import import describe_validation_error, format_from_content_type, import_rows, insert_chunk
+from cache import CachedBody, ResponseCache, etag_matches
+from db_pool import (
+    ConnectionPool, DatabaseBusy, PoolTimeout, contention, ensure_wal, open_connection, retry_on_busy, retry_writes,
+)
+from export import EXPORT_FORMATS, MEDIA_TYPES, export_filename, stream_export
+from facets import FACETS, facet_counts, facet_filter, quiz_facets, set_quiz_facet
+from fastjson import RawJSONResponse, encode_rows
+from grading import (
+    MAX_CHOICE, AnswerKeyCache, decode_answers, encode_choices, pack_answers, parse_answers, parse_choices,
+    regrade_quiz, score_answers, unpack_answers,
+)
+from jobs import JOB_STATUSES, JobRunner, enqueue, get_job, list_jobs
+from live import LiveSessions
+from metrics import MetricsMiddleware, TracedConnection, instrument_connection, metrics
+from migrations import migrate
+from pagination import NEXT_PAGE_HEADER, PageParams, encode_page_token, keyset_query, stream_ndjson
+from sampling import QuestionIdCache, attempted_quizzes, sample_question_ids
+from search import SEARCH_KINDS, build_match_query, search_questions, search_quizzes
+import stats
+from write_queue import GroupCommitWriter, WriterQueueFull
 
-# Database initialization function
+@asynccontextmanager
+async def lifespan(app):
+    attempt_writer.start()
+    archiver.start()
+    job_runner.start()
+    yield
+    job_runner.stop()
+    archiver.stop()
+    attempt_writer.stop()
+    db_pool.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Requests beyond the concurrency budgets are shed before they reach the
+# threadpool; MetricsMiddleware sits outside, so shed requests are counted too
+admission = AdmissionController(
+    settings.ADMISSION_READ_LIMIT, settings.ADMISSION_READ_QUEUE,
+    settings.ADMISSION_WRITE_LIMIT, settings.ADMISSION_WRITE_QUEUE,
+    settings.ADMISSION_QUEUE_TIMEOUT_SECONDS, settings.ADMISSION_RETRY_AFTER_SECONDS,
+    parse_route_limits(settings.ADMISSION_ROUTE_LIMITS),
+)
+app.add_middleware(AdmissionMiddleware, controller=admission, router=app.router)
+app.add_middleware(MetricsMiddleware)
+
+# Per-user attempt rate limit, off unless ATTEMPT_RATE_PER_USER is set
+attempt_rate_limit = (
+    TokenBuckets(settings.ATTEMPT_RATE_PER_USER, settings.ATTEMPT_BURST_PER_USER, settings.ATTEMPT_RATE_MAX_USERS)
+    if settings.ATTEMPT_RATE_PER_USER > 0 else None
+)
+
+# Database initialization function: bring the schema up to the latest migration
 def initialize_db():
-    connection = sqlite3.connect('pquiz_db.sqlite3')
-    cursor = connection.cursor()
+    connection = get_db_connection()
+    try:
+        ensure_wal(connection)
+        migrate(connection)
+    finally:
+        connection.close()
 
-    # Create tables if not exist
-    cursor.execute('''CREATE TABLE IF NOT EXISTS quizzes (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        title TEXT NOT NULL,
-                        description TEXT)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS questions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        quiz_id INTEGER,
-                        question_text TEXT NOT NULL,
-                        choices TEXT NOT NULL,
-                        correct_answer INTEGER,
-                        FOREIGN KEY (quiz_id) REFERENCES quizzes (id))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS attempts (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        quiz_id INTEGER,
-                        user_id INTEGER,
-                        answers TEXT NOT NULL,
-                        FOREIGN KEY (quiz_id) REFERENCES quizzes (id))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS categories (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        category_name TEXT NOT NULL,
-                        description TEXT)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS levels (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        level_name TEXT NOT NULL,
-                        description TEXT)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS topics (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        topic_name TEXT NOT NULL,
-                        description TEXT)''')
-
-    connection.commit()
-    connection.close()
+# Function to get a new, pre-tuned database connection with SQL tracing
+def get_db_connection():
+    return instrument_connection(open_connection(settings.DATABASE_PATH, factory=TracedConnection))
 
 # Initialize the database at startup
 initialize_db()
 
-# Function to get a database connection
-def get_db_connection():
-    return sqlite3.connect('pquiz_db.sqlite3')
+# Shared pool of reusable connections, handed to endpoints through get_db
+db_pool = ConnectionPool(get_db_connection, settings.DB_POOL_SIZE, settings.DB_POOL_TIMEOUT)
+
+# FastAPI dependency: check a connection out of the pool for one request
+def get_db():
+    connection = db_pool.acquire()
+    try:
+        yield connection
+    finally:
+        db_pool.release(connection)
+
+@app.exception_handler(PoolTimeout)
+@app.exception_handler(DatabaseBusy)
+@app.exception_handler(WriterQueueFull)
+def overloaded_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+# Per-quiz answer keys, kept until a question of the quiz changes
+answer_keys = AnswerKeyCache(settings.ANSWER_KEY_CACHE_SIZE)
+
+# Rendered GET /quizzes/{quiz_id}/full bodies, keyed by quiz id
+quiz_cache = ResponseCache(settings.QUIZ_CACHE_MAX_BYTES)
+
+# Per-quiz question id arrays that random samples are drawn from
+question_pools = QuestionIdCache(settings.SAMPLE_POOL_CACHE_SIZE)
+
+# Per-quiz item analysis statistics, updated with new attempts as they arrive
+item_analysis = ItemAnalysisCache(settings.ANALYTICS_CACHE_SIZE, settings.ANALYTICS_BATCH_SIZE)
+
+# Called after every committed change to a quiz or its questions
+def invalidate_quiz(quiz_id):
+    answer_keys.invalidate(quiz_id)
+    quiz_cache.invalidate(quiz_id)
+    question_pools.invalidate(quiz_id)
+    item_analysis.invalidate(quiz_id)
+
+# Quiz versions (see migration 6) this process's caches were last checked
+# against, least recently checked first, for as many quizzes as the caches
+# hold; a quiz forgotten here is just invalidated on its next check
+QUIZ_VERSIONS_SEEN_SIZE = max(settings.ANSWER_KEY_CACHE_SIZE, settings.SAMPLE_POOL_CACHE_SIZE,
+                              settings.ANALYTICS_CACHE_SIZE)
+quiz_versions_seen = OrderedDict()
+quiz_versions_lock = threading.Lock()
+
+# With several server processes, another process may have changed the quiz:
+# compare its shared version counter with the last one seen here and drop the
+# local cache entries if it moved. A single process sees all its own changes.
+def sync_quiz_caches(connection, quiz_id):
+    if settings.WORKERS <= 1:
+        return
+    row = connection.execute("SELECT version FROM quiz_versions WHERE quiz_id = ?", (quiz_id,)).fetchone()
+    version = row[0] if row else 0
+    with quiz_versions_lock:
+        if quiz_versions_seen.get(quiz_id) == version:
+            quiz_versions_seen.move_to_end(quiz_id)
+            return
+    invalidate_quiz(quiz_id)
+    with quiz_versions_lock:
+        quiz_versions_seen[quiz_id] = version
+        quiz_versions_seen.move_to_end(quiz_id)
+        while len(quiz_versions_seen) > QUIZ_VERSIONS_SEEN_SIZE:
+            quiz_versions_seen.popitem(last=False)
+
+# Runs on the attempt writer thread, inside the batch transaction; grades the
+# attempt against the cached answer key and stores the score with it.
+# Rows are (quiz_id, user_id, packed answers, client_token); an attempt whose
+# client token is already stored is a client retry and returns the stored attempt.
+# Tokens are looked up in client_tokens, which outlives archived attempts.
+def insert_attempt(connection, row):
+    quiz_id, user_id, answers, client_token = row
+    if client_token is not None:
+        stored = connection.execute(
+            "SELECT attempt_id, score FROM client_tokens WHERE client_token = ?", (client_token,)
+        ).fetchone()
+        if stored is not None:
+            return tuple(stored)
+    sync_quiz_caches(connection, quiz_id)
+    score = score_answers(answer_keys.get(connection, quiz_id), answers)
+    cursor = connection.execute(
+        '''INSERT INTO attempts (quiz_id, user_id, answers, score, created_at, client_token) VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (client_token) WHERE client_token IS NOT NULL DO NOTHING''',
+        (quiz_id, user_id, answers, score, int(time.time()), client_token)
+    )
+    if cursor.rowcount == 0:
+        return tuple(connection.execute(
+            "SELECT id, score FROM attempts WHERE client_token = ?", (client_token,)
+        ).fetchone())
+    if client_token is not None:
+        connection.execute(
+            "INSERT INTO client_tokens (client_token, attempt_id, score) VALUES (?, ?, ?)",
+            (client_token, cursor.lastrowid, score)
+        )
+    stats.record_attempt(connection, quiz_id, user_id, cursor.lastrowid, score)
+    return cursor.lastrowid, score
+
+# Attempt submissions arrive in bursts (the end of a timed exam), so they are
+# group-committed by a single writer thread instead of one transaction each
+attempt_writer = GroupCommitWriter(
+    "attempt-writer", get_db_connection, insert_attempt,
+    settings.ATTEMPT_BATCH_SIZE, settings.ATTEMPT_FLUSH_INTERVAL_MS, settings.ATTEMPT_QUEUE_SIZE,
+    retry=retry_on_busy,
+)
+
+# Moves old attempts into monthly archive databases in the background
+archiver = Archiver(get_db_connection, settings.ARCHIVE_INTERVAL_SECONDS, settings.ARCHIVE_AFTER_DAYS)
+
+# Background job handlers (see jobs.py); each runs on a job runner thread with
+# its own connection and may be run again from the start after a crash
+
+# Delete a quiz's attempts and questions in chunks, each its own short write
+# transaction, then whatever its archived attempts left behind. The quiz row
+# itself is already gone (see delete_quiz).
+def cascade_delete_quiz(ctx, quiz_id):
+    connection = ctx.connection
+    counts = {}
+    total = connection.execute(
+        "SELECT (SELECT count(*) FROM attempts WHERE quiz_id = ?) + (SELECT count(*) FROM questions WHERE quiz_id = ?)",
+        (quiz_id, quiz_id)
+    ).fetchone()[0]
+    ctx.progress(0, total)
+    for table in ('attempts', 'questions'):
+        def delete_chunk():
+            with connection:
+                return connection.execute(
+                    f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE quiz_id = ? LIMIT ?)",
+                    (quiz_id, settings.JOB_DELETE_CHUNK_SIZE)
+                ).rowcount
+        counts[table] = 0
+        while True:
+            deleted = retry_on_busy(delete_chunk)
+            if not deleted:
+                break
+            counts[table] += deleted
+            ctx.progress(sum(counts.values()), total)
+    counts['archived_attempts'] = delete_archived_quiz(connection, quiz_id)
+
+    def clear_stats():
+        with connection:
+            stats.clear_quiz_stats(connection, quiz_id)
+    retry_on_busy(clear_stats)
+    invalidate_quiz(quiz_id)
+    return {"quiz_id": quiz_id, **counts}
+
+def regrade_job(ctx, quiz_id):
+    connection = ctx.connection
+    sync_quiz_caches(connection, quiz_id)
+    key = answer_keys.get(connection, quiz_id)
+    total = connection.execute("SELECT count(*) FROM attempts WHERE quiz_id = ?", (quiz_id,)).fetchone()[0]
+    ctx.progress(0, total)
+    result = retry_on_busy(lambda: regrade_quiz(connection, key, settings.REGRADE_BATCH_SIZE,
+                                                on_progress=lambda graded: ctx.progress(graded, total)))
+    retry_on_busy(lambda: stats.rebuild_quiz_stats(connection, quiz_id))
+    return result
+
+def rebuild_stats_job(ctx, quiz_id=None):
+    started = time.perf_counter()
+    if quiz_id is None:
+        with ctx.long_transaction(settings.JOB_MAINTENANCE_LEASE_SECONDS):
+            retry_on_busy(lambda: stats.rebuild_all_stats(ctx.connection))
+    else:
+        retry_on_busy(lambda: stats.rebuild_quiz_stats(ctx.connection, quiz_id))
+    return {"quiz_id": quiz_id, "elapsed_seconds": round(time.perf_counter() - started, 6)}
+
+# VACUUM rewrites the whole file and holds the write lock while it does
+def vacuum_job(ctx):
+    started = time.perf_counter()
+    pages_before = ctx.connection.execute("PRAGMA page_count").fetchone()[0]
+    with ctx.long_transaction(settings.JOB_MAINTENANCE_LEASE_SECONDS):
+        retry_on_busy(lambda: ctx.connection.execute("VACUUM"))
+    pages_after = ctx.connection.execute("PRAGMA page_count").fetchone()[0]
+    return {"pages_before": pages_before, "pages_after": pages_after,
+            "elapsed_seconds": round(time.perf_counter() - started, 6)}
+
+def analyze_job(ctx):
+    started = time.perf_counter()
+    def analyze():
+        with ctx.connection:
+            ctx.connection.execute("ANALYZE")
+    with ctx.long_transaction(settings.JOB_MAINTENANCE_LEASE_SECONDS):
+        retry_on_busy(analyze)
+    ctx.connection.execute("PRAGMA optimize")
+    return {"elapsed_seconds": round(time.perf_counter() - started, 6)}
+
+def archive_job(ctx, after_days=None):
+    return {"moved": archive_old_attempts(ctx.connection, after_days)}
+
+# Queued by migration 14 for attempts archived before it
+def index_archives_job(ctx):
+    return {"added": index_archived_users(ctx.connection)}
+
+JOB_HANDLERS = {
+    "delete_quiz": cascade_delete_quiz,
+    "regrade": regrade_job,
+    "rebuild_stats": rebuild_stats_job,
+    "vacuum": vacuum_job,
+    "analyze": analyze_job,
+    "archive": archive_job,
+    "index_archives": index_archives_job,
+}
+
+# Runs queued maintenance jobs on background threads
+job_runner = JobRunner(get_db_connection, JOB_HANDLERS, settings.JOB_WORKERS,
+                       settings.JOB_POLL_INTERVAL_SECONDS, settings.JOB_RETENTION_DAYS,
+                       settings.JOB_LEASE_SECONDS)
+
+# Live sessions load the quiz's questions and answer key once per room
+def load_live_quiz(quiz_id):
+    connection = db_pool.acquire()
+    try:
+        if connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is None:
+            return None
+        sync_quiz_caches(connection, quiz_id)
+        questions = [
+            (question_id, text, json.loads(choices)) for question_id, text, choices in connection.execute(
+                "SELECT id, question_text, choices FROM questions WHERE quiz_id = ? ORDER BY id", (quiz_id,)
+            )
+        ]
+        return questions, answer_keys.get(connection, quiz_id).packed
+    finally:
+        db_pool.release(connection)
+
+live_sessions = LiveSessions(load_live_quiz, lambda row: attempt_writer.submit((*row, None)))
 
 # Define Pydantic models for request/response validation
 
+# Choices are a list of strings; "a,b,c" text is still accepted and split
+Choices = Annotated[List[str], BeforeValidator(parse_choices)]
+
+# Answers are one choice index per question, in question id order, null for
+# a skipped question. "1,0,2" text is still accepted; as before, an answer
+# in it that is not a choice index counts as skipped.
+Answers = Annotated[
+    List[Optional[Annotated[int, Field(ge=0, le=MAX_CHOICE)]]],
+    BeforeValidator(lambda value: unpack_answers(parse_answers(value)) if isinstance(value, str) else value),
+]
+
 class QuizCreate(BaseModel):
     title: str
     description: Optional[str] = None
@@ -70,26 +334,168 @@ class QuizResponse(BaseModel):
 class QuestionCreate(BaseModel):
     quiz_id: int
     question_text: str
-    choices: str
+    choices: Choices
     correct_answer: int
 
 class QuestionResponse(BaseModel):
     id: int
     quiz_id: int
     question_text: str
-    choices: str
+    choices: Choices
     correct_answer: int
 
+class QuizFullResponse(QuizResponse):
+    questions: List[QuestionResponse]
+
+class BulkImportError(BaseModel):
+    row: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkImportError]
+    elapsed_seconds: float
+    rows_per_second: float
+
 class AttemptCreate(BaseModel):
     quiz_id: int
     user_id: int
-    answers: str
+    answers: Answers
+    # Client-generated id that makes resubmitting the same attempt harmless
+    client_token: Optional[str] = None
 
 class AttemptResponse(BaseModel):
     id: int
     quiz_id: int
     user_id: int
-    answers: str
+    answers: Answers
+    score: Optional[int] = None
+
+# Items are validated one by one in create_attempts_batch, so a malformed
+# attempt fails alone instead of failing the whole batch with 422
+class AttemptBatch(BaseModel):
+    attempts: List[Any]
+
+class AttemptBatchItem(BaseModel):
+    client_token: Optional[str] = None
+    id: Optional[int] = None
+    score: Optional[int] = None
+    error: Optional[str] = None
+    # Set when the attempt was refused for now (rate limited) rather than for good
+    retry_after: Optional[int] = None
+
+class AttemptBatchResult(BaseModel):
+    results: List[AttemptBatchItem]
+
+class JobAccepted(BaseModel):
+    job_id: int
+    kind: str
+    status: str
+    message: Optional[str] = None
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    params: dict
+    status: str
+    done: int
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    attempt_id: int
+    user_id: Optional[int] = None
+    score: int
+
+class LeaderboardResponse(BaseModel):
+    quiz_id: int
+    entries: List[LeaderboardEntry]
+
+class ScoreCount(BaseModel):
+    score: int
+    count: int
+
+class QuizStatsResponse(BaseModel):
+    quiz_id: int
+    attempt_count: int
+    mean_score: Optional[float] = None
+    stddev_score: Optional[float] = None
+    min_score: Optional[int] = None
+    max_score: Optional[int] = None
+    distribution: List[ScoreCount]
+
+class ChoiceAnalytics(BaseModel):
+    choice: int
+    label: Optional[str] = None
+    correct: bool
+    count: int
+    proportion: Optional[float] = None
+    mean_total_score: Optional[float] = None
+
+class ItemAnalytics(BaseModel):
+    question_id: int
+    quiz_id: int
+    attempts: int
+    answered: int
+    unanswered: int
+    p_value: Optional[float] = None
+    point_biserial: Optional[float] = None
+    corrected_point_biserial: Optional[float] = None
+    choices: List[ChoiceAnalytics]
+
+class QuizAnalyticsResponse(BaseModel):
+    quiz_id: int
+    attempts: int
+    last_attempt_id: int
+    updated_at: Optional[int] = None
+    questions: List[ItemAnalytics]
+
+class SearchResult(BaseModel):
+    kind: str
+    id: int
+    quiz_id: Optional[int] = None
+    title: str
+    snippet: str
+    rank: float
+
+class SearchResponse(BaseModel):
+    query: str
+    kind: str
+    results: List[SearchResult]
+    next_offset: Optional[int] = None
+
+class QuestionSample(BaseModel):
+    seed: int
+    pool_size: int
+    excluded_quizzes: List[int]
+    questions: List[QuestionResponse]
+
+class FacetValueCount(BaseModel):
+    id: int
+    name: str
+    quizzes: int
+
+class FacetCountsResponse(BaseModel):
+    category: List[FacetValueCount]
+    level: List[FacetValueCount]
+    topic: List[FacetValueCount]
+
+class QuizFacets(BaseModel):
+    category: List[int]
+    level: List[int]
+    topic: List[int]
+
+# Facets left out are not changed
+class QuizFacetsUpdate(BaseModel):
+    category: Optional[List[int]] = None
+    level: Optional[List[int]] = None
+    topic: Optional[List[int]] = None
 
 class CategoryCreate(BaseModel):
     category_name: str
@@ -118,280 +524,648 @@ class TopicResponse(BaseModel):
     topic_name: str
     description: Optional[str] = None
 
+# Column lists used by the keyset-paginated list endpoints
+QUIZ_COLUMNS = ('id', 'title', 'description')
+CATEGORY_COLUMNS = ('id', 'category_name', 'description')
+LEVEL_COLUMNS = ('id', 'level_name', 'description')
+TOPIC_COLUMNS = ('id', 'topic_name', 'description')
+QUESTION_COLUMNS = ('id', 'quiz_id', 'question_text', 'choices', 'correct_answer')
+
+# Serve one keyset page of a table, or stream the rows after the cursor as NDJSON.
+# Pages are encoded straight from the rows unless FAST_JSON_LISTS is off.
+def list_rows(connection, response, table, columns, model, page, where=None):
+    sql, params = keyset_query(table, columns, page.after_id, page.limit, where)
+    if page.stream:
+        return StreamingResponse(stream_ndjson(db_pool, sql, params, columns), media_type="application/x-ndjson")
+    rows = connection.execute(sql, params).fetchall()
+    if len(rows) == page.limit:
+        response.headers[NEXT_PAGE_HEADER] = encode_page_token(rows[-1][0])
+    if settings.FAST_JSON_LISTS:
+        return RawJSONResponse(encode_rows(columns, rows), headers=dict(response.headers))
+    return [model(**dict(zip(columns, row))) for row in rows]
+
+# Health and connection pool statistics
+
+@app.get("/health", response_model=dict)
+def health():
+    healthy = db_pool.healthy()
+    content = {
+        "status": "ok" if healthy else "unavailable",
+        "db_pool": db_pool.stats(),
+        "attempt_writer": attempt_writer.stats(),
+        "answer_keys": answer_keys.stats(),
+        "quiz_cache": quiz_cache.stats(),
+        "write_contention": contention.stats(),
+        "live_sessions": live_sessions.stats(),
+        "archiver": archiver.stats(),
+        "jobs": job_runner.stats(),
+        "question_pools": question_pools.stats(),
+        "item_analysis": item_analysis.stats(),
+        "admission": admission.stats(),
+        "attempt_rate_limit": attempt_rate_limit.stats() if attempt_rate_limit is not None else None,
+    }
+    return JSONResponse(status_code=200 if healthy else 503, content=content)
+
+# Subsystem gauges exported alongside the request and SQL metrics
+def subsystem_gauges():
+    for name, value in db_pool.stats().items():
+        yield f"pquiz_db_pool_{name}", {}, value
+    for name, value in attempt_writer.stats().items():
+        if not isinstance(value, bool):
+            yield f"pquiz_attempt_writer_{name}", {}, value
+    for name, value in archiver.stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"pquiz_archiver_{name}", {}, value
+    for name, value in job_runner.stats().items():
+        yield f"pquiz_jobs_{name}", {}, value
+    for name, value in live_sessions.stats().items():
+        yield f"pquiz_live_{name}", {}, value
+    contention_stats = contention.stats()
+    pid = contention_stats.pop("pid")
+    for name, value in contention_stats.items():
+        yield f"pquiz_db_contention_{name}", {"pid": pid}, value
+    for name, value in item_analysis.stats().items():
+        yield f"pquiz_item_analysis_{name}", {}, value
+    for gate, gate_stats in admission.stats().items():
+        for name, value in gate_stats.items():
+            yield f"pquiz_admission_{name}", {"gate": gate}, value
+    if attempt_rate_limit is not None:
+        for name, value in attempt_rate_limit.stats().items():
+            yield f"pquiz_attempt_rate_limit_{name}", {}, value
+    for cache_name, cache in (("answer_keys", answer_keys), ("quiz_full", quiz_cache), ("question_pools", question_pools)):
+        for name, value in cache.stats().items():
+            yield f"pquiz_cache_{name}", {"cache": cache_name}, value
+
+metrics.register_collector("Connection pool, attempt writer, archiver, job runner, live session, lock contention, item analysis, admission control and cache state.", subsystem_gauges)
+
+# Prometheus text exposition
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # API Endpoints with integrated Pydantic models
 
 @app.post("/quizzes/", response_model=QuizResponse)
-def create_quiz(quiz: QuizCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            cursor = connection.execute(
-                "INSERT INTO quizzes (title, description) VALUES (?, ?)",
-                (quiz.title, quiz.description)
-            )
-            quiz_id = cursor.lastrowid
-        return {"id": quiz_id, "title": quiz.title, "description": quiz.description}
-    finally:
-        connection.close()
+@retry_writes
+def create_quiz(quiz: QuizCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO quizzes (title, description) VALUES (?, ?)",
+            (quiz.title, quiz.description)
+        )
+        quiz_id = cursor.lastrowid
+    return {"id": quiz_id, "title": quiz.title, "description": quiz.description}
+
+# Facet values of the quiz filter, e.g. ?category=1&category=2&level=3: a
+# quiz matches when it has any of the given values of every facet given
+class FacetParams:
+    def __init__(
+        self,
+        category: Optional[List[int]] = Query(None),
+        level: Optional[List[int]] = Query(None),
+        topic: Optional[List[int]] = Query(None),
+    ):
+        self.selected = {"category": category or [], "level": level or [], "topic": topic or []}
 
 @app.get("/quizzes/", response_model=List[QuizResponse])
-def get_quizzes():
-    connection = get_db_connection()
-    try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM quizzes")
-        quizzes = cursor.fetchall()
-        return [QuizResponse(id=q[0], title=q[1], description=q[2]) for q in quizzes]
-    finally:
-        connection.close()
+def get_quizzes(response: Response, page: PageParams = Depends(), facets: FacetParams = Depends(),
+                connection: sqlite3.Connection = Depends(get_db)):
+    matching = facet_filter(facets.selected, page.after_id)
+    where = (f"id IN ({matching[0]})", matching[1]) if matching else None
+    return list_rows(connection, response, "quizzes", QUIZ_COLUMNS, QuizResponse, page, where)
+
+# Quiz counts per category, level and topic, for the quizzes matching the
+# filter (the whole catalogue when there is none)
+@app.get("/quizzes/facets", response_model=FacetCountsResponse)
+def get_facet_counts(facets: FacetParams = Depends(), connection: sqlite3.Connection = Depends(get_db)):
+    return facet_counts(connection, facets.selected)
+
+@app.get("/quizzes/{quiz_id}/facets", response_model=QuizFacets)
+def get_quiz_facets(quiz_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    if connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    return quiz_facets(connection, quiz_id)
+
+@app.put("/quizzes/{quiz_id}/facets", response_model=QuizFacets)
+@retry_writes
+def update_quiz_facets(quiz_id: int, update: QuizFacetsUpdate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        if connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is None:
+            raise HTTPException(status_code=404, detail="Quiz not found")
+        for facet in FACETS:
+            value_ids = getattr(update, facet)
+            if value_ids is not None:
+                set_quiz_facet(connection, quiz_id, facet, value_ids)
+        return quiz_facets(connection, quiz_id)
 
 @app.put("/quizzes/{quiz_id}", response_model=QuizResponse)
-def update_quiz(quiz_id: int, quiz: QuizCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute(
-                "UPDATE quizzes SET title = ?, description = ? WHERE id = ?",
-                (quiz.title, quiz.description, quiz_id)
-            )
-        return {"id": quiz_id, "title": quiz.title, "description": quiz.description}
-    finally:
-        connection.close()
+@retry_writes
+def update_quiz(quiz_id: int, quiz: QuizCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute(
+            "UPDATE quizzes SET title = ?, description = ? WHERE id = ?",
+            (quiz.title, quiz.description, quiz_id)
+        )
+    invalidate_quiz(quiz_id)
+    return {"id": quiz_id, "title": quiz.title, "description": quiz.description}
 
-@app.delete("/quizzes/{quiz_id}", response_model=QuizResponse)
-def delete_quiz(quiz_id: int):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute("DELETE FROM quizzes WHERE id = ?", (quiz_id,))
-        return {"message": "Quiz deleted successfully"}
-    finally:
-        connection.close()
+# The quiz disappears at once; its questions and attempts are deleted by a
+# background job queued in the same transaction
+@app.delete("/quizzes/{quiz_id}", response_model=JobAccepted, status_code=202)
+@retry_writes
+def delete_quiz(quiz_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        if connection.execute("DELETE FROM quizzes WHERE id = ?", (quiz_id,)).rowcount == 0:
+            raise HTTPException(status_code=404, detail="Quiz not found")
+        stats.clear_quiz_stats(connection, quiz_id)
+        job_id = enqueue(connection, "delete_quiz", {"quiz_id": quiz_id})
+    invalidate_quiz(quiz_id)
+    job_runner.wake()
+    return {"job_id": job_id, "kind": "delete_quiz", "status": "queued", "message": "Quiz deleted successfully"}
 
 @app.post("/quizzes/{quiz_id}/questions/", response_model=QuestionResponse)
-def add_question(quiz_id: int, question: QuestionCreate):
-    connection = get_db_connection()
+@retry_writes
+def add_question(quiz_id: int, question: QuestionCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        if connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is None:
+            raise HTTPException(status_code=404, detail="Quiz not found")
+        cursor = connection.execute(
+            "INSERT INTO questions (quiz_id, question_text, choices, correct_answer) VALUES (?, ?, ?, ?)",
+            (quiz_id, question.question_text, encode_choices(question.choices), question.correct_answer)
+        )
+        question_id = cursor.lastrowid
+    invalidate_quiz(quiz_id)
+    return {**question.dict(), "id": question_id}
+
+# Insert a batch of validated questions in a single transaction; returns the
+# questions that failed, as insert_chunk does
+@retry_writes
+def insert_questions(quiz_id, questions):
+    connection = db_pool.acquire()
     try:
         with connection:
-            cursor = connection.execute(
+            failures = insert_chunk(
+                connection,
                 "INSERT INTO questions (quiz_id, question_text, choices, correct_answer) VALUES (?, ?, ?, ?)",
-                (quiz_id, question.question_text, question.choices, question.correct_answer)
+                [(quiz_id, q.question_text, encode_choices(q.choices), q.correct_answer) for q in questions]
             )
-            question_id = cursor.lastrowid
-        return {**question.dict(), "id": question_id}
+        invalidate_quiz(quiz_id)
+        return failures
     finally:
-        connection.close()
+        db_pool.release(connection)
 
-@app.get("/quizzes/{quiz_id}/questions/", response_model=List[QuestionResponse])
-def get_questions(quiz_id: int):
-    connection = get_db_connection()
+def quiz_exists(quiz_id):
+    connection = db_pool.acquire()
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM questions WHERE quiz_id = ?", (quiz_id,))
-        questions = cursor.fetchall()
-        return [QuestionResponse(id=q[0], quiz_id=q[1], question_text=q[2], choices=q[3], correct_answer=q[4]) for q in questions]
+        return connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is not None
     finally:
-        connection.close()
+        db_pool.release(connection)
+
+# Bulk import: NDJSON (default) or CSV with a header row, chosen by the
+# format parameter or the Content-Type. The body is parsed as it streams in;
+# an unknown quiz is a 404 before any of it is read.
+@app.post("/quizzes/{quiz_id}/questions/bulk", response_model=BulkImportResult)
+async def import_questions(quiz_id: int, request: Request, format: Optional[str] = Query(None, pattern="^(ndjson|csv)$")):
+    if not await run_in_threadpool(quiz_exists, quiz_id):
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    fmt = format or format_from_content_type(request.headers.get("content-type"))
+    return await import_rows(
+        request.stream(), fmt, QuestionCreate,
+        lambda questions: insert_questions(quiz_id, questions),
+        defaults={"quiz_id": quiz_id},
+    )
+
+# Question rows as API dicts; choices are stored as a JSON array
+def question_dict(row):
+    question = dict(zip(QUESTION_COLUMNS, row))
+    question["choices"] = json.loads(question["choices"])
+    return question
+
+# The fast path has SQLite build the JSON array itself, embedding each stored
+# choices array as it is, so no row is decoded or re-encoded in Python
+@app.get("/quizzes/{quiz_id}/questions/", response_model=List[QuestionResponse])
+def get_questions(quiz_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    if settings.FAST_JSON_LISTS:
+        body = connection.execute(
+            '''SELECT json_group_array(json(question)) FROM (
+                   SELECT json_object('id', id, 'quiz_id', quiz_id, 'question_text', question_text,
+                                      'choices', json(choices), 'correct_answer', correct_answer) AS question
+                   FROM questions WHERE quiz_id = ? ORDER BY id)''',
+            (quiz_id,)
+        ).fetchone()[0]
+        return RawJSONResponse(body.encode())
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, quiz_id, question_text, choices, correct_answer FROM questions WHERE quiz_id = ? ORDER BY id", (quiz_id,))
+    return [QuestionResponse(**question_dict(q)) for q in cursor.fetchall()]
+
+# Render a quiz and all of its questions as one JSON document, built by SQLite
+def render_full_quiz(connection, quiz_id):
+    row = connection.execute(
+        '''SELECT json_object('id', id, 'title', title, 'description', description, 'questions', (
+                   SELECT json_group_array(json(question)) FROM (
+                       SELECT json_object('id', id, 'quiz_id', quiz_id, 'question_text', question_text,
+                                          'choices', json(choices), 'correct_answer', correct_answer) AS question
+                       FROM questions WHERE quiz_id = quizzes.id ORDER BY id)))
+           FROM quizzes WHERE id = ?''',
+        (quiz_id,)
+    ).fetchone()
+    return row[0].encode() if row else None
+
+# Quiz plus questions in one round trip, served from the in-process cache with
+# a strong ETag. Cache hits never touch SQLite, except for the version check
+# when several server processes share the database.
+@app.get("/quizzes/{quiz_id}/full", response_model=QuizFullResponse)
+def get_full_quiz(quiz_id: int, request: Request):
+    if settings.WORKERS > 1:
+        connection = db_pool.acquire()
+        try:
+            sync_quiz_caches(connection, quiz_id)
+        finally:
+            db_pool.release(connection)
+
+    def render():
+        connection = db_pool.acquire()
+        try:
+            body = render_full_quiz(connection, quiz_id)
+        finally:
+            db_pool.release(connection)
+        if body is None:
+            raise HTTPException(status_code=404, detail="Quiz not found")
+        return CachedBody(body)
+    entry = quiz_cache.get_or_load(quiz_id, render)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 @app.put("/questions/{question_id}", response_model=QuestionResponse)
-def update_question(question_id: int, question: QuestionCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute(
-                "UPDATE questions SET question_text = ?, choices = ?, correct_answer = ? WHERE id = ?",
-                (question.question_text, question.choices, question.correct_answer, question_id)
-            )
-        return {**question.dict(), "id": question_id}
-    finally:
-        connection.close()
+@retry_writes
+def update_question(question_id: int, question: QuestionCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        row = connection.execute(
+            "UPDATE questions SET question_text = ?, choices = ?, correct_answer = ? WHERE id = ? RETURNING quiz_id",
+            (question.question_text, encode_choices(question.choices), question.correct_answer, question_id)
+        ).fetchone()
+    if row:
+        invalidate_quiz(row[0])
+    return {**question.dict(), "id": question_id}
 
-@app.delete("/questions/{question_id}", response_model=QuestionResponse)
-def delete_question(question_id: int):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute("DELETE FROM questions WHERE id = ?", (question_id,))
-        return {"message": "Question deleted successfully"}
-    finally:
-        connection.close()
+@app.delete("/questions/{question_id}", response_model=dict)
+@retry_writes
+def delete_question(question_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        row = connection.execute("DELETE FROM questions WHERE id = ? RETURNING quiz_id", (question_id,)).fetchone()
+    if row:
+        invalidate_quiz(row[0])
+    return {"message": "Question deleted successfully"}
 
 # Attempts CRUD with Pydantic models
 
 @app.post("/attempts/", response_model=AttemptResponse)
-def create_attempt(attempt: AttemptCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            cursor = connection.execute(
-                "INSERT INTO attempts (quiz_id, user_id, answers) VALUES (?, ?, ?)",
-                (attempt.quiz_id, attempt.user_id, attempt.answers)
-            )
-            attempt_id = cursor.lastrowid
-        return {**attempt.dict(), "id": attempt_id}
-    finally:
-        connection.close()
+async def create_attempt(attempt: AttemptCreate):
+    if attempt_rate_limit is not None:
+        attempt_rate_limit.take(attempt.user_id)
+    future = attempt_writer.submit((attempt.quiz_id, attempt.user_id, pack_answers(attempt.answers), attempt.client_token))
+    attempt_id, score = await asyncio.wrap_future(future)
+    return {**attempt.dict(), "id": attempt_id, "score": score}
 
-@app.get("/attempts/{attempt_id}", response_model=AttemptResponse)
-def get_attempt(attempt_id: int):
-    connection = get_db_connection()
+# Attempts queued by offline clients, sent in one request. Each attempt is
+# validated on its own and the valid ones go through the group-commit writer
+# together; results are in request order, with an error for each attempt that
+# was refused. Each attempt counts against its user's rate limit, and one over
+# it comes back with retry_after instead of being stored. If the writer queue fills up part way the request fails with
+# 503, and the client resends the whole batch: attempts with a client_token
+# that were already stored are not stored twice.
+def parse_batch_attempt(item):
+    if not isinstance(item, dict):
+        return None, "Expected an attempt object"
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM attempts WHERE id = ?", (attempt_id,))
-        attempt = cursor.fetchone()
-        if attempt:
-            return AttemptResponse(id=attempt[0], quiz_id=attempt[1], user_id=attempt[2], answers=attempt[3])
+        return AttemptCreate(**item), None
+    except ValidationError as exc:
+        return None, describe_validation_error(exc)
+
+@app.post("/attempts/batch", response_model=AttemptBatchResult)
+async def create_attempts_batch(batch: AttemptBatch):
+    if len(batch.attempts) > settings.ATTEMPT_SYNC_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.ATTEMPT_SYNC_MAX_ITEMS} attempts per batch")
+    results = [None] * len(batch.attempts)
+    accepted = []
+    for index, item in enumerate(batch.attempts):
+        attempt, error = parse_batch_attempt(item)
+        if error is not None:
+            token = item.get("client_token") if isinstance(item, dict) else None
+            results[index] = {"client_token": token if isinstance(token, str) else None, "error": error}
+            continue
+        if attempt_rate_limit is not None:
+            try:
+                attempt_rate_limit.take(attempt.user_id)
+            except HTTPException as exc:
+                results[index] = {"client_token": attempt.client_token, "error": exc.detail,
+                                  "retry_after": int(exc.headers["Retry-After"])}
+                continue
+        accepted.append((index, attempt))
+    futures = [
+        asyncio.wrap_future(attempt_writer.submit(
+            (attempt.quiz_id, attempt.user_id, pack_answers(attempt.answers), attempt.client_token)
+        ))
+        for _, attempt in accepted
+    ]
+    outcomes = await asyncio.gather(*futures, return_exceptions=True)
+    for (index, attempt), outcome in zip(accepted, outcomes):
+        if isinstance(outcome, Exception):
+            results[index] = {"client_token": attempt.client_token, "error": f"{type(outcome).__name__}: {outcome}"}
         else:
-            raise HTTPException(status_code=404, detail="Attempt not found")
-    finally:
-        connection.close()
+            results[index] = {"client_token": attempt.client_token, "id": outcome[0], "score": outcome[1]}
+    return {"results": results}
+
+# Live session for a quiz; see live.py for the message protocol
+@app.websocket("/quizzes/{quiz_id}/live")
+async def live_session(websocket: WebSocket, quiz_id: int, user_id: int, host: bool = False):
+    await live_sessions.serve(websocket, quiz_id, user_id, host)
+
+# Stream every attempt after `after_id` in id order, at constant memory. The
+# last exported id resumes an interrupted export; with questions=true each
+# attempt becomes one graded row per question.
+@app.get("/attempts/export")
+def export_attempts(
+    format: str = Query("ndjson", pattern="^(" + "|".join(EXPORT_FORMATS) + ")$"),
+    after_id: int = Query(0, ge=0),
+    quiz_id: Optional[int] = None,
+    questions: bool = False,
+    gzip: bool = False,
+):
+    chunks = stream_export(db_pool, fmt=format, after_id=after_id, quiz_id=quiz_id,
+                           questions=questions, compress=gzip,
+                           answer_keys=answer_keys if settings.WORKERS <= 1 else None)
+    headers = {"Content-Disposition": f'attachment; filename="{export_filename(format, questions, gzip)}"'}
+    media_type = "application/gzip" if gzip else MEDIA_TYPES[format]
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+# Archive databases holding attempts moved out of the hot table
+@app.get("/attempts/archives", response_model=List[dict])
+def get_attempt_archives(connection: sqlite3.Connection = Depends(get_db)):
+    return list_archives(connection)
+
+# Attempts are looked up in the hot table first, then in the archives
+@app.get("/attempts/{attempt_id}", response_model=AttemptResponse)
+def get_attempt(attempt_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, quiz_id, user_id, answers, score FROM attempts WHERE id = ?", (attempt_id,))
+    attempt = cursor.fetchone()
+    if attempt is None:
+        attempt = find_archived_attempt(connection, attempt_id)
+    if attempt:
+        return AttemptResponse(id=attempt[0], quiz_id=attempt[1], user_id=attempt[2],
+                               answers=unpack_answers(decode_answers(attempt[3])), score=attempt[4])
+    else:
+        raise HTTPException(status_code=404, detail="Attempt not found")
+
+# Queue a job and wake an idle runner once the job is committed
+def start_job(connection, kind, params):
+    with connection:
+        job_id = enqueue(connection, kind, params)
+    job_runner.wake()
+    return {"job_id": job_id, "kind": kind, "status": "queued"}
+
+# Re-score every attempt of a quiz against its current answer key; the job's
+# result has the number of questions and of attempts graded
+@app.post("/quizzes/{quiz_id}/regrade", response_model=JobAccepted, status_code=202)
+@retry_writes
+def regrade_attempts(quiz_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    if connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    return start_job(connection, "regrade", {"quiz_id": quiz_id})
+
+# Background jobs and database maintenance
+
+MAINTENANCE_JOBS = {"vacuum": "vacuum", "analyze": "analyze", "rebuild-stats": "rebuild_stats", "archive": "archive"}
+
+@app.post("/maintenance/{operation}", response_model=JobAccepted, status_code=202)
+@retry_writes
+def start_maintenance(operation: str, quiz_id: Optional[int] = None, after_days: Optional[float] = Query(None, ge=0),
+                      connection: sqlite3.Connection = Depends(get_db)):
+    kind = MAINTENANCE_JOBS.get(operation)
+    if kind is None:
+        raise HTTPException(status_code=404, detail=f"Unknown maintenance operation; expected one of {', '.join(MAINTENANCE_JOBS)}")
+    params = {}
+    if kind == "rebuild_stats" and quiz_id is not None:
+        params["quiz_id"] = quiz_id
+    if kind == "archive" and after_days is not None:
+        params["after_days"] = after_days
+    return start_job(connection, kind, params)
+
+@app.get("/jobs/", response_model=List[JobResponse])
+def get_jobs(status: Optional[str] = None, before_id: Optional[int] = None,
+             limit: int = Query(50, ge=1, le=settings.MAX_PAGE_SIZE), connection: sqlite3.Connection = Depends(get_db)):
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(JOB_STATUSES)}")
+    return list_jobs(connection, status, limit, before_id)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job_status(job_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    job = get_job(connection, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Leaderboard and statistics, read from the incrementally maintained aggregates
+
+@app.get("/quizzes/{quiz_id}/leaderboard", response_model=LeaderboardResponse)
+def get_leaderboard(quiz_id: int, limit: int = Query(10, ge=1, le=settings.LEADERBOARD_SIZE), connection: sqlite3.Connection = Depends(get_db)):
+    return {"quiz_id": quiz_id, "entries": stats.leaderboard(connection, quiz_id, limit)}
+
+@app.get("/quizzes/{quiz_id}/stats", response_model=QuizStatsResponse)
+def get_quiz_stats(quiz_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    return stats.quiz_stats(connection, quiz_id)
+
+# Item analysis: difficulty, discrimination and choice frequencies per question
+
+# Choice labels of the quiz's questions, in answer key order
+def question_choice_labels(connection, key):
+    rows = dict(connection.execute("SELECT id, choices FROM questions WHERE quiz_id = ?", (key.quiz_id,)).fetchall())
+    return [json.loads(rows[question_id]) if question_id in rows else [] for question_id in key.question_ids]
+
+def analyze_quiz(connection, quiz_id, question_id=None):
+    sync_quiz_caches(connection, quiz_id)
+    key = answer_keys.get(connection, quiz_id)
+    indexes = None
+    if question_id is not None:
+        if question_id not in key.question_ids:
+            raise HTTPException(status_code=404, detail="Question not found")
+        indexes = [key.question_ids.index(question_id)]
+    items, summary = item_analysis.analyze(connection, key, question_choice_labels(connection, key), indexes)
+    for index, item in zip(indexes or range(len(key)), items):
+        item.update(question_id=key.question_ids[index], quiz_id=quiz_id)
+    return items, summary
+
+@app.get("/quizzes/{quiz_id}/analytics", response_model=QuizAnalyticsResponse)
+def get_quiz_analytics(quiz_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    if connection.execute("SELECT 1 FROM quizzes WHERE id = ?", (quiz_id,)).fetchone() is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    items, summary = analyze_quiz(connection, quiz_id)
+    return {"quiz_id": quiz_id, **summary, "questions": items}
+
+@app.get("/questions/{question_id}/analytics", response_model=ItemAnalytics)
+def get_question_analytics(question_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    row = connection.execute("SELECT quiz_id FROM questions WHERE id = ?", (question_id,)).fetchone()
+    if row is None or row[0] is None:
+        raise HTTPException(status_code=404, detail="Question not found")
+    items, _ = analyze_quiz(connection, row[0], question_id)
+    return items[0]
+
+# Full-text search, ranked by bm25; the last word matches as a prefix
+
+@app.get("/search", response_model=SearchResponse)
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: str = Query("questions", pattern="^(" + "|".join(SEARCH_KINDS) + ")$"),
+    quiz_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=settings.SEARCH_MAX_OFFSET),
+    connection: sqlite3.Connection = Depends(get_db),
+):
+    match = build_match_query(q)
+    if match is None:
+        raise HTTPException(status_code=400, detail="Search query has no searchable words")
+    if kind == "quizzes":
+        results = search_quizzes(connection, match, limit, offset)
+    else:
+        results = search_questions(connection, match, limit, offset, quiz_id)
+    next_offset = offset + limit if len(results) == limit and offset + limit <= settings.SEARCH_MAX_OFFSET else None
+    return {"query": q, "kind": kind, "results": results, "next_offset": next_offset}
+
+# Random practice exams: n distinct questions drawn from the given quizzes.
+# The same seed over the same pool returns the same questions in the same
+# order; without a seed one is chosen and returned so the draw can be repeated.
+# With user_id, quizzes the user has already attempted are left out.
+
+@app.get("/questions/sample", response_model=QuestionSample)
+def sample_questions(
+    quiz_id: List[int] = Query(..., min_length=1, max_length=settings.SAMPLE_MAX_QUIZZES),
+    n: int = Query(10, ge=1, le=settings.SAMPLE_MAX_QUESTIONS),
+    seed: Optional[int] = None,
+    user_id: Optional[int] = None,
+    connection: sqlite3.Connection = Depends(get_db),
+):
+    quiz_ids = list(dict.fromkeys(quiz_id))
+    excluded = attempted_quizzes(connection, user_id, quiz_ids) if user_id is not None else set()
+    pools = []
+    for quiz in quiz_ids:
+        if quiz not in excluded:
+            sync_quiz_caches(connection, quiz)
+            pools.append(question_pools.get(connection, quiz))
+    if seed is None:
+        seed = random.getrandbits(63)
+    question_ids, pool_size = sample_question_ids(pools, n, seed)
+    rows = {}
+    if question_ids:
+        placeholders = ','.join('?' * len(question_ids))
+        cursor = connection.execute(
+            f"SELECT id, quiz_id, question_text, choices, correct_answer FROM questions WHERE id IN ({placeholders})",
+            question_ids
+        )
+        rows = {row[0]: row for row in cursor}
+    questions = [question_dict(rows[id]) for id in question_ids if id in rows]
+    return {"seed": seed, "pool_size": pool_size, "excluded_quizzes": sorted(excluded), "questions": questions}
 
 # Categories CRUD with Pydantic models
 
 @app.post("/categories/", response_model=CategoryResponse)
-def create_category(category: CategoryCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            cursor = connection.execute(
-                "INSERT INTO categories (category_name, description) VALUES (?, ?)",
-                (category.category_name, category.description)
-            )
-            category_id = cursor.lastrowid
-        return {**category.dict(), "id": category_id}
-    finally:
-        connection.close()
+@retry_writes
+def create_category(category: CategoryCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO categories (category_name, description) VALUES (?, ?)",
+            (category.category_name, category.description)
+        )
+        category_id = cursor.lastrowid
+    return {**category.dict(), "id": category_id}
 
 @app.get("/categories/", response_model=List[CategoryResponse])
-def get_categories():
-    connection = get_db_connection()
-    try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM categories")
-        categories = cursor.fetchall()
-        return [CategoryResponse(id=c[0], category_name=c[1], description=c[2]) for c in categories]
-    finally:
-        connection.close()
+def get_categories(response: Response, page: PageParams = Depends(), connection: sqlite3.Connection = Depends(get_db)):
+    return list_rows(connection, response, "categories", CATEGORY_COLUMNS, CategoryResponse, page)
 
 @app.put("/categories/{category_id}", response_model=CategoryResponse)
-def update_category(category_id: int, category: CategoryCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute(
-                "UPDATE categories SET category_name = ?, description = ? WHERE id = ?",
-                (category.category_name, category.description, category_id)
-            )
-        return {**category.dict(), "id": category_id}
-    finally:
-        connection.close()
+@retry_writes
+def update_category(category_id: int, category: CategoryCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute(
+            "UPDATE categories SET category_name = ?, description = ? WHERE id = ?",
+            (category.category_name, category.description, category_id)
+        )
+    return {**category.dict(), "id": category_id}
 
 @app.delete("/categories/{category_id}", response_model=dict)
-def delete_category(category_id: int):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute("DELETE FROM categories WHERE id = ?", (category_id,))
-        return {"message": "Category deleted successfully"}
-    finally:
-        connection.close()
+@retry_writes
+def delete_category(category_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+    return {"message": "Category deleted successfully"}
 
 # Levels CRUD with Pydantic models
 
 @app.post("/levels/", response_model=LevelResponse)
-def create_level(level: LevelCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            cursor = connection.execute(
-                "INSERT INTO levels (level_name, description) VALUES (?, ?)",
-                (level.level_name, level.description)
-            )
-            level_id = cursor.lastrowid
-        return {**level.dict(), "id": level_id}
-    finally:
-        connection.close()
+@retry_writes
+def create_level(level: LevelCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO levels (level_name, description) VALUES (?, ?)",
+            (level.level_name, level.description)
+        )
+        level_id = cursor.lastrowid
+    return {**level.dict(), "id": level_id}
 
 @app.get("/levels/", response_model=List[LevelResponse])
-def get_levels():
-    connection = get_db_connection()
-    try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM levels")
-        levels = cursor.fetchall()
-        return [LevelResponse(id=l[0], level_name=l[1], description=l[2]) for l in levels]
-    finally:
-        connection.close()
+def get_levels(response: Response, page: PageParams = Depends(), connection: sqlite3.Connection = Depends(get_db)):
+    return list_rows(connection, response, "levels", LEVEL_COLUMNS, LevelResponse, page)
 
 @app.put("/levels/{level_id}", response_model=LevelResponse)
-def update_level(level_id: int, level: LevelCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute(
-                "UPDATE levels SET level_name = ?, description = ? WHERE id = ?",
-                (level.level_name, level.description, level_id)
-            )
-        return {**level.dict(), "id": level_id}
-    finally:
-        connection.close()
+@retry_writes
+def update_level(level_id: int, level: LevelCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute(
+            "UPDATE levels SET level_name = ?, description = ? WHERE id = ?",
+            (level.level_name, level.description, level_id)
+        )
+    return {**level.dict(), "id": level_id}
 
 @app.delete("/levels/{level_id}", response_model=dict)
-def delete_level(level_id: int):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute("DELETE FROM levels WHERE id = ?", (level_id,))
-        return {"message": "Level deleted successfully"}
-    finally:
-        connection.close()
+@retry_writes
+def delete_level(level_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute("DELETE FROM levels WHERE id = ?", (level_id,))
+    return {"message": "Level deleted successfully"}
 
 # Topics CRUD with Pydantic models
 
 @app.post("/topics/", response_model=TopicResponse)
-def create_topic(topic: TopicCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            cursor = connection.execute(
-                "INSERT INTO topics (topic_name, description) VALUES (?, ?)",
-                (topic.topic_name, topic.description)
-            )
-            topic_id = cursor.lastrowid
-        return {**topic.dict(), "id": topic_id}
-    finally:
-        connection.close()
+@retry_writes
+def create_topic(topic: TopicCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO topics (topic_name, description) VALUES (?, ?)",
+            (topic.topic_name, topic.description)
+        )
+        topic_id = cursor.lastrowid
+    return {**topic.dict(), "id": topic_id}
 
 @app.get("/topics/", response_model=List[TopicResponse])
-def get_topics():
-    connection = get_db_connection()
-    try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM topics")
-        topics = cursor.fetchall()
-        return [TopicResponse(id=t[0], topic_name=t[1], description=t[2]) for t in topics]
-    finally:
-        connection.close()
+def get_topics(response: Response, page: PageParams = Depends(), connection: sqlite3.Connection = Depends(get_db)):
+    return list_rows(connection, response, "topics", TOPIC_COLUMNS, TopicResponse, page)
 
 @app.put("/topics/{topic_id}", response_model=TopicResponse)
-def update_topic(topic_id: int, topic: TopicCreate):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute(
-                "UPDATE topics SET topic_name = ?, description = ? WHERE id = ?",
-                (topic.topic_name, topic.description, topic_id)
-            )
-        return {**topic.dict(), "id": topic_id}
-    finally:
-        connection.close()
+@retry_writes
+def update_topic(topic_id: int, topic: TopicCreate, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute(
+            "UPDATE topics SET topic_name = ?, description = ? WHERE id = ?",
+            (topic.topic_name, topic.description, topic_id)
+        )
+    return {**topic.dict(), "id": topic_id}
 
 @app.delete("/topics/{topic_id}", response_model=dict)
-def delete_topic(topic_id: int):
-    connection = get_db_connection()
-    try:
-        with connection:
-            connection.execute("DELETE FROM topics WHERE id = ?", (topic_id,))
-        return {"message": "Topic deleted successfully"}
-    finally:
-        connection.close()
+@retry_writes
+def delete_topic(topic_id: int, connection: sqlite3.Connection = Depends(get_db)):
+    with connection:
+        connection.execute("DELETE FROM topics WHERE id = ?", (topic_id,))
+    return {"message": "Topic deleted successfully"}
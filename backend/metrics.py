@@ -0,0 +1,340 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import settings
+
+# Request and SQL instrumentation, exported in the Prometheus text format.
+#
+# MetricsMiddleware records per-route latency histograms, status counts and
+# in-flight requests. Connections created through get_db_connection() are
+# TracedConnections: their cursors time every statement (execute plus fetch),
+# a trace callback counts statements by kind, including the ones triggers
+# run, and a progress handler counts SQLite VM steps as a cost measure.
+#
+# Statements are labelled by a fingerprint: literals and IN lists collapsed,
+# so the label set stays bounded however the statements are parameterized.
+# Transaction control, pragmas and DDL are not timed, and fingerprints beyond
+# MAX_STATEMENT_LABELS are counted together as "other".
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# The progress handler runs every this many SQLite VM instructions
+PROGRESS_STEPS = 1000
+
+slow_query_log = logging.getLogger('pquiz.sql.slow')
+
+# Distinct statement labels kept before new ones are folded into "other"
+MAX_STATEMENT_LABELS = 200
+
+OTHER_STATEMENT = 'other'
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROW_LIST = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+# Not timed: transaction control, pragmas, and the one-off schema statements of migrations
+_UNTIMED = ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'CREATE', 'DROP', 'ALTER')
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}'
+        yield f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.total)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels.items()) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def normalize_sql(sql):
+    return _WHITESPACE.sub(' ', sql).strip()[:160]
+
+
+# Bounded label for a statement, or None for one that is not timed
+def statement_fingerprint(sql):
+    text = _WHITESPACE.sub(' ', sql).strip()
+    if text.split(' ', 1)[0].upper() in _UNTIMED:
+        return None
+    text = _STRING_LITERAL.sub('?', text)
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = _PLACEHOLDER_LIST.sub('(...)', text)
+    text = _ROW_LIST.sub('(...)', text)
+    return text[:160]
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = {}        # (method, route) -> Histogram
+        self.responses = {}       # (method, route, status) -> count
+        self.statements = {}      # statement fingerprint -> Histogram
+        self.statement_kinds = {}  # SELECT / INSERT / ... -> count (from the trace callback)
+        self.vm_steps = 0
+        self.slow_queries = 0
+        self._collectors = []
+        # Measurements from cursors collected by the garbage collector, which
+        # may run while this thread holds _lock; folded in under the lock later
+        self._deferred = deque()
+
+    # Extra gauges from other subsystems: fn() -> iterable of (name, labels, value)
+    def register_collector(self, help_text, collector):
+        self._collectors.append((help_text, collector))
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, route, status, elapsed):
+        with self._lock:
+            self.in_flight -= 1
+            histogram = self.requests.get((method, route))
+            if histogram is None:
+                histogram = self.requests[(method, route)] = Histogram(REQUEST_BUCKETS)
+            histogram.observe(elapsed)
+            key = (method, route, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    # `vm_steps` are the VM steps the connection ran since its last statement
+    def statement_finished(self, sql, elapsed, vm_steps=0):
+        key = statement_fingerprint(sql)
+        with self._lock:
+            self.vm_steps += vm_steps
+            self._fold_deferred()
+            slow = key is not None and self._observe_statement(key, elapsed)
+        if slow:
+            slow_query_log.warning("slow query (%.1f ms): %s", elapsed * 1000, normalize_sql(sql))
+
+    # Lock-free; for TimedCursor.__del__
+    def statement_deferred(self, sql, elapsed, vm_steps=0):
+        self._deferred.append((statement_fingerprint(sql), elapsed, vm_steps))
+
+    def _fold_deferred(self):
+        while self._deferred:
+            key, elapsed, vm_steps = self._deferred.popleft()
+            self.vm_steps += vm_steps
+            if key is not None:
+                self._observe_statement(key, elapsed)
+
+    # Returns whether the statement was slow; caller holds _lock
+    def _observe_statement(self, key, elapsed):
+        histogram = self.statements.get(key)
+        if histogram is None:
+            if len(self.statements) >= MAX_STATEMENT_LABELS:
+                key = OTHER_STATEMENT
+                histogram = self.statements.get(key)
+            if histogram is None:
+                histogram = self.statements[key] = Histogram(SQL_BUCKETS)
+        histogram.observe(elapsed)
+        slow = elapsed * 1000 >= settings.SLOW_QUERY_MS
+        if slow:
+            self.slow_queries += 1
+        return slow
+
+    def statement_traced(self, sql):
+        kind = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+        if kind == '--':
+            kind = 'TRIGGER'
+        with self._lock:
+            self.statement_kinds[kind] = self.statement_kinds.get(kind, 0) + 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            self._fold_deferred()
+            lines += ['# HELP pquiz_http_requests_in_flight Requests currently being served.',
+                      '# TYPE pquiz_http_requests_in_flight gauge',
+                      f'pquiz_http_requests_in_flight {self.in_flight}']
+            lines += ['# HELP pquiz_http_request_duration_seconds Request latency by route.',
+                      '# TYPE pquiz_http_request_duration_seconds histogram']
+            for (method, route), histogram in sorted(self.requests.items()):
+                lines += histogram.lines('pquiz_http_request_duration_seconds', {'method': method, 'route': route})
+            lines += ['# HELP pquiz_http_responses_total Responses by route and status code.',
+                      '# TYPE pquiz_http_responses_total counter']
+            for (method, route, status), count in sorted(self.responses.items()):
+                lines.append(f'pquiz_http_responses_total{_labels({"method": method, "route": route, "status": status})} {count}')
+            lines += ['# HELP pquiz_sql_statement_duration_seconds Statement time (execute and fetch) by statement.',
+                      '# TYPE pquiz_sql_statement_duration_seconds histogram']
+            for sql, histogram in sorted(self.statements.items()):
+                lines += histogram.lines('pquiz_sql_statement_duration_seconds', {'statement': sql})
+            lines += ['# HELP pquiz_sql_statements_total Statements run by SQLite, by kind, including trigger bodies.',
+                      '# TYPE pquiz_sql_statements_total counter']
+            for kind, count in sorted(self.statement_kinds.items()):
+                lines.append(f'pquiz_sql_statements_total{_labels({"kind": kind})} {count}')
+            lines += ['# HELP pquiz_sql_vm_steps_total Approximate SQLite virtual machine instructions executed.',
+                      '# TYPE pquiz_sql_vm_steps_total counter',
+                      f'pquiz_sql_vm_steps_total {self.vm_steps}',
+                      '# HELP pquiz_sql_slow_queries_total Statements slower than the slow-query threshold.',
+                      '# TYPE pquiz_sql_slow_queries_total counter',
+                      f'pquiz_sql_slow_queries_total {self.slow_queries}']
+        for help_text, collector in self._collectors:
+            seen = set()
+            for name, labels, value in collector():
+                if name not in seen:
+                    seen.add(name)
+                    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Times each statement from execute() until its rows are exhausted, the
+    # cursor moves on to the next statement or the cursor is closed
+
+    _sql = None
+    _elapsed = 0.0
+
+    def _finish(self, record=metrics.statement_finished):
+        if self._sql is not None:
+            record(self._sql, self._elapsed, self.connection.take_vm_steps())
+            self._sql = None
+
+    def _timed(self, sql, method, *args):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._sql = sql
+            self._elapsed = time.perf_counter() - started
+            if self.description is None:
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sql, super().executemany, sql, seq_of_parameters)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        rows = method(*args)
+        self._elapsed += time.perf_counter() - started
+        return rows
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._fetch(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Never takes the metrics lock: the collector may run while it is held
+        self._finish(metrics.statement_deferred)
+
+
+class TracedConnection(sqlite3.Connection):
+    # VM steps are counted per connection, without a lock (a connection is
+    # used by one thread at a time), and handed to the metrics with the
+    # statement that ran them
+    vm_steps = 0
+
+    def count_vm_steps(self):
+        # Called from SQLite; a non-zero return value would abort the statement
+        self.vm_steps += PROGRESS_STEPS
+        return 0
+
+    def take_vm_steps(self):
+        steps, self.vm_steps = self.vm_steps, 0
+        return steps
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def instrument_connection(connection):
+    connection.set_trace_callback(metrics.statement_traced)
+    connection.set_progress_handler(connection.count_vm_steps, PROGRESS_STEPS)
+    return connection
+
+
+class MetricsMiddleware:
+    # Pure ASGI middleware, so streaming responses are timed until their last
+    # chunk is sent
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+        metrics.request_started()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            metrics.request_finished(scope['method'], path, status, time.perf_counter() - started)
@@ -0,0 +1,423 @@
+import settings
+from grading import decode_answers, encode_choices, parse_choices
+
+# Versioned schema migrations, tracked in PRAGMA user_version.
+#
+# Each entry is (version, description, steps). A step is either an SQL
+# statement or a callable taking the connection, for data migrations. A
+# migration runs in a single transaction together with the user_version bump,
+# so a failed migration leaves the database at the previous version. Never
+# edit a released migration; append a new one instead.
+
+# Rewrite comma-separated questions.choices as JSON arrays of strings
+def _choices_to_json(connection):
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            "SELECT id, choices FROM questions WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, settings.REGRADE_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for question_id, choices in rows:
+            encoded = encode_choices(str(choice) for choice in parse_choices(choices or ''))
+            if encoded != choices:
+                updates.append((encoded, question_id))
+        connection.executemany("UPDATE questions SET choices = ? WHERE id = ?", updates)
+        after_id = rows[-1][0]
+
+
+# Rewrite "1,0,2" attempts.answers text as packed bytes
+def _pack_answers(connection):
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            "SELECT id, answers FROM attempts WHERE id > ? AND typeof(answers) != 'blob' ORDER BY id LIMIT ?",
+            (after_id, settings.REGRADE_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.executemany(
+            "UPDATE attempts SET answers = ? WHERE id = ?",
+            [(decode_answers(answers), attempt_id) for attempt_id, answers in rows]
+        )
+        after_id = rows[-1][0]
+
+
+# Aggregates of the scored attempts of existing quizzes, as migration 4
+# shipped them; a private copy, so later changes to stats.py do not change
+# what the migration runs
+def _build_stats(connection):
+    for table in ('quiz_stats', 'quiz_score_counts', 'quiz_leaderboard'):
+        connection.execute(f"DELETE FROM {table}")
+    connection.execute(
+        '''INSERT INTO quiz_stats (quiz_id, attempt_count, score_sum, score_sq_sum, min_score, max_score)
+            SELECT quiz_id, count(*), sum(score), sum(score * score), min(score), max(score)
+            FROM attempts WHERE score IS NOT NULL AND quiz_id IN (SELECT id FROM quizzes) GROUP BY quiz_id'''
+    )
+    connection.execute(
+        '''INSERT INTO quiz_score_counts (quiz_id, score, attempt_count)
+            SELECT quiz_id, score, count(*)
+            FROM attempts WHERE score IS NOT NULL AND quiz_id IN (SELECT id FROM quizzes) GROUP BY quiz_id, score'''
+    )
+    connection.execute(
+        '''INSERT INTO quiz_leaderboard (quiz_id, attempt_id, user_id, score)
+            SELECT quiz_id, id, user_id, score FROM (
+                SELECT quiz_id, id, user_id, score,
+                       row_number() OVER (PARTITION BY quiz_id ORDER BY score DESC, id) AS position
+                FROM attempts WHERE score IS NOT NULL AND quiz_id IN (SELECT id FROM quizzes))
+            WHERE position <= ?''',
+        (settings.LEADERBOARD_SIZE,)
+    )
+
+
+MIGRATIONS = [
+    (1, "base tables", [
+        '''CREATE TABLE IF NOT EXISTS quizzes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                quiz_id INTEGER,
+                question_text TEXT NOT NULL,
+                choices TEXT NOT NULL,
+                correct_answer INTEGER,
+                FOREIGN KEY (quiz_id) REFERENCES quizzes (id))''',
+        '''CREATE TABLE IF NOT EXISTS attempts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                quiz_id INTEGER,
+                user_id INTEGER,
+                answers TEXT NOT NULL,
+                FOREIGN KEY (quiz_id) REFERENCES quizzes (id))''',
+        '''CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category_name TEXT NOT NULL,
+                description TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS levels (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                level_name TEXT NOT NULL,
+                description TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS topics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic_name TEXT NOT NULL,
+                description TEXT)''',
+    ]),
+    (2, "secondary indexes for quiz and user lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_questions_quiz_id ON questions (quiz_id)",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_quiz_user ON attempts (quiz_id, user_id)",
+        # Covering index for per-user lookups ("which quizzes has this user attempted")
+        "CREATE INDEX IF NOT EXISTS idx_attempts_user_quiz ON attempts (user_id, quiz_id)",
+    ]),
+    (3, "attempt scores and answer-key index", [
+        "ALTER TABLE attempts ADD COLUMN score INTEGER",
+        # Covering, id-ordered index for loading a quiz's answer key
+        "CREATE INDEX IF NOT EXISTS idx_questions_answer_key ON questions (quiz_id, id, correct_answer)",
+        # Keyset walks over one quiz's attempts (re-grading)
+        "CREATE INDEX IF NOT EXISTS idx_attempts_quiz_id ON attempts (quiz_id)",
+    ]),
+    (4, "incrementally maintained quiz statistics and leaderboards", [
+        '''CREATE TABLE IF NOT EXISTS quiz_stats (
+                quiz_id INTEGER PRIMARY KEY,
+                attempt_count INTEGER NOT NULL,
+                score_sum INTEGER NOT NULL,
+                score_sq_sum INTEGER NOT NULL,
+                min_score INTEGER,
+                max_score INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS quiz_score_counts (
+                quiz_id INTEGER NOT NULL,
+                score INTEGER NOT NULL,
+                attempt_count INTEGER NOT NULL,
+                PRIMARY KEY (quiz_id, score)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS quiz_leaderboard (
+                quiz_id INTEGER NOT NULL,
+                attempt_id INTEGER NOT NULL,
+                user_id INTEGER,
+                score INTEGER NOT NULL,
+                PRIMARY KEY (quiz_id, attempt_id)) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_quiz_leaderboard_rank ON quiz_leaderboard (quiz_id, score DESC, attempt_id)",
+        # Existing scored attempts
+        _build_stats,
+    ]),
+    (5, "full-text search over quizzes and questions", [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS quizzes_fts USING fts5 (
+                title, description,
+                content='quizzes', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3')''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5 (
+                question_text, choices,
+                content='questions', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3')''',
+        '''CREATE TRIGGER IF NOT EXISTS quizzes_fts_insert AFTER INSERT ON quizzes BEGIN
+                INSERT INTO quizzes_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quizzes_fts_delete AFTER DELETE ON quizzes BEGIN
+                INSERT INTO quizzes_fts (quizzes_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quizzes_fts_update AFTER UPDATE OF title, description ON quizzes BEGIN
+                INSERT INTO quizzes_fts (quizzes_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+                INSERT INTO quizzes_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+                INSERT INTO questions_fts (rowid, question_text, choices) VALUES (new.id, new.question_text, new.choices);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+                INSERT INTO questions_fts (questions_fts, rowid, question_text, choices)
+                VALUES ('delete', old.id, old.question_text, old.choices);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question_text, choices ON questions BEGIN
+                INSERT INTO questions_fts (questions_fts, rowid, question_text, choices)
+                VALUES ('delete', old.id, old.question_text, old.choices);
+                INSERT INTO questions_fts (rowid, question_text, choices) VALUES (new.id, new.question_text, new.choices);
+            END''',
+        # Index the rows that already exist
+        "INSERT INTO quizzes_fts (quizzes_fts) VALUES ('rebuild')",
+        "INSERT INTO questions_fts (questions_fts) VALUES ('rebuild')",
+    ]),
+    (6, "per-quiz change counters for multi-process cache invalidation", [
+        '''CREATE TABLE IF NOT EXISTS quiz_versions (
+                quiz_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_versions_quiz_update AFTER UPDATE ON quizzes BEGIN
+                INSERT INTO quiz_versions (quiz_id, version) VALUES (old.id, 1)
+                ON CONFLICT (quiz_id) DO UPDATE SET version = version + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_versions_quiz_delete AFTER DELETE ON quizzes BEGIN
+                INSERT INTO quiz_versions (quiz_id, version) VALUES (old.id, 1)
+                ON CONFLICT (quiz_id) DO UPDATE SET version = version + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_versions_question_insert AFTER INSERT ON questions BEGIN
+                INSERT INTO quiz_versions (quiz_id, version) VALUES (new.quiz_id, 1)
+                ON CONFLICT (quiz_id) DO UPDATE SET version = version + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_versions_question_update AFTER UPDATE ON questions BEGIN
+                INSERT INTO quiz_versions (quiz_id, version) VALUES (old.quiz_id, 1)
+                ON CONFLICT (quiz_id) DO UPDATE SET version = version + 1;
+                INSERT INTO quiz_versions (quiz_id, version) VALUES (new.quiz_id, 1)
+                ON CONFLICT (quiz_id) DO UPDATE SET version = version + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_versions_question_delete AFTER DELETE ON questions BEGIN
+                INSERT INTO quiz_versions (quiz_id, version) VALUES (old.quiz_id, 1)
+                ON CONFLICT (quiz_id) DO UPDATE SET version = version + 1;
+            END''',
+    ]),
+    (7, "attempt timestamps and the archive catalogue", [
+        "ALTER TABLE attempts ADD COLUMN created_at INTEGER",
+        # Existing attempts have no timestamp; they start ageing from now
+        "UPDATE attempts SET created_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE created_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_created_at ON attempts (created_at)",
+        '''CREATE TABLE IF NOT EXISTS attempt_archives (
+                period TEXT PRIMARY KEY,
+                min_id INTEGER NOT NULL,
+                max_id INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )''',
+        # What archived attempts contribute to the per-quiz aggregates, so they
+        # can still be rebuilt once the rows have left the attempts table
+        '''CREATE TABLE IF NOT EXISTS archived_score_counts (
+                quiz_id INTEGER NOT NULL,
+                score INTEGER NOT NULL,
+                attempt_count INTEGER NOT NULL,
+                PRIMARY KEY (quiz_id, score)
+            ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS archived_leaderboard (
+                quiz_id INTEGER NOT NULL,
+                attempt_id INTEGER NOT NULL,
+                user_id INTEGER,
+                score INTEGER NOT NULL,
+                PRIMARY KEY (quiz_id, attempt_id)
+            ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_archived_leaderboard_rank ON archived_leaderboard (quiz_id, score DESC, attempt_id)",
+    ]),
+    (8, "background jobs", [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                worker TEXT
+            )''',
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)",
+        # Quizzes deleted before deletes cascaded left their questions and
+        # attempts behind; queue the cascade for each of them
+        '''INSERT INTO jobs (kind, params, status, created_at)
+            SELECT 'delete_quiz', json_object('quiz_id', quiz_id), 'queued', strftime('%s', 'now')
+            FROM (SELECT quiz_id FROM questions UNION SELECT quiz_id FROM attempts)
+            WHERE quiz_id IS NOT NULL AND quiz_id NOT IN (SELECT id FROM quizzes)''',
+    ]),
+    (9, "client tokens for idempotent attempt submission", [
+        "ALTER TABLE attempts ADD COLUMN client_token TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_attempts_client_token ON attempts (client_token) WHERE client_token IS NOT NULL",
+    ]),
+    (10, "JSON question choices and packed attempt answers", [
+        _choices_to_json,
+        _pack_answers,
+        # Checked on every write from here on, whichever code path it takes
+        '''CREATE TRIGGER IF NOT EXISTS questions_choices_insert BEFORE INSERT ON questions
+            WHEN CASE WHEN json_valid(new.choices) THEN json_type(new.choices) != 'array'
+                OR EXISTS (SELECT 1 FROM json_each(new.choices) WHERE type != 'text') ELSE 1 END BEGIN
+                SELECT RAISE(ABORT, 'questions.choices must be a JSON array of strings');
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS questions_choices_update BEFORE UPDATE OF choices ON questions
+            WHEN CASE WHEN json_valid(new.choices) THEN json_type(new.choices) != 'array'
+                OR EXISTS (SELECT 1 FROM json_each(new.choices) WHERE type != 'text') ELSE 1 END BEGIN
+                SELECT RAISE(ABORT, 'questions.choices must be a JSON array of strings');
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS attempts_answers_insert BEFORE INSERT ON attempts
+            WHEN typeof(new.answers) != 'blob' BEGIN
+                SELECT RAISE(ABORT, 'attempts.answers must be packed bytes');
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS attempts_answers_update BEFORE UPDATE OF answers ON attempts
+            WHEN typeof(new.answers) != 'blob' BEGIN
+                SELECT RAISE(ABORT, 'attempts.answers must be packed bytes');
+            END''',
+        # The rewritten rows leave free pages behind; give them back
+        '''INSERT INTO jobs (kind, params, status, created_at)
+            SELECT 'vacuum', '{}', 'queued', strftime('%s', 'now') WHERE EXISTS (SELECT 1 FROM attempts)''',
+    ]),
+    (11, "quiz categories, levels and topics with facet counts", [
+        # Quizzes tagged with each facet value, kept by the association triggers
+        '''CREATE TABLE IF NOT EXISTS quiz_facet_counts (
+                facet TEXT NOT NULL,
+                value_id INTEGER NOT NULL,
+                quiz_count INTEGER NOT NULL,
+                PRIMARY KEY (facet, value_id)
+            ) WITHOUT ROWID''',
+        # Association tables are keyed by the facet value first, so a filter
+        # reads one value's quiz ids in id order; the quiz_id index serves
+        # lookups and deletes by quiz
+        '''CREATE TABLE IF NOT EXISTS quiz_categories (
+                category_id INTEGER NOT NULL,
+                quiz_id INTEGER NOT NULL,
+                PRIMARY KEY (category_id, quiz_id)
+            ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_quiz_categories_quiz ON quiz_categories (quiz_id, category_id)",
+        '''CREATE TRIGGER IF NOT EXISTS quiz_categories_count_insert AFTER INSERT ON quiz_categories BEGIN
+                INSERT INTO quiz_facet_counts (facet, value_id, quiz_count) VALUES ('category', new.category_id, 1)
+                ON CONFLICT (facet, value_id) DO UPDATE SET quiz_count = quiz_count + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_categories_count_delete AFTER DELETE ON quiz_categories BEGIN
+                UPDATE quiz_facet_counts SET quiz_count = quiz_count - 1 WHERE facet = 'category' AND value_id = old.category_id;
+                DELETE FROM quiz_facet_counts WHERE facet = 'category' AND value_id = old.category_id AND quiz_count <= 0;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS categories_unlink AFTER DELETE ON categories BEGIN
+                DELETE FROM quiz_categories WHERE category_id = old.id;
+            END''',
+        '''CREATE TABLE IF NOT EXISTS quiz_levels (
+                level_id INTEGER NOT NULL,
+                quiz_id INTEGER NOT NULL,
+                PRIMARY KEY (level_id, quiz_id)
+            ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_quiz_levels_quiz ON quiz_levels (quiz_id, level_id)",
+        '''CREATE TRIGGER IF NOT EXISTS quiz_levels_count_insert AFTER INSERT ON quiz_levels BEGIN
+                INSERT INTO quiz_facet_counts (facet, value_id, quiz_count) VALUES ('level', new.level_id, 1)
+                ON CONFLICT (facet, value_id) DO UPDATE SET quiz_count = quiz_count + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_levels_count_delete AFTER DELETE ON quiz_levels BEGIN
+                UPDATE quiz_facet_counts SET quiz_count = quiz_count - 1 WHERE facet = 'level' AND value_id = old.level_id;
+                DELETE FROM quiz_facet_counts WHERE facet = 'level' AND value_id = old.level_id AND quiz_count <= 0;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS levels_unlink AFTER DELETE ON levels BEGIN
+                DELETE FROM quiz_levels WHERE level_id = old.id;
+            END''',
+        '''CREATE TABLE IF NOT EXISTS quiz_topics (
+                topic_id INTEGER NOT NULL,
+                quiz_id INTEGER NOT NULL,
+                PRIMARY KEY (topic_id, quiz_id)
+            ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_quiz_topics_quiz ON quiz_topics (quiz_id, topic_id)",
+        '''CREATE TRIGGER IF NOT EXISTS quiz_topics_count_insert AFTER INSERT ON quiz_topics BEGIN
+                INSERT INTO quiz_facet_counts (facet, value_id, quiz_count) VALUES ('topic', new.topic_id, 1)
+                ON CONFLICT (facet, value_id) DO UPDATE SET quiz_count = quiz_count + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quiz_topics_count_delete AFTER DELETE ON quiz_topics BEGIN
+                UPDATE quiz_facet_counts SET quiz_count = quiz_count - 1 WHERE facet = 'topic' AND value_id = old.topic_id;
+                DELETE FROM quiz_facet_counts WHERE facet = 'topic' AND value_id = old.topic_id AND quiz_count <= 0;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS topics_unlink AFTER DELETE ON topics BEGIN
+                DELETE FROM quiz_topics WHERE topic_id = old.id;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS quizzes_facets_delete AFTER DELETE ON quizzes BEGIN
+                DELETE FROM quiz_categories WHERE quiz_id = old.id;
+                DELETE FROM quiz_levels WHERE quiz_id = old.id;
+                DELETE FROM quiz_topics WHERE quiz_id = old.id;
+            END''',
+    ]),
+    (12, "job leases", [
+        # A running job belongs to its worker until lease_expires_at; jobs
+        # already running have no lease and are queued again
+        "ALTER TABLE jobs ADD COLUMN lease_expires_at REAL",
+    ]),
+    (13, "client tokens kept after their attempts are archived", [
+        # The archiver never prunes this table, so a retried submission is
+        # recognised however old its attempt is. Tokens of attempts archived
+        # before this migration are gone with their rows.
+        '''CREATE TABLE IF NOT EXISTS client_tokens (
+                client_token TEXT PRIMARY KEY,
+                attempt_id INTEGER NOT NULL,
+                score INTEGER
+            ) WITHOUT ROWID''',
+        '''INSERT OR IGNORE INTO client_tokens (client_token, attempt_id, score)
+            SELECT client_token, id, score FROM attempts WHERE client_token IS NOT NULL''',
+    ]),
+    (14, "users with archived attempts per quiz", [
+        # Kept by the archiver, so which quizzes a user has attempted is known
+        # without opening the archives
+        '''CREATE TABLE IF NOT EXISTS archived_user_quizzes (
+                quiz_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (quiz_id, user_id)
+            ) WITHOUT ROWID''',
+        # Archives cannot be attached inside the migration's transaction; a job
+        # indexes the attempts archived so far
+        '''INSERT INTO jobs (kind, params, status, created_at)
+            SELECT 'index_archives', '{}', 'queued', strftime('%s', 'now')
+            WHERE EXISTS (SELECT 1 FROM attempt_archives)''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Apply every migration newer than the database's user_version, in order
+def migrate(connection, target=LATEST_VERSION):
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version > target:
+            break
+        # Re-read inside the write lock so concurrent workers migrate only once
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(connection) >= version:
+                connection.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(step)
+            connection.execute(f"PRAGMA user_version = {int(version)}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        applied.append((version, description))
+    if applied:
+        connection.execute("PRAGMA optimize")
+    return applied
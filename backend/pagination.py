@@ -0,0 +1,81 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Query
+
+import settings
+
+NEXT_PAGE_HEADER = 'X-Next-Page-Token'
+
+
+# Opaque continuation token: base64url-encoded JSON holding the last id seen
+def encode_page_token(after_id):
+    raw = json.dumps({"after_id": after_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_page_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        after_id = json.loads(base64.urlsafe_b64decode(padded))["after_id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    if not isinstance(after_id, int):
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    return after_id
+
+
+class PageParams:
+    # Query parameters shared by the keyset-paginated list endpoints.
+    #
+    # `page_token` (from the previous response's X-Next-Page-Token header)
+    # takes precedence over `after_id`. With `stream=true` the rows after the
+    # cursor are streamed as NDJSON and `limit` is only applied if given.
+
+    def __init__(
+        self,
+        after_id: Optional[int] = Query(None, ge=0),
+        limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE),
+        page_token: Optional[str] = None,
+        stream: bool = False,
+    ):
+        self.after_id = decode_page_token(page_token) if page_token else (after_id or 0)
+        self.stream = stream
+        if limit is None and not stream:
+            limit = settings.DEFAULT_PAGE_SIZE
+        self.limit = limit
+
+
+# Build the keyset query for one page (or, when limit is None, the whole tail)
+def keyset_query(table, columns, after_id, limit, where=None):
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE id > ?"
+    params = [after_id]
+    if where:
+        sql += f" AND {where[0]}"
+        params.extend(where[1])
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+# Generator yielding NDJSON lines straight off a cursor, fetchmany at a time.
+# It checks its own connection out of the pool because the request-scoped
+# connection is released before the response body is sent.
+def stream_ndjson(pool, sql, params, columns, batch_size=None):
+    batch_size = batch_size or settings.STREAM_BATCH_SIZE
+    connection = pool.acquire()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows).encode()
+    finally:
+        cursor.close()
+        pool.release(connection)
@@ -0,0 +1,193 @@
+# Query-plan regression check.
+#
+# Runs EXPLAIN QUERY PLAN on every SQL statement written in the modules listed
+# in SOURCE_FILES (plus the queries the list endpoints generate) against a freshly migrated scratch
+# database, and fails if any of them does a full SCAN of one of the large
+# tables. SQL written as f-strings is rendered with the representative values
+# in fstring_bindings(). Run it from the backend directory:
+#
+#     python query_plan_check.py
+#
+# It exits with status 1 and prints the offending plans on failure. The same
+# check runs under pytest (test_query_plans.py).
+import ast
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+from archive import ARCHIVE_ALIAS, ARCHIVE_SCHEMA, LOOKUP_ALIAS
+from migrations import migrate
+
+# Tables that grow with usage and must never be scanned in full
+LARGE_TABLES = ('quizzes', 'questions', 'attempts', 'quiz_categories', 'quiz_levels', 'quiz_topics')
+
+SQL_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+_SQL_START = re.compile(r'(?:%s)\b' % '|'.join(SQL_PREFIXES), re.IGNORECASE)
+
+SOURCE_FILES = ('main.py', 'grading.py', 'stats.py', 'search.py', 'sampling.py', 'export.py', 'archive.py', 'jobs.py', 'analytics.py', 'facets.py')
+
+_NAMED_PARAM = re.compile(r'[:@$]([A-Za-z_][A-Za-z0-9_]*)')
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Representative values for the names interpolated into f-string SQL, per
+# source file. Each entry is a group of alternatives whose names go together
+# (a facet's table and columns); an f-string is rendered once for every
+# combination of the groups it uses.
+def fstring_bindings(path):
+    from archive import ATTEMPT_COLUMNS
+    from facets import FACETS, facet_filter
+    from stats import AGGREGATE_TABLES, rebuild_sources
+
+    groups = [
+        [{'placeholders': '?, ?, ?'}],
+        [{'ATTEMPT_COLUMNS': ATTEMPT_COLUMNS, 'ARCHIVE_ALIAS': ARCHIVE_ALIAS, 'LOOKUP_ALIAS': LOOKUP_ALIAS}],
+    ]
+    if path == 'main.py':
+        # cascade_delete_quiz
+        groups.append([{'table': table} for table in ('attempts', 'questions')])
+    elif path == 'stats.py':
+        groups.append([{'table': table} for table in AGGREGATE_TABLES])
+        groups.append([dict(zip(('where', 'score_sources', 'leader_sources'), (where, *rebuild_sources(where, True))))
+                       for where in ("quiz_id = ?", "quiz_id IN (SELECT id FROM quizzes)")])
+    elif path == 'facets.py':
+        groups.append([dict(zip(('table', 'column', 'values', 'name_column'), names)) for names in FACETS.values()])
+        groups.append([{'subquery': facet_filter(selected)[0]}
+                       for selected in ({'category': [1]}, {'category': [1, 2], 'level': [3], 'topic': [4]})])
+    return groups
+
+
+# Render an f-string node with every combination of the binding groups that
+# define its names; None when some name has no representative value
+def render_fstring(node, path, groups):
+    names = {part.id for part in ast.walk(node) if isinstance(part, ast.Name)}
+    used = [group for group in groups if names & set(group[0])]
+    if not names <= {name for group in used for name in group[0]}:
+        return None
+    code = compile(ast.fix_missing_locations(ast.Expression(node)), path, 'eval')
+    rendered = []
+    for combination in itertools.product(*used):
+        bindings = {}
+        for choice in combination:
+            bindings.update(choice)
+        try:
+            sql = eval(code, {}, bindings)
+        except NameError:
+            continue
+        if sql not in rendered:
+            rendered.append(sql)
+    return rendered
+
+
+# Every string literal in the source files that looks like a DML statement,
+# f-strings rendered with representative values. An f-string with a name
+# fstring_bindings() does not know for its file is reported with sql None.
+def collect_statements(paths=SOURCE_FILES):
+    statements = []
+    for path in paths:
+        groups = fstring_bindings(path)
+        with open(os.path.join(_HERE, path), encoding='utf-8') as source:
+            tree = ast.parse(source.read(), filename=path)
+        formatted = {
+            id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr)
+            for part in ast.walk(node) if part is not node
+        }
+        for node in ast.walk(tree):
+            if id(node) in formatted:
+                continue
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                sql = node.value.strip()
+                if _SQL_START.match(sql):
+                    statements.append((f"{path}:{node.lineno}", sql))
+            elif isinstance(node, ast.JoinedStr):
+                head = node.values[0] if node.values else None
+                if not (isinstance(head, ast.Constant) and _SQL_START.match(head.value.strip())):
+                    continue
+                rendered = render_fstring(node, path, groups)
+                if rendered is None:
+                    statements.append((f"{path}:{node.lineno}", None))
+                for sql in rendered or ():
+                    statements.append((f"{path}:{node.lineno}", sql.strip()))
+    return statements
+
+
+# Queries built at runtime rather than written as literals
+def generated_statements():
+    from pagination import keyset_query
+    statements = []
+    for table, columns in (
+        ('quizzes', ('id', 'title', 'description')),
+        ('categories', ('id', 'category_name', 'description')),
+        ('levels', ('id', 'level_name', 'description')),
+        ('topics', ('id', 'topic_name', 'description')),
+    ):
+        statements.append((f"keyset_query({table})", keyset_query(table, columns, 0, 100)[0]))
+    from facets import facet_filter
+    for selected in ({'category': [1]}, {'category': [1, 2], 'level': [3], 'topic': [4]}):
+        subquery, _ = facet_filter(selected)
+        statements.append((f"facet_filter({sorted(selected)})", keyset_query(
+            'quizzes', ('id', 'title', 'description'), 0, 100, (f"id IN ({subquery})", []))[0]))
+    return statements
+
+
+def explain(connection, sql):
+    names = _NAMED_PARAM.findall(sql)
+    params = {name: None for name in names} if names else [None] * sql.count('?')
+    return [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def full_scans(plan):
+    scans = []
+    for detail in plan:
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+        if match and match.group(1) in LARGE_TABLES:
+            scans.append(detail)
+    return scans
+
+
+# Returns a list of (location, sql, problem) tuples; empty means every plan is fine
+def check_query_plans(statements=None):
+    if statements is None:
+        statements = collect_statements() + generated_statements()
+    problems = []
+    with tempfile.TemporaryDirectory() as scratch:
+        connection = sqlite3.connect(os.path.join(scratch, 'plan_check.sqlite3'))
+        try:
+            migrate(connection)
+            for alias in (ARCHIVE_ALIAS, LOOKUP_ALIAS):
+                connection.execute(f"ATTACH DATABASE ':memory:' AS {alias}")
+                for statement in ARCHIVE_SCHEMA:
+                    connection.execute(statement.format(alias=alias))
+            connection.execute("ANALYZE")
+            for location, sql in statements:
+                if sql is None:
+                    problems.append((location, '', "f-string SQL with no representative values in fstring_bindings()"))
+                    continue
+                try:
+                    plan = explain(connection, sql)
+                except sqlite3.Error as exc:
+                    problems.append((location, sql, f"cannot prepare: {exc}"))
+                    continue
+                for detail in full_scans(plan):
+                    problems.append((location, sql, detail))
+        finally:
+            connection.close()
+    return problems
+
+
+def main():
+    statements = collect_statements() + generated_statements()
+    problems = check_query_plans(statements)
+    for location, sql, problem in problems:
+        print(f"{location}: {problem}\n    {' '.join(sql.split())}")
+    print(f"{len(statements)} statements checked, {len(problems)} problems")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
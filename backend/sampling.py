@@ -0,0 +1,77 @@
+import random
+from array import array
+from bisect import bisect_right
+
+from cache import LRUCache
+
+# Random question sampling for generated practice exams.
+#
+# Each quiz's question ids are cached as a dense, sorted array('q'), so a
+# draw never sorts or scans the questions table: k distinct positions are
+# picked from the concatenated pools with Floyd's algorithm (O(k) expected),
+# mapped back to ids by bisecting the pool offsets, and only the k chosen rows
+# are read. Draws are reproducible: the same seed and pool give the same
+# questions in the same order.
+
+
+class QuestionIdCache(LRUCache):
+    # LRU cache of per-quiz question id arrays, invalidated on question changes
+
+    def __init__(self, max_entries):
+        super().__init__(max_entries)
+
+    def get(self, connection, quiz_id):
+        return self.get_or_load(quiz_id, lambda: array('q', (row[0] for row in connection.execute(
+            "SELECT id FROM questions WHERE quiz_id = ? ORDER BY id", (quiz_id,)
+        ))))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "question_ids": sum(len(ids) for ids in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Quizzes among `quiz_ids` the user has already attempted. An attempt answers
+# every question of its quiz, so those questions count as seen. Archived
+# attempts count through archived_user_quizzes.
+def attempted_quizzes(connection, user_id, quiz_ids):
+    placeholders = ','.join('?' * len(quiz_ids))
+    rows = connection.execute(
+        f'''SELECT quiz_id FROM attempts WHERE user_id = ? AND quiz_id IN ({placeholders})
+            UNION SELECT quiz_id FROM archived_user_quizzes WHERE user_id = ? AND quiz_id IN ({placeholders})''',
+        (user_id, *quiz_ids, user_id, *quiz_ids)
+    )
+    return {row[0] for row in rows}
+
+
+# k distinct integers from range(total), in a random order (Floyd's algorithm)
+def sample_positions(rng, total, k):
+    chosen = {}
+    for upper in range(total - k, total):
+        candidate = rng.randint(0, upper)
+        if candidate in chosen:
+            candidate = upper
+        chosen[candidate] = None
+    positions = list(chosen)
+    rng.shuffle(positions)
+    return positions
+
+
+def sample_question_ids(pools, k, seed):
+    offsets = []
+    total = 0
+    for ids in pools:
+        offsets.append(total)
+        total += len(ids)
+    k = min(k, total)
+    rng = random.Random(seed)
+    sampled = []
+    for position in sample_positions(rng, total, k):
+        pool = bisect_right(offsets, position) - 1
+        sampled.append(pools[pool][position - offsets[pool]])
+    return sampled, total
@@ -0,0 +1,55 @@
+import re
+
+# Full-text search over the FTS5 indexes created by migration 5. The indexes
+# are external-content tables kept in sync with quizzes and questions by
+# triggers, so they store only the inverted index, not a copy of the text.
+
+SEARCH_KINDS = ('questions', 'quizzes')
+
+SNIPPET_TOKENS = 12
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+# Turn free text into an FTS5 query: every word must match, and the last one
+# also matches as a prefix so results show up while the user is still typing.
+# Words are quoted, so FTS5 operators in user input are treated as text.
+def build_match_query(text):
+    terms = _TERM.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_quizzes(connection, match, limit, offset):
+    rows = connection.execute(
+        '''SELECT quizzes.id, quizzes.title,
+                  snippet(quizzes_fts, -1, '[', ']', '...', ?) AS snippet,
+                  bm25(quizzes_fts, 10.0, 1.0) AS rank
+           FROM quizzes_fts JOIN quizzes ON quizzes.id = quizzes_fts.rowid
+           WHERE quizzes_fts MATCH ?
+           ORDER BY rank LIMIT ? OFFSET ?''',
+        (SNIPPET_TOKENS, match, limit, offset)
+    ).fetchall()
+    return [
+        {"kind": "quiz", "id": id, "quiz_id": id, "title": title, "snippet": snippet, "rank": rank}
+        for id, title, snippet, rank in rows
+    ]
+
+
+def search_questions(connection, match, limit, offset, quiz_id=None):
+    rows = connection.execute(
+        '''SELECT questions.id, questions.quiz_id, questions.question_text,
+                  snippet(questions_fts, -1, '[', ']', '...', ?) AS snippet,
+                  bm25(questions_fts, 5.0, 1.0) AS rank
+           FROM questions_fts JOIN questions ON questions.id = questions_fts.rowid
+           WHERE questions_fts MATCH ? AND (? IS NULL OR questions.quiz_id = ?)
+           ORDER BY rank LIMIT ? OFFSET ?''',
+        (SNIPPET_TOKENS, match, quiz_id, quiz_id, limit, offset)
+    ).fetchall()
+    return [
+        {"kind": "question", "id": id, "quiz_id": quiz, "title": text, "snippet": snippet, "rank": rank}
+        for id, quiz, text, snippet, rank in rows
+    ]
@@ -0,0 +1,147 @@
+import os
+
+# Runtime configuration, read once from the environment at import time.
+# Every value has a default that matches the single-process setup in guide.txt.
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return value.lower() not in ('0', 'false', 'no', 'off') if value not in (None, '') else default
+
+
+# Database file, relative to the directory the backend is started from
+DATABASE_PATH = os.environ.get('PQUIZ_DB_PATH', 'pquiz_db.sqlite3')
+
+# Connection pool
+DB_POOL_SIZE = _env_int('PQUIZ_DB_POOL_SIZE', 8)
+DB_POOL_TIMEOUT = _env_float('PQUIZ_DB_POOL_TIMEOUT', 5.0)
+DB_STATEMENT_CACHE_SIZE = _env_int('PQUIZ_DB_STATEMENT_CACHE_SIZE', 512)
+DB_BUSY_TIMEOUT_MS = _env_int('PQUIZ_DB_BUSY_TIMEOUT_MS', 5000)
+DB_CACHE_SIZE_KB = _env_int('PQUIZ_DB_CACHE_SIZE_KB', 65536)
+DB_MMAP_SIZE = _env_int('PQUIZ_DB_MMAP_SIZE', 268435456)
+
+# Multi-process deployments: number of server processes sharing the database
+# (uvicorn's WEB_CONCURRENCY unless set), and the retry policy for writes that
+# still find the database locked after busy_timeout
+WORKERS = _env_int('PQUIZ_WORKERS', _env_int('WEB_CONCURRENCY', 1))
+DB_WRITE_RETRIES = _env_int('PQUIZ_DB_WRITE_RETRIES', 5)
+DB_RETRY_BASE_MS = _env_float('PQUIZ_DB_RETRY_BASE_MS', 10.0)
+DB_RETRY_MAX_MS = _env_float('PQUIZ_DB_RETRY_MAX_MS', 1000.0)
+
+# List endpoints
+DEFAULT_PAGE_SIZE = _env_int('PQUIZ_DEFAULT_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = _env_int('PQUIZ_MAX_PAGE_SIZE', 1000)
+STREAM_BATCH_SIZE = _env_int('PQUIZ_STREAM_BATCH_SIZE', 500)
+# Encode list pages straight from cursor rows instead of through the response models
+FAST_JSON_LISTS = _env_bool('PQUIZ_FAST_JSON_LISTS', True)
+
+# Bulk question import
+BULK_IMPORT_BATCH_SIZE = _env_int('PQUIZ_BULK_IMPORT_BATCH_SIZE', 2000)
+BULK_IMPORT_MAX_ERRORS = _env_int('PQUIZ_BULK_IMPORT_MAX_ERRORS', 1000)
+
+# Group-commit writer for attempt submissions
+ATTEMPT_BATCH_SIZE = _env_int('PQUIZ_ATTEMPT_BATCH_SIZE', 256)
+ATTEMPT_FLUSH_INTERVAL_MS = _env_float('PQUIZ_ATTEMPT_FLUSH_INTERVAL_MS', 5.0)
+ATTEMPT_QUEUE_SIZE = _env_int('PQUIZ_ATTEMPT_QUEUE_SIZE', 10000)
+
+# Most attempts one POST /attempts/batch request may carry
+ATTEMPT_SYNC_MAX_ITEMS = _env_int('PQUIZ_ATTEMPT_SYNC_MAX_ITEMS', 500)
+
+# Grading
+ANSWER_KEY_CACHE_SIZE = _env_int('PQUIZ_ANSWER_KEY_CACHE_SIZE', 4096)
+REGRADE_BATCH_SIZE = _env_int('PQUIZ_REGRADE_BATCH_SIZE', 5000)
+
+# Full-quiz response cache
+QUIZ_CACHE_MAX_BYTES = _env_int('PQUIZ_QUIZ_CACHE_MAX_BYTES', 67108864)
+
+# Leaderboards: number of top attempts kept per quiz
+LEADERBOARD_SIZE = _env_int('PQUIZ_LEADERBOARD_SIZE', 100)
+
+# Instrumentation: statements slower than this are logged to pquiz.sql.slow
+SLOW_QUERY_MS = _env_float('PQUIZ_SLOW_QUERY_MS', 100.0)
+
+# Full-text search: deepest offset a client may page to
+SEARCH_MAX_OFFSET = _env_int('PQUIZ_SEARCH_MAX_OFFSET', 1000)
+
+# Question sampling: quizzes whose question ids are kept in memory, and the
+# most questions and quizzes one draw may use
+SAMPLE_POOL_CACHE_SIZE = _env_int('PQUIZ_SAMPLE_POOL_CACHE_SIZE', 4096)
+SAMPLE_MAX_QUESTIONS = _env_int('PQUIZ_SAMPLE_MAX_QUESTIONS', 200)
+SAMPLE_MAX_QUIZZES = _env_int('PQUIZ_SAMPLE_MAX_QUIZZES', 100)
+
+# Attempt export: rows per fetchmany() batch and gzip compression level
+EXPORT_BATCH_SIZE = _env_int('PQUIZ_EXPORT_BATCH_SIZE', 2000)
+EXPORT_GZIP_LEVEL = _env_int('PQUIZ_EXPORT_GZIP_LEVEL', 6)
+
+# Live sessions: messages queued per client before it counts as too slow,
+# tally broadcast interval, and clients per room
+LIVE_CLIENT_QUEUE_SIZE = _env_int('PQUIZ_LIVE_CLIENT_QUEUE_SIZE', 64)
+LIVE_TALLY_INTERVAL_MS = _env_float('PQUIZ_LIVE_TALLY_INTERVAL_MS', 250.0)
+LIVE_MAX_CLIENTS = _env_int('PQUIZ_LIVE_MAX_CLIENTS', 2000)
+
+# Attempt archival: attempts older than ARCHIVE_AFTER_DAYS (0 disables it) are
+# moved into monthly archive databases in ARCHIVE_DIR, checked every
+# ARCHIVE_INTERVAL_SECONDS, in batches with a pause between them
+ARCHIVE_DIR = os.environ.get('PQUIZ_ARCHIVE_DIR') or os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), 'archives')
+ARCHIVE_AFTER_DAYS = _env_float('PQUIZ_ARCHIVE_AFTER_DAYS', 180.0)
+ARCHIVE_INTERVAL_SECONDS = _env_float('PQUIZ_ARCHIVE_INTERVAL_SECONDS', 3600.0)
+ARCHIVE_BATCH_SIZE = _env_int('PQUIZ_ARCHIVE_BATCH_SIZE', 500)
+ARCHIVE_BATCH_PAUSE_MS = _env_float('PQUIZ_ARCHIVE_BATCH_PAUSE_MS', 50.0)
+
+# Background jobs: worker threads per server process, how often idle workers
+# poll for jobs queued by other processes, how long finished jobs are kept
+# (0 keeps them forever), how long a running job stays claimed without a
+# heartbeat from its worker, how long a job doing one long transaction
+# (VACUUM, ANALYZE, a full stats rebuild) stays claimed, since heartbeats
+# cannot renew it meanwhile, and rows per chunk of a cascade delete
+JOB_WORKERS = _env_int('PQUIZ_JOB_WORKERS', 1)
+JOB_POLL_INTERVAL_SECONDS = _env_float('PQUIZ_JOB_POLL_INTERVAL_SECONDS', 2.0)
+JOB_RETENTION_DAYS = _env_float('PQUIZ_JOB_RETENTION_DAYS', 14.0)
+JOB_LEASE_SECONDS = _env_float('PQUIZ_JOB_LEASE_SECONDS', 60.0)
+JOB_MAINTENANCE_LEASE_SECONDS = _env_float('PQUIZ_JOB_MAINTENANCE_LEASE_SECONDS', 6 * 3600.0)
+JOB_DELETE_CHUNK_SIZE = _env_int('PQUIZ_JOB_DELETE_CHUNK_SIZE', 2000)
+
+# Item analysis: quizzes whose statistics are kept in memory, and attempts per
+# response-matrix batch
+ANALYTICS_CACHE_SIZE = _env_int('PQUIZ_ANALYTICS_CACHE_SIZE', 256)
+ANALYTICS_BATCH_SIZE = _env_int('PQUIZ_ANALYTICS_BATCH_SIZE', 20000)
+
+# Admission control, per server process: requests run at once and requests
+# allowed to wait for a slot, for reads (GET, HEAD) and for writes, how long
+# one may wait, and the Retry-After sent with the 503 when it cannot. A limit
+# of 0 disables that gate. The read and write limits plus the bulk import and
+# export route limits below (20 + 12 + 2 + 2) stay below the threadpool's 40
+# threads, so admitted requests never wait for a thread; the attempt routes
+# are async and hold no thread while they wait.
+ADMISSION_READ_LIMIT = _env_int('PQUIZ_ADMISSION_READ_LIMIT', 20)
+ADMISSION_READ_QUEUE = _env_int('PQUIZ_ADMISSION_READ_QUEUE', 96)
+ADMISSION_WRITE_LIMIT = _env_int('PQUIZ_ADMISSION_WRITE_LIMIT', 12)
+ADMISSION_WRITE_QUEUE = _env_int('PQUIZ_ADMISSION_WRITE_QUEUE', 48)
+ADMISSION_QUEUE_TIMEOUT_SECONDS = _env_float('PQUIZ_ADMISSION_QUEUE_TIMEOUT_SECONDS', 2.0)
+ADMISSION_RETRY_AFTER_SECONDS = _env_int('PQUIZ_ADMISSION_RETRY_AFTER_SECONDS', 1)
+# Routes admitted by a gate of their own instead of the read or write gate, as
+# "METHOD path=limit:queue" items separated by commas. Attempt submission is
+# async and group-committed, so it takes many at once; bulk import and export
+# hold their slot for the whole body and get only a few.
+ADMISSION_ROUTE_LIMITS = os.environ.get(
+    'PQUIZ_ADMISSION_ROUTE_LIMITS',
+    'POST /attempts/=256:2048,POST /attempts/batch=8:32,'
+    'POST /quizzes/{quiz_id}/questions/bulk=2:4,GET /attempts/export=2:2',
+)
+
+# Per-user attempt rate limit on POST /attempts/ and on each attempt of
+# POST /attempts/batch: attempts per second on average (0 disables it) and the
+# burst allowed on top, for at most ATTEMPT_RATE_MAX_USERS recently seen users
+ATTEMPT_RATE_PER_USER = _env_float('PQUIZ_ATTEMPT_RATE_PER_USER', 0.0)
+ATTEMPT_BURST_PER_USER = _env_int('PQUIZ_ATTEMPT_BURST_PER_USER', 10)
+ATTEMPT_RATE_MAX_USERS = _env_int('PQUIZ_ATTEMPT_RATE_MAX_USERS', 100000)
@@ -0,0 +1,208 @@
+import argparse
+import math
+import sys
+
+import settings
+
+# Per-quiz aggregates maintained incrementally by the attempt writer:
+#
+#   quiz_stats         running count, sum and sum of squares of scores
+#   quiz_score_counts  score distribution, one row per distinct score
+#   quiz_leaderboard   the top LEADERBOARD_SIZE attempts, indexed by score
+#
+# Reads are O(K) index walks; the rebuild functions recompute everything from
+# the attempts table for consistency checks and after re-grading. Attempts
+# moved out by archive.py are accounted for through archived_score_counts and
+# archived_leaderboard, which keep their share of the aggregates.
+
+AGGREGATE_TABLES = ('quiz_stats', 'quiz_score_counts', 'quiz_leaderboard')
+
+
+# Runs inside the writer's batch transaction, right after the attempt insert
+def record_attempt(connection, quiz_id, user_id, attempt_id, score):
+    if score is None:
+        return
+    connection.execute(
+        '''INSERT INTO quiz_stats (quiz_id, attempt_count, score_sum, score_sq_sum, min_score, max_score)
+           VALUES (?, 1, ?, ?, ?, ?)
+           ON CONFLICT (quiz_id) DO UPDATE SET
+               attempt_count = attempt_count + 1,
+               score_sum = score_sum + excluded.score_sum,
+               score_sq_sum = score_sq_sum + excluded.score_sq_sum,
+               min_score = min(min_score, excluded.min_score),
+               max_score = max(max_score, excluded.max_score)''',
+        (quiz_id, score, score * score, score, score)
+    )
+    connection.execute(
+        '''INSERT INTO quiz_score_counts (quiz_id, score, attempt_count) VALUES (?, ?, 1)
+           ON CONFLICT (quiz_id, score) DO UPDATE SET attempt_count = attempt_count + 1''',
+        (quiz_id, score)
+    )
+    connection.execute(
+        "INSERT INTO quiz_leaderboard (quiz_id, attempt_id, user_id, score) VALUES (?, ?, ?, ?)",
+        (quiz_id, attempt_id, user_id, score)
+    )
+    # Keep the table bounded: drop whatever fell out of the top K
+    connection.execute(
+        '''DELETE FROM quiz_leaderboard WHERE quiz_id = ? AND attempt_id IN (
+               SELECT attempt_id FROM quiz_leaderboard WHERE quiz_id = ?
+               ORDER BY score DESC, attempt_id LIMIT -1 OFFSET ?)''',
+        (quiz_id, quiz_id, settings.LEADERBOARD_SIZE)
+    )
+
+
+def leaderboard(connection, quiz_id, limit):
+    rows = connection.execute(
+        "SELECT attempt_id, user_id, score FROM quiz_leaderboard WHERE quiz_id = ? ORDER BY score DESC, attempt_id LIMIT ?",
+        (quiz_id, limit)
+    ).fetchall()
+    return [
+        {"rank": rank, "attempt_id": attempt_id, "user_id": user_id, "score": score}
+        for rank, (attempt_id, user_id, score) in enumerate(rows, start=1)
+    ]
+
+
+def quiz_stats(connection, quiz_id):
+    row = connection.execute(
+        "SELECT attempt_count, score_sum, score_sq_sum, min_score, max_score FROM quiz_stats WHERE quiz_id = ?",
+        (quiz_id,)
+    ).fetchone()
+    if row is None:
+        return {"quiz_id": quiz_id, "attempt_count": 0, "mean_score": None, "stddev_score": None,
+                "min_score": None, "max_score": None, "distribution": []}
+    count, total, total_sq, min_score, max_score = row
+    mean = total / count
+    distribution = connection.execute(
+        "SELECT score, attempt_count FROM quiz_score_counts WHERE quiz_id = ? ORDER BY score",
+        (quiz_id,)
+    ).fetchall()
+    return {
+        "quiz_id": quiz_id,
+        "attempt_count": count,
+        "mean_score": mean,
+        "stddev_score": math.sqrt(max(total_sq / count - mean * mean, 0.0)),
+        "min_score": min_score,
+        "max_score": max_score,
+        "distribution": [{"score": score, "count": n} for score, n in distribution],
+    }
+
+
+def clear_quiz_stats(connection, quiz_id):
+    for table in AGGREGATE_TABLES:
+        connection.execute(f"DELETE FROM {table} WHERE quiz_id = ?", (quiz_id,))
+
+
+# Recompute the aggregates of one quiz, or of every quiz, from the attempts
+# table. Runs inside the caller's transaction.
+def recompute_stats(connection, quiz_id=None):
+    if quiz_id is not None:
+        clear_quiz_stats(connection, quiz_id)
+        _rebuild(connection, "quiz_id = ?", (quiz_id,))
+    else:
+        for table in AGGREGATE_TABLES:
+            connection.execute(f"DELETE FROM {table}")
+        _rebuild(connection, "quiz_id IN (SELECT id FROM quizzes)", ())
+
+
+def rebuild_quiz_stats(connection, quiz_id):
+    with connection:
+        recompute_stats(connection, quiz_id)
+
+
+def rebuild_all_stats(connection):
+    with connection:
+        recompute_stats(connection)
+
+
+# The command line below does not migrate; a database the server has not yet
+# brought to migration 7 has no archived_* tables to add in
+def _has_archive_tables(connection):
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_score_counts'"
+    ).fetchone() is not None
+
+
+# The score counts and leaderboard candidates of the quizzes matching
+# `where`, from the attempts table and, with `archived`, the archived shares
+def rebuild_sources(where, archived):
+    score_sources = f"""SELECT quiz_id, score, count(*) AS attempt_count
+                FROM attempts WHERE score IS NOT NULL AND {where} GROUP BY quiz_id, score"""
+    leader_sources = f"SELECT quiz_id, id, user_id, score FROM attempts WHERE score IS NOT NULL AND {where}"
+    if archived:
+        score_sources += f" UNION ALL SELECT quiz_id, score, attempt_count FROM archived_score_counts WHERE {where}"
+        leader_sources += f" UNION ALL SELECT quiz_id, attempt_id, user_id, score FROM archived_leaderboard WHERE {where}"
+    return score_sources, leader_sources
+
+
+def _rebuild(connection, where, params):
+    archived = _has_archive_tables(connection)
+    score_sources, leader_sources = rebuild_sources(where, archived)
+    copies = 2 if archived else 1
+    connection.execute(
+        f'''INSERT INTO quiz_score_counts (quiz_id, score, attempt_count)
+            SELECT quiz_id, score, sum(attempt_count) FROM ({score_sources})
+            GROUP BY quiz_id, score''',
+        params * copies
+    )
+    # The distribution determines every other statistic
+    connection.execute(
+        f'''INSERT INTO quiz_stats (quiz_id, attempt_count, score_sum, score_sq_sum, min_score, max_score)
+            SELECT quiz_id, sum(attempt_count), sum(score * attempt_count), sum(score * score * attempt_count),
+                   min(score), max(score)
+            FROM quiz_score_counts WHERE {where} GROUP BY quiz_id''',
+        params
+    )
+    connection.execute(
+        f'''INSERT INTO quiz_leaderboard (quiz_id, attempt_id, user_id, score)
+            SELECT quiz_id, id, user_id, score FROM (
+                SELECT quiz_id, id, user_id, score,
+                       row_number() OVER (PARTITION BY quiz_id ORDER BY score DESC, id) AS position
+                FROM ({leader_sources}))
+            WHERE position <= ?''',
+        (*(params * copies), settings.LEADERBOARD_SIZE)
+    )
+
+
+# Compare the stored aggregates with a fresh recomputation; returns the ids of
+# quizzes whose aggregates disagree
+def check_stats(connection):
+    connection.execute("SAVEPOINT check_stats")
+    try:
+        stored = {table: set(connection.execute(f"SELECT * FROM {table}")) for table in AGGREGATE_TABLES}
+        recompute_stats(connection)
+        fresh = {table: set(connection.execute(f"SELECT * FROM {table}")) for table in AGGREGATE_TABLES}
+    finally:
+        connection.execute("ROLLBACK TO check_stats")
+        connection.execute("RELEASE check_stats")
+    mismatched = set()
+    for table in AGGREGATE_TABLES:
+        mismatched.update(row[0] for row in stored[table] ^ fresh[table])
+    return sorted(mismatched)
+
+
+def main(argv=None):
+    from db_pool import open_connection
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify the per-quiz leaderboard and statistics tables.")
+    parser.add_argument('command', choices=('rebuild', 'check'))
+    parser.add_argument('--quiz-id', type=int, help="rebuild a single quiz instead of all of them")
+    args = parser.parse_args(argv)
+
+    connection = open_connection(settings.DATABASE_PATH)
+    try:
+        if args.command == 'check':
+            mismatched = check_stats(connection)
+            print(f"{len(mismatched)} quizzes with stale aggregates" + (f": {mismatched}" if mismatched else ""))
+            return 1 if mismatched else 0
+        if args.quiz_id is not None:
+            rebuild_quiz_stats(connection, args.quiz_id)
+        else:
+            rebuild_all_stats(connection)
+        print("Aggregates rebuilt")
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+from query_plan_check import check_query_plans, collect_statements, generated_statements
+
+
+def test_no_full_scans_of_large_tables():
+    problems = check_query_plans(collect_statements() + generated_statements())
+    assert not problems, '\n'.join(f"{location}: {problem}\n    {' '.join(sql.split())}"
+                                   for location, sql, problem in problems)
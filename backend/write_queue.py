@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriterQueueFull(Exception):
+    pass
+
+
+class GroupCommitWriter:
+    # A dedicated writer thread that commits queued writes in batches.
+    #
+    # submit() enqueues an item and returns a Future. The writer thread takes
+    # the first waiting item, keeps collecting until it has `batch_size` items
+    # or `flush_interval_ms` has passed, then runs `write(connection, item)`
+    # for each of them inside one transaction. Every future resolves with its
+    # write()'s return value once the whole batch has committed, so N writers
+    # pay for one fsync instead of N and never contend for SQLite's write lock.
+    # `retry(fn)`, if given, wraps every transaction, e.g. to retry it while
+    # another process holds the lock.
+
+    def __init__(self, name, connect, write, batch_size, flush_interval_ms, max_queue, retry=None):
+        self.name = name
+        self.connect = connect
+        self.write = write
+        self.retry = retry or (lambda fn: fn())
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._max_depth = 0
+        self._commit_total = 0.0
+        self._last_batch_size = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    # Drain what is already queued, then stop the writer thread
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, item):
+        if self._thread is None:
+            self.start()
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise WriterQueueFull(f"{self.name} queue is full")
+        with self._stats_lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return future
+
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        connection = self.connect()
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                batch = self._collect()
+                if batch:
+                    self._commit(connection, batch)
+        finally:
+            connection.close()
+
+    def _commit(self, connection, batch):
+        started = time.perf_counter()
+        try:
+            results = self.retry(lambda: self._transaction(connection, [item for item, _ in batch]))
+        except Exception:
+            # One bad item must not fail its neighbours: retry them one by one
+            self._commit_individually(connection, batch)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += len(batch)
+            self._commit_total += elapsed
+            self._last_batch_size = len(batch)
+
+    def _transaction(self, connection, items):
+        with connection:
+            return [self.write(connection, item) for item in items]
+
+    def _commit_individually(self, connection, batch):
+        for item, future in batch:
+            try:
+                result = self.retry(lambda: self._transaction(connection, [item])[0])
+            except Exception as exc:
+                with self._stats_lock:
+                    self._failed += 1
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "queue_depth": self._queue.qsize(),
+                "queue_max_depth": self._max_depth,
+                "queue_capacity": self._queue.maxsize,
+                "batch_size": self.batch_size,
+                "flush_interval_ms": self.flush_interval * 1000,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "failed": self._failed,
+                "batches": batches,
+                "rows": self._rows,
+                "last_batch_size": self._last_batch_size,
+                "avg_batch_size": (self._rows / batches) if batches else 0.0,
+                "avg_commit_ms": (self._commit_total / batches * 1000) if batches else 0.0,
+            }
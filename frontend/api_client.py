@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+
+class ApiCall:
+    # Handle for one in-flight request. Cancelling it drops the callbacks; the
+    # HTTP request itself cannot be interrupted, but a call that has not
+    # started yet is never sent.
+
+    def __init__(self, method, path, owner):
+        self.method = method
+        self.path = path
+        self.owner = owner
+        self.future = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class ApiClient:
+    # Runs backend calls on a small thread pool over one keep-alive
+    # requests.Session and delivers results on the Kivy main thread through
+    # Clock.schedule_once, so button handlers never block the UI.
+    #
+    # on_success(response) is called for 2xx/3xx responses, on_error(error) for
+    # connection errors, timeouts and 4xx/5xx responses (error is the
+    # exception, with .response set for HTTP errors).
+
+    def __init__(self, base_url, max_workers=4, timeout=10.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='api')
+        self._calls = set()
+        self._lock = threading.Lock()
+
+    def request(self, method, path, on_success=None, on_error=None, owner=None, timeout=None, **kwargs):
+        call = ApiCall(method, path, owner)
+        with self._lock:
+            self._calls.add(call)
+        call.future = self.executor.submit(self._send, call, on_success, on_error, timeout or self.timeout, kwargs)
+        call.future.add_done_callback(lambda future: future.cancelled() and self._forget(call))
+        return call
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    # Cancel every pending call made on behalf of `owner` (e.g. a screen being left)
+    def cancel_owner(self, owner):
+        with self._lock:
+            calls = [call for call in self._calls if call.owner is owner]
+        for call in calls:
+            call.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            calls = list(self._calls)
+        for call in calls:
+            call.cancel()
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def _send(self, call, on_success, on_error, timeout, kwargs):
+        if call.cancelled:
+            self._forget(call)
+            return
+        started = time.perf_counter()
+        try:
+            response = self.session.request(call.method, self.base_url + call.path, timeout=timeout, **kwargs)
+            response.raise_for_status()
+        except requests.RequestException as error:
+            self._log(call, started, getattr(error.response, 'status_code', type(error).__name__))
+            self._deliver(call, on_error, error)
+        else:
+            self._log(call, started, response.status_code)
+            self._deliver(call, on_success, response)
+
+    def _log(self, call, started, status):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        Logger.info(f"ApiClient: {call.method} {call.path} -> {status} in {elapsed_ms:.1f} ms")
+
+    def _deliver(self, call, callback, result):
+        def dispatch(dt):
+            self._forget(call)
+            if callback is not None and not call.cancelled:
+                callback(result)
+        Clock.schedule_once(dispatch)
+
+    def _forget(self, call):
+        with self._lock:
+            self._calls.discard(call)
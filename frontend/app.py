@@ -4,14 +4,46 @@ from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
-import requests
+from kivy.logger import Logger
+
+from api_client import ApiClient
+from local_store import AttemptSync, LocalStore
+from results_list import ResultsList
 
 # Base URL of the FastAPI app
 BASE_URL = 'http://127.0.0.1:8000'  # Replace with the actual URL of your FastAPI app
 
+# Offline store, relative to the directory the app is started from
+LOCAL_DB_PATH = 'pquiz_local.sqlite3'
+
+# Shared HTTP client: calls run on background threads over one keep-alive session
+api = ApiClient(BASE_URL)
+
+# Cached quizzes and queued attempts, and the background sync of those attempts
+store = LocalStore(LOCAL_DB_PATH)
+attempt_sync = AttemptSync(api, store)
+
 # Create the main screen manager
 screen_manager = ScreenManager()
 
+# Default result handlers: print the JSON body, log failures
+def print_response(response):
+    print(response.json() if response.content else response.status_code)
+
+def log_error(error):
+    response = getattr(error, 'response', None)
+    detail = response.text if response is not None else str(error)
+    Logger.error(f"QuizApp: request failed: {detail}")
+
+# Base class for screens that talk to the backend. Calls made through
+# self.call() are cancelled when the user leaves the screen.
+class ApiScreen(Screen):
+    def call(self, method, path, on_success=print_response, on_error=log_error, **kwargs):
+        return api.request(method, path, on_success=on_success, on_error=on_error, owner=self, **kwargs)
+
+    def on_leave(self, *args):
+        api.cancel_owner(self)
+
 # Home screen
 class HomeScreen(Screen):
     def __init__(self, **kwargs):
@@ -48,7 +80,7 @@ class HomeScreen(Screen):
 
 # Quizzes CRUD screen
 # Quizzes CRUD screen
-class QuizzesScreen(Screen):
+class QuizzesScreen(ApiScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -68,6 +100,9 @@ class QuizzesScreen(Screen):
         layout.add_widget(Button(text="Get Quizzes", on_press=self.get_quizzes))
         layout.add_widget(Button(text="Delete Quiz", on_press=self.delete_quiz))
         layout.add_widget(Button(text="Back to Home", on_press=self.goto_home))
+
+        self.results = ResultsList(self.call, ('id', 'title', 'description'), size_hint_y=4)
+        layout.add_widget(self.results)
         
         self.add_widget(layout)
 
@@ -76,34 +111,27 @@ class QuizzesScreen(Screen):
         description = self.description_input.text
         
         # Sending data as JSON in the request body
-        response = requests.post(
-            f'{BASE_URL}/quizzes/',
-            json={'title': title, 'description': description}
-        )
-        
-        print(response.json())
+        self.call('POST', '/quizzes/', json={'title': title, 'description': description})
 
     def get_quizzes(self, instance):
-        response = requests.get(f'{BASE_URL}/quizzes/')
-        print(response.json())
+        self.results.load('/quizzes/')
 
     def update_quiz(self, instance):
         quiz_id = 1  # Replace with actual quiz ID input or handling
         title = self.title_input.text
         description = self.description_input.text
-        response = requests.put(f'{BASE_URL}/quizzes/{quiz_id}', json={'title': title, 'description': description})
-        print(response.json())
+        self.call('PUT', f'/quizzes/{quiz_id}', json={'title': title, 'description': description})
 
     def delete_quiz(self, instance):
         quiz_id = 1  # Replace with actual quiz ID input or handling
-        response = requests.delete(f'{BASE_URL}/quizzes/{quiz_id}')
-        print(response.json())
+        self.call('DELETE', f'/quizzes/{quiz_id}')
 
     def goto_home(self, instance):
         screen_manager.current = 'home'
 
-# Attempts CRUD screen
-class AttemptsScreen(Screen):
+# Attempts CRUD screen. Attempts are recorded in the local store and sent to
+# the backend in batches by attempt_sync, so recording works offline.
+class AttemptsScreen(ApiScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -121,33 +149,75 @@ class AttemptsScreen(Screen):
         layout.add_widget(Label(text="Answers (comma separated):"))
         layout.add_widget(self.answers_input)
 
+        layout.add_widget(Button(text="Download Quiz for Offline Use", on_press=self.download_quiz))
         layout.add_widget(Button(text="Record Attempt", on_press=self.create_attempt))
         layout.add_widget(Button(text="Get Attempt", on_press=self.get_attempt))
         layout.add_widget(Button(text="Back to Home", on_press=self.goto_home))
+
+        self.status_label = Label(text="")
+        layout.add_widget(self.status_label)
         
         self.add_widget(layout)
 
+    def on_enter(self, *args):
+        attempt_sync.on_change = self.show_sync_status
+        self.show_sync_status()
+
+    def on_leave(self, *args):
+        super().on_leave(*args)
+        attempt_sync.on_change = None
+
+    def show_sync_status(self, message=None):
+        counts = store.attempt_counts()
+        status = f"Attempts: {counts.get('pending', 0)} waiting to sync, {counts.get('synced', 0)} synced"
+        if counts.get('rejected'):
+            status += f", {counts['rejected']} rejected"
+        self.status_label.text = f"{message}\n{status}" if message else status
+
+    def download_quiz(self, instance):
+        quiz_id = self.quiz_id_input.text.strip()
+        if not quiz_id.isdigit():
+            self.show_sync_status("Enter a numeric quiz ID")
+            return
+
+        def cached(response):
+            quiz = response.json()
+            store.cache_quiz(quiz)
+            self.show_sync_status(f"Quiz {quiz['id']} saved: {len(quiz['questions'])} questions")
+
+        def offline(error):
+            log_error(error)
+            quiz = store.quiz(int(quiz_id))
+            if quiz is None:
+                self.show_sync_status(f"Quiz {quiz_id} could not be downloaded")
+            else:
+                self.show_sync_status(f"Offline: using the saved copy of quiz {quiz_id} ({len(quiz['questions'])} questions)")
+
+        self.call('GET', f'/quizzes/{quiz_id}/full', on_success=cached, on_error=offline)
+
     def create_attempt(self, instance):
-        quiz_id = int(self.quiz_id_input.text)
-        user_id = int(self.user_id_input.text)
-        answers = self.answers_input.text.split(',')
-        
-        response = requests.post(
-            f'{BASE_URL}/attempts/',
-            json={'quiz_id': quiz_id, 'user_id': user_id, 'answers': answers}
-        )
-        print(response.json())
+        try:
+            quiz_id = int(self.quiz_id_input.text)
+            user_id = int(self.user_id_input.text)
+        except ValueError:
+            self.show_sync_status("Quiz ID and user ID must be numbers")
+            return
+        # One choice index per question; a blank or non-numeric answer skips it
+        answers = [int(answer) if answer.strip().isdigit() else None for answer in self.answers_input.text.split(',')]
+
+        store.add_attempt(quiz_id, user_id, answers)
+        self.show_sync_status("Attempt recorded")
+        attempt_sync.flush()
 
     def get_attempt(self, instance):
         attempt_id = 1  # Replace with actual attempt ID input or handling
-        response = requests.get(f'{BASE_URL}/attempts/{attempt_id}')
-        print(response.json())
+        self.call('GET', f'/attempts/{attempt_id}')
 
     def goto_home(self, instance):
         screen_manager.current = 'home'
 
 # Categories CRUD screen
-class CategoriesScreen(Screen):
+class CategoriesScreen(ApiScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -167,42 +237,35 @@ class CategoriesScreen(Screen):
         layout.add_widget(Button(text="Get Categories", on_press=self.get_categories))
         layout.add_widget(Button(text="Delete Category", on_press=self.delete_category))
         layout.add_widget(Button(text="Back to Home", on_press=self.goto_home))
+
+        self.results = ResultsList(self.call, ('id', 'category_name', 'description'), size_hint_y=4)
+        layout.add_widget(self.results)
         
         self.add_widget(layout)
 
     def create_category(self, instance):
         category_name = self.category_name_input.text
         description = self.description_input.text
-        response = requests.post(
-            f'{BASE_URL}/categories/',
-            json={'name': category_name, 'description': description}
-        )
-        print(response.json())
+        self.call('POST', '/categories/', json={'name': category_name, 'description': description})
 
     def get_categories(self, instance):
-        response = requests.get(f'{BASE_URL}/categories/')
-        print(response.json())
+        self.results.load('/categories/')
 
     def update_category(self, instance):
         category_id = 1  # Replace with actual category ID input or handling
         category_name = self.category_name_input.text
         description = self.description_input.text
-        response = requests.put(
-            f'{BASE_URL}/categories/{category_id}',
-            json={'name': category_name, 'description': description}
-        )
-        print(response.json())
+        self.call('PUT', f'/categories/{category_id}', json={'name': category_name, 'description': description})
 
     def delete_category(self, instance):
         category_id = 1  # Replace with actual category ID input or handling
-        response = requests.delete(f'{BASE_URL}/categories/{category_id}')
-        print(response.json())
+        self.call('DELETE', f'/categories/{category_id}')
 
     def goto_home(self, instance):
         screen_manager.current = 'home'
 
 # Levels CRUD screen
-class LevelsScreen(Screen):
+class LevelsScreen(ApiScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -222,42 +285,35 @@ class LevelsScreen(Screen):
         layout.add_widget(Button(text="Get Levels", on_press=self.get_levels))
         layout.add_widget(Button(text="Delete Level", on_press=self.delete_level))
         layout.add_widget(Button(text="Back to Home", on_press=self.goto_home))
+
+        self.results = ResultsList(self.call, ('id', 'level_name', 'description'), size_hint_y=4)
+        layout.add_widget(self.results)
         
         self.add_widget(layout)
 
     def create_level(self, instance):
         level_name = self.level_name_input.text
         description = self.description_input.text
-        response = requests.post(
-            f'{BASE_URL}/levels/',
-            json={'name': level_name, 'description': description}
-        )
-        print(response.json())
+        self.call('POST', '/levels/', json={'name': level_name, 'description': description})
 
     def get_levels(self, instance):
-        response = requests.get(f'{BASE_URL}/levels/')
-        print(response.json())
+        self.results.load('/levels/')
 
     def update_level(self, instance):
         level_id = 1  # Replace with actual level ID input or handling
         level_name = self.level_name_input.text
         description = self.description_input.text
-        response = requests.put(
-            f'{BASE_URL}/levels/{level_id}',
-            json={'name': level_name, 'description': description}
-        )
-        print(response.json())
+        self.call('PUT', f'/levels/{level_id}', json={'name': level_name, 'description': description})
 
     def delete_level(self, instance):
         level_id = 1  # Replace with actual level ID input or handling
-        response = requests.delete(f'{BASE_URL}/levels/{level_id}')
-        print(response.json())
+        self.call('DELETE', f'/levels/{level_id}')
 
     def goto_home(self, instance):
         screen_manager.current = 'home'
 
 # Topics CRUD screen
-class TopicsScreen(Screen):
+class TopicsScreen(ApiScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -277,46 +333,44 @@ class TopicsScreen(Screen):
         layout.add_widget(Button(text="Get Topics", on_press=self.get_topics))
         layout.add_widget(Button(text="Delete Topic", on_press=self.delete_topic))
         layout.add_widget(Button(text="Back to Home", on_press=self.goto_home))
+
+        self.results = ResultsList(self.call, ('id', 'topic_name', 'description'), size_hint_y=4)
+        layout.add_widget(self.results)
         
         self.add_widget(layout)
 
     def create_topic(self, instance):
         topic_name = self.topic_name_input.text
         description = self.description_input.text
-        response = requests.post(
-            f'{BASE_URL}/topics/',
-            json={'name': topic_name, 'description': description}
-        )
-        print(response.json())
+        self.call('POST', '/topics/', json={'name': topic_name, 'description': description})
 
     def get_topics(self, instance):
-        response = requests.get(f'{BASE_URL}/topics/')
-        print(response.json())
+        self.results.load('/topics/')
 
     def update_topic(self, instance):
         topic_id = 1  # Replace with actual topic ID input or handling
         topic_name = self.topic_name_input.text
         description = self.description_input.text
-        response = requests.put(
-            f'{BASE_URL}/topics/{topic_id}',
-            json={'name': topic_name, 'description': description}
-        )
-        print(response.json())
+        self.call('PUT', f'/topics/{topic_id}', json={'name': topic_name, 'description': description})
 
     def delete_topic(self, instance):
         topic_id = 1  # Replace with actual topic ID input or handling
-        response = requests.delete(f'{BASE_URL}/topics/{topic_id}')
-        print(response.json())
+        self.call('DELETE', f'/topics/{topic_id}')
 
     def goto_home(self, instance):
         screen_manager.current = 'home'
 
-class QuestionsScreen(Screen):
+class QuestionsScreen(ApiScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         layout.add_widget(Label(text="Questions CRUD"))
 
+        # Quiz whose questions are listed
+        self.quiz_id_input = TextInput(hint_text='Enter quiz ID', multiline=False)
+        layout.add_widget(Label(text="Quiz ID:"))
+        layout.add_widget(self.quiz_id_input)
+
         # Input fields for creating and updating questions
         self.question_text_input = TextInput(hint_text='Enter question text', multiline=False)
         self.option_a_input = TextInput(hint_text='Enter option A', multiline=False)
@@ -343,60 +397,58 @@ class QuestionsScreen(Screen):
         layout.add_widget(Button(text="Get Questions", on_press=self.get_questions))
         layout.add_widget(Button(text="Delete Question", on_press=self.delete_question))
         layout.add_widget(Button(text="Back to Home", on_press=self.goto_home))
+
+        self.results = ResultsList(self.call, ('id', 'quiz_id', 'question_text', 'choices', 'correct_answer'), size_hint_y=4)
+        layout.add_widget(self.results)
         
         self.add_widget(layout)
 
+    # The filled-in options, in order, as the question's choices
+    def choices(self):
+        options = (self.option_a_input, self.option_b_input, self.option_c_input, self.option_d_input)
+        return [option.text.strip() for option in options if option.text.strip()]
+
     def create_question(self, instance):
+        quiz_id = self.quiz_id_input.text.strip()
+        if not quiz_id.isdigit():
+            Logger.error("QuizApp: enter a numeric quiz ID to add a question to")
+            return
         question_text = self.question_text_input.text
-        option_a = self.option_a_input.text
-        option_b = self.option_b_input.text
-        option_c = self.option_c_input.text
-        option_d = self.option_d_input.text
         correct_answer = self.correct_answer_input.text
         
-        response = requests.post(
-            f'{BASE_URL}/questions/',
-            json={
+        self.call('POST', f'/quizzes/{quiz_id}/questions/', json={
+                'quiz_id': int(quiz_id),
                 'question_text': question_text,
-                'option_a': option_a,
-                'option_b': option_b,
-                'option_c': option_c,
-                'option_d': option_d,
+                'choices': self.choices(),
                 'correct_answer': correct_answer
-            }
-        )
-        print(response.json())
+            })
 
     def get_questions(self, instance):
-        response = requests.get(f'{BASE_URL}/questions/')
-        print(response.json())
+        quiz_id = self.quiz_id_input.text.strip()
+        if not quiz_id.isdigit():
+            Logger.error("QuizApp: enter a numeric quiz ID to list its questions")
+            return
+        self.results.load(f'/quizzes/{quiz_id}/questions/')
 
     def update_question(self, instance):
         question_id = 1  # Replace with actual question ID input or handling
+        quiz_id = self.quiz_id_input.text.strip()
+        if not quiz_id.isdigit():
+            Logger.error("QuizApp: enter the question's numeric quiz ID")
+            return
         question_text = self.question_text_input.text
-        option_a = self.option_a_input.text
-        option_b = self.option_b_input.text
-        option_c = self.option_c_input.text
-        option_d = self.option_d_input.text
         correct_answer = self.correct_answer_input.text
         
-        response = requests.put(
-            f'{BASE_URL}/questions/{question_id}',
-            json={
+        self.call('PUT', f'/questions/{question_id}', json={
+                'quiz_id': int(quiz_id),
                 'question_text': question_text,
-                'option_a': option_a,
-                'option_b': option_b,
-                'option_c': option_c,
-                'option_d': option_d,
+                'choices': self.choices(),
                 'correct_answer': correct_answer
-            }
-        )
-        print(response.json())
+            })
 
     def delete_question(self, instance):
         question_id = 1  # Replace with actual question ID input or handling
-        response = requests.delete(f'{BASE_URL}/questions/{question_id}')
-        print(response.json())
+        self.call('DELETE', f'/questions/{question_id}')
 
     def goto_home(self, instance):
         screen_manager.current = 'home'
@@ -412,7 +464,13 @@ class QuizApp(App):
         screen_manager.add_widget(CategoriesScreen(name='categories'))
         screen_manager.add_widget(LevelsScreen(name='levels'))
         screen_manager.add_widget(TopicsScreen(name='topics'))
+        attempt_sync.start()
         return screen_manager
 
+    def on_stop(self):
+        attempt_sync.stop()
+        api.shutdown()
+        store.close()
+
 if __name__ == '__main__':
     QuizApp().run()
@@ -0,0 +1,248 @@
+import json
+import random
+import sqlite3
+import time
+import uuid
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+# Local SQLite store that keeps the app usable without the backend.
+#
+# Quizzes and their questions are cached as they are downloaded, so a quiz
+# can be taken offline. Attempts are written here first, committed before
+# the user is told they were recorded, and sent to the backend later in
+# batches by AttemptSync; each carries a client token, so a batch that is
+# sent twice (the response was lost, the app was restarted) is stored once.
+#
+# All access happens on the Kivy main thread: ApiClient delivers responses
+# there, so the store needs no locking.
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS quizzes (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            cached_at REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY,
+            quiz_id INTEGER NOT NULL,
+            question_text TEXT NOT NULL,
+            choices TEXT NOT NULL,           -- JSON array of strings
+            correct_answer INTEGER)''',
+    "CREATE INDEX IF NOT EXISTS idx_questions_quiz_id ON questions (quiz_id, id)",
+    # status: pending until the backend has stored it, then synced; rejected
+    # when the backend refused it for good
+    '''CREATE TABLE IF NOT EXISTS attempts (
+            client_token TEXT PRIMARY KEY,
+            quiz_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            answers TEXT NOT NULL,           -- JSON array of choice indexes, null when skipped
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at REAL NOT NULL,
+            tries INTEGER NOT NULL DEFAULT 0,
+            attempt_id INTEGER,
+            score INTEGER,
+            error TEXT)''',
+    "CREATE INDEX IF NOT EXISTS idx_attempts_status ON attempts (status, created_at)",
+)
+
+
+# Stores written before choices and answers were kept as JSON hold comma-
+# separated text; the backend still accepts that form, so it is passed on as is
+def _load_json(text):
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    return value if isinstance(value, list) else text
+
+
+class LocalStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        # Queued attempts must survive a crash or power loss
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = FULL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    # Cache a GET /quizzes/{id}/full document, replacing the quiz's old questions
+    def cache_quiz(self, quiz):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO quizzes (id, title, description, cached_at) VALUES (?, ?, ?, ?)",
+                (quiz['id'], quiz['title'], quiz.get('description'), time.time())
+            )
+            self.connection.execute("DELETE FROM questions WHERE quiz_id = ?", (quiz['id'],))
+            self.connection.executemany(
+                "INSERT INTO questions (id, quiz_id, question_text, choices, correct_answer) VALUES (?, ?, ?, ?, ?)",
+                [(q['id'], q['quiz_id'], q['question_text'], json.dumps(q['choices']), q.get('correct_answer'))
+                 for q in quiz.get('questions', ())]
+            )
+
+    def quiz(self, quiz_id):
+        row = self.connection.execute("SELECT id, title, description FROM quizzes WHERE id = ?", (quiz_id,)).fetchone()
+        if row is None:
+            return None
+        questions = self.connection.execute(
+            "SELECT id, quiz_id, question_text, choices, correct_answer FROM questions WHERE quiz_id = ? ORDER BY id",
+            (quiz_id,)
+        ).fetchall()
+        return {"id": row[0], "title": row[1], "description": row[2],
+                "questions": [{"id": question_id, "quiz_id": quiz_id, "question_text": text,
+                               "choices": _load_json(choices), "correct_answer": correct_answer}
+                              for question_id, quiz_id, text, choices, correct_answer in questions]}
+
+    # Queue an attempt for the backend; `answers` is a list of choice indexes,
+    # None for a skipped question. Returns its client token.
+    def add_attempt(self, quiz_id, user_id, answers):
+        client_token = uuid.uuid4().hex
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO attempts (client_token, quiz_id, user_id, answers, created_at) VALUES (?, ?, ?, ?, ?)",
+                (client_token, quiz_id, user_id, json.dumps(answers), time.time())
+            )
+        return client_token
+
+    # Oldest pending attempts, in the shape POST /attempts/batch takes
+    def pending_attempts(self, limit):
+        rows = self.connection.execute(
+            "SELECT client_token, quiz_id, user_id, answers FROM attempts WHERE status = 'pending' ORDER BY created_at LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [{"client_token": token, "quiz_id": quiz_id, "user_id": user_id, "answers": _load_json(answers)}
+                for token, quiz_id, user_id, answers in rows]
+
+    def record_results(self, results):
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE attempts SET status = 'synced', attempt_id = ?, score = ?, error = NULL WHERE client_token = ?",
+                [(result['id'], result['score'], result['client_token']) for result in results if result.get('error') is None]
+            )
+            self.connection.executemany(
+                "UPDATE attempts SET status = 'rejected', error = ? WHERE client_token = ?",
+                [(result['error'], result['client_token']) for result in results
+                 if result.get('error') is not None and result.get('retry_after') is None]
+            )
+            # Refused for now (rate limited): stays pending for a later batch
+            self.connection.executemany(
+                "UPDATE attempts SET tries = tries + 1, error = ? WHERE client_token = ?",
+                [(result['error'], result['client_token']) for result in results if result.get('retry_after') is not None]
+            )
+
+    def record_failure(self, client_tokens, error, reject=False):
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE attempts SET tries = tries + 1, error = ?, status = ? WHERE client_token = ?",
+                [(error, 'rejected' if reject else 'pending', token) for token in client_tokens]
+            )
+
+    def attempt_counts(self):
+        return dict(self.connection.execute("SELECT status, count(*) FROM attempts GROUP BY status").fetchall())
+
+
+class AttemptSync:
+    # Sends pending attempts to POST /attempts/batch, `batch_size` at a time,
+    # on the Kivy clock. After a failure (no connection, timeout, 5xx, 429)
+    # the next try waits base_delay * 2^failures seconds, capped at max_delay,
+    # with full jitter so a room of clients that lost the network together does
+    # not reconnect together; a Retry-After header is honoured. Batches keep
+    # going back to back while attempts are pending, and a check runs every
+    # `interval` seconds. A batch the backend refuses as a whole with a 4xx
+    # is sent again in halves, so only an attempt refused on its own is
+    # rejected for good.
+
+    def __init__(self, api, store, batch_size=100, interval=5.0, base_delay=1.0, max_delay=300.0):
+        self.api = api
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.next_try = 0.0
+        self._limit = batch_size   # below batch_size while a refused batch is split
+        self._in_flight = None
+        self._event = None
+        self.on_change = None   # called after every batch, e.g. to refresh a status label
+
+    def start(self):
+        if self._event is None:
+            self._event = Clock.schedule_interval(lambda dt: self.flush(), self.interval)
+        self.flush()
+
+    def stop(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+        if self._in_flight is not None:
+            self._in_flight.cancel()
+            self._in_flight = None
+
+    # Send the next batch now unless one is in flight or a backoff is running
+    def flush(self):
+        if self._in_flight is not None and not self._in_flight.cancelled:
+            return
+        if time.monotonic() < self.next_try:
+            return
+        batch = self.store.pending_attempts(self._limit)
+        if not batch:
+            return
+        tokens = [attempt['client_token'] for attempt in batch]
+        self._in_flight = self.api.post(
+            '/attempts/batch', json={'attempts': batch},
+            on_success=self._on_success, on_error=lambda error: self._on_error(tokens, error),
+        )
+
+    def _on_success(self, response):
+        self._in_flight = None
+        self.failures = 0
+        self._limit = self.batch_size
+        results = response.json()['results']
+        self.store.record_results(results)
+        self._changed()
+        # Attempts over their user's rate limit are sent again once it allows
+        delay = max((result.get('retry_after') or 0 for result in results), default=0)
+        self.next_try = time.monotonic() + delay if delay else 0.0
+        Clock.schedule_once(lambda dt: self.flush(), delay)
+
+    def _on_error(self, tokens, error):
+        self._in_flight = None
+        response = getattr(error, 'response', None)
+        status = response.status_code if response is not None else None
+        detail = response.text if response is not None else str(error)
+        # A 4xx other than 408/429 will fail the same way every time, but for a
+        # batch it does not say which attempt is at fault; a 413 means the
+        # batch is larger than the backend takes, so later ones are smaller too
+        if status is not None and 400 <= status < 500 and status not in (408, 429):
+            if len(tokens) > 1:
+                self._limit = len(tokens) // 2
+                if status == 413:
+                    self.batch_size = self._limit
+                Logger.warning(f"AttemptSync: batch of {len(tokens)} refused ({status}), sending {self._limit} at a time")
+            else:
+                Logger.error(f"AttemptSync: attempt rejected ({status}): {detail}")
+                self.store.record_failure(tokens, detail, reject=True)
+                self._limit = self.batch_size
+            self._changed()
+            Clock.schedule_once(lambda dt: self.flush())
+            return
+        self.store.record_failure(tokens, detail)
+        self.failures += 1
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** self.failures))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        self.next_try = time.monotonic() + delay
+        Logger.warning(f"AttemptSync: batch failed ({status or type(error).__name__}), retrying in {delay:.1f}s")
+        self._changed()
+        Clock.schedule_once(lambda dt: self.flush(), delay)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
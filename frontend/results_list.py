@@ -0,0 +1,210 @@
+from kivy.clock import Clock
+from kivy.logger import Logger
+from kivy.metrics import dp
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.spinner import Spinner
+from kivy.uix.textinput import TextInput
+
+# Scrollable, paged result lists for the list endpoints.
+#
+# Rows are shown by a RecycleView: only the rows in view (plus a small
+# margin) have widgets, and those widgets are reused as the list scrolls, so
+# a list of 100k rows costs the same widgets and frame time as one of 50.
+# Every row has the same fixed height, so the layout never measures text.
+#
+# Pages are fetched on demand: when the user scrolls to within a screen of
+# the end of what is loaded, the next page is requested with the token from
+# the previous response's X-Next-Page-Token header. Sorting and filtering work
+# on the rows loaded so far, without another request.
+
+NEXT_PAGE_HEADER = 'X-Next-Page-Token'
+
+ROW_HEIGHT = dp(28)
+
+
+# List values (question choices, attempt answers) are shown comma-separated
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ', '.join('' if item is None else str(item) for item in value)
+    return str(value)
+
+
+class ResultRow(RecycleDataViewBehavior, Label):
+    def __init__(self, **kwargs):
+        super().__init__(halign='left', valign='middle', shorten=True, shorten_from='right', **kwargs)
+        self.bind(size=self._fit_text)
+
+    def _fit_text(self, instance, size):
+        self.text_size = (size[0] - dp(8), size[1])
+
+
+class ResultsView(RecycleView):
+    # Calls on_near_end() whenever less than one screen of rows is left below
+    # the viewport
+
+    def __init__(self, on_near_end, **kwargs):
+        super().__init__(**kwargs)
+        self.on_near_end = on_near_end
+        self.viewclass = ResultRow
+        layout = RecycleBoxLayout(orientation='vertical', size_hint_y=None,
+                                  default_size=(None, ROW_HEIGHT), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+        self.layout = layout
+        self.bind(scroll_y=self.check_end, height=self.check_end)
+        layout.bind(height=self.check_end)
+
+    def check_end(self, *args):
+        # scroll_y is 1 at the top and 0 at the bottom
+        hidden_below = max(self.layout.height - self.height, 0) * self.scroll_y
+        if hidden_below <= self.height:
+            self.on_near_end()
+
+
+class ResultsList(BoxLayout):
+    # `request(method, path, on_success, on_error, **kwargs)` sends a call
+    # (ApiScreen.call) and returns its ApiCall. `columns` are the row fields
+    # shown, in order; they are also the sort keys.
+
+    def __init__(self, request, columns, page_size=200, **kwargs):
+        super().__init__(orientation='vertical', spacing=dp(4), **kwargs)
+        self.request = request
+        self.columns = columns
+        self.page_size = page_size
+        self.path = None
+        self.rows = []              # every row loaded, in server order
+        self.visible = []           # indexes into rows, after filter and sort
+        self.next_token = None
+        self.exhausted = True
+        self._pending = None
+        self._search_text = []      # lower-cased row text for filtering, built on demand
+
+        controls = BoxLayout(orientation='horizontal', size_hint_y=None, height=ROW_HEIGHT + dp(8), spacing=dp(4))
+        self.filter_input = TextInput(hint_text='Filter loaded rows', multiline=False, size_hint_x=0.5)
+        self.sort_spinner = Spinner(text='Sort: server order', values=('server order',) + tuple(columns), size_hint_x=0.3)
+        self.order_button = Button(text='Asc', size_hint_x=0.2)
+        controls.add_widget(self.filter_input)
+        controls.add_widget(self.sort_spinner)
+        controls.add_widget(self.order_button)
+        self.status_label = Label(text='', size_hint_y=None, height=ROW_HEIGHT)
+        self.view = ResultsView(self._load_more)
+
+        self.add_widget(controls)
+        self.add_widget(self.status_label)
+        self.add_widget(self.view)
+
+        # Typing and page arrivals are coalesced into one rebuild per frame
+        self._refilter = Clock.create_trigger(self._apply_view, 0.25)
+        self._rebuild = Clock.create_trigger(self._apply_view)
+        self.filter_input.bind(text=lambda *args: self._refilter())
+        self.sort_spinner.bind(text=self._on_sort)
+        self.order_button.bind(on_press=self._toggle_order)
+
+    @property
+    def sort_column(self):
+        column = self.sort_spinner.text[len('Sort: '):]
+        return column if column in self.columns else None
+
+    @property
+    def descending(self):
+        return self.order_button.text == 'Desc'
+
+    # Start over with the first page of `path`
+    def load(self, path):
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        self.path = path
+        self.rows = []
+        self._search_text = []
+        self.visible = []
+        self.view.data = []
+        self.view.scroll_y = 1
+        self.next_token = None
+        self.exhausted = False
+        self._load_more()
+
+    def _load_more(self):
+        if self.exhausted or self.path is None:
+            return
+        if self._pending is not None and not self._pending.cancelled:
+            return
+        params = {'limit': self.page_size}
+        if self.next_token:
+            params['page_token'] = self.next_token
+        self._update_status('Loading ...')
+        self._pending = self.request('GET', self.path, on_success=self._on_page, on_error=self._on_error, params=params)
+
+    def _on_page(self, response):
+        self._pending = None
+        page = response.json()
+        self.next_token = response.headers.get(NEXT_PAGE_HEADER)
+        self.exhausted = not self.next_token or not page
+        start = len(self.rows)
+        self.rows.extend(page)
+        if self._filtering() or self.sort_column is not None:
+            self._rebuild()
+        else:
+            # Unfiltered, unsorted: append the page's rows to the view as they are
+            indexes = range(start, len(self.rows))
+            self.visible.extend(indexes)
+            self.view.data.extend({'text': self._row_text(self.rows[index])} for index in indexes)
+            self._update_status()
+        # A short page may leave the list shorter than the screen; keep filling it
+        Clock.schedule_once(self.view.check_end)
+
+    def _on_error(self, error):
+        self._pending = None
+        response = getattr(error, 'response', None)
+        detail = response.text if response is not None else str(error)
+        Logger.error(f"ResultsList: loading {self.path} failed: {detail}")
+        self._update_status(f"Loading failed ({response.status_code if response is not None else 'no connection'}); scroll to retry")
+
+    def _row_text(self, row):
+        return '  |  '.join(_cell_text(row.get(column)) for column in self.columns)
+
+    def _filtering(self):
+        return bool(self.filter_input.text.strip())
+
+    def _on_sort(self, spinner, text):
+        if not text.startswith('Sort: '):
+            spinner.text = f'Sort: {text}'
+            return
+        self._rebuild()
+
+    def _toggle_order(self, instance):
+        self.order_button.text = 'Asc' if self.descending else 'Desc'
+        self._rebuild()
+
+    # Recompute the visible rows from everything loaded: filter on the row
+    # text, then a stable sort on the chosen column (None sorts last)
+    def _apply_view(self, *args):
+        rows = self.rows
+        indexes = range(len(rows))
+        needle = self.filter_input.text.strip().lower()
+        if needle:
+            search_text = self._search_text
+            search_text.extend(self._row_text(row).lower() for row in rows[len(search_text):])
+            indexes = [index for index in indexes if needle in search_text[index]]
+        column = self.sort_column
+        if column is not None:
+            present = [index for index in indexes if rows[index].get(column) is not None]
+            missing = [index for index in indexes if rows[index].get(column) is None]
+            present.sort(key=lambda index: rows[index][column], reverse=self.descending)
+            indexes = present + missing
+        self.visible = list(indexes)
+        self.view.data = [{'text': self._row_text(rows[index])} for index in self.visible]
+        self._update_status()
+
+    def _update_status(self, text=None):
+        if text is None:
+            more = '' if self.exhausted else ', scroll for more'
+            text = f"{len(self.visible)} of {len(self.rows)} loaded rows shown{more}"
+        self.status_label.text = text